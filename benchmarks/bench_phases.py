@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Measure the time and peak memory of each phase of the tree diff (PHASE 1
+`diff_subtree`, PHASE 2 `detect_moves`, PHASE 3 `simplify_diff`, and PHASE 4
+`restructure_diff`) on synthetic trees (see `treediffer.synthetic`) of several sizes under several
+change profiles, for example:
+
+    python benchmarks/bench_phases.py --sizes 1000,10000,100000 --output results.json
+
+Reports the time per node in microseconds (best of `--repeat` runs) and the
+peak memory allocated during each phase (measured in a separate run, tracing
+the allocations of each phase with `tracemalloc`). The results are saved as a JSON list of records, one for each
+size, profile, and phase, so runs can be compared to find regressions.
+"""
+import argparse
+import gc
+import json
+import platform
+import time
+import tracemalloc
+
+from treediffer.plans import get_plan
+from treediffer.synthetic import TreeGenerator
+from treediffer.treediffs import detect_moves, diff_subtree, restructure_diff, simplify_diff
+
+
+PHASES = ['diff_subtree', 'detect_moves', 'simplify_diff', 'restructure_diff']
+PROFILES = ['few_edits', 'mass_moves', 'big_deletions', 'exercise_heavy']
+
+
+# CHANGE PROFILES
+################################################################################
+
+def profile_changes(num_nodes, profile):
+    """
+    Returns the exercise ratio and the changes (see `TreeMutation`) of `profile`.
+    """
+    if profile == 'few_edits':
+        # 0.1% of the nodes renamed, a few subtrees cloned and deleted
+        few = max(1, num_nodes // 10000)
+        return 0.2, dict(renames=max(1, num_nodes // 1000), clones=few, deletions=few)
+    elif profile == 'mass_moves':
+        # 10% of the nodes moved to another topic
+        return 0.2, dict(moves=num_nodes // 10)
+    elif profile == 'big_deletions':
+        # 30% of the top-level topics deleted
+        return 0.2, dict(deletions=3, deletion_depth=1)
+    elif profile == 'exercise_heavy':
+        # one question edited in 5% of the nodes, mostly exercises
+        return 0.8, dict(question_edits=num_nodes // 20)
+    raise ValueError('Unknown change profile ' + profile)
+
+
+# PHASES
+################################################################################
+
+def run_phases(treeA, treeB, plan, clock):
+    """
+    Run the four phases of the diff and return the dict of the measurement
+    returned by `clock(func)` for each phase, and the raw diff.
+    """
+    measures = {}
+    raw_diff, measures['diff_subtree'] = clock(
+        lambda: diff_subtree(None, treeA, None, treeB, root=True, plan=plan))
+    nodes_moved, measures['detect_moves'] = clock(
+        lambda: detect_moves(raw_diff['nodes_deleted'], raw_diff['nodes_added']))
+    raw_diff['nodes_moved'] = nodes_moved
+    simplified_diff, measures['simplify_diff'] = clock(
+        lambda: simplify_diff(raw_diff))
+    _, measures['restructure_diff'] = clock(
+        lambda: restructure_diff(simplified_diff, treeA, treeB, mapA=plan.mapA, mapB=plan.mapB))
+    return measures, raw_diff
+
+
+def time_call(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def trace_call(func):
+    # trace only the allocations of `func` (tracemalloc.reset_peak needs Python 3.9)
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench(num_nodes, profile, repeat, memory, preset=None, seed=42):
+    exercises, changes = profile_changes(num_nodes, profile)
+    generator = TreeGenerator(num_nodes, preset=preset, seed=seed, exercises=exercises)
+    treeA = generator.build()
+    treeB = generator.mutate(seed=seed, **changes).build()
+    plan = get_plan(preset=preset)
+
+    best = dict((phase, None) for phase in PHASES)
+    for _ in range(repeat):
+        gc.collect()
+        measures, raw_diff = run_phases(treeA, treeB, plan, time_call)
+        for phase, elapsed in measures.items():
+            best[phase] = elapsed if best[phase] is None else min(best[phase], elapsed)
+    peaks = dict((phase, None) for phase in PHASES)
+    if memory:
+        gc.collect()
+        peaks, _ = run_phases(treeA, treeB, plan, trace_call)
+
+    counts = dict((key, len(raw_diff[key])) for key in
+                  ['nodes_deleted', 'nodes_added', 'nodes_moved', 'nodes_modified'])
+    return [
+        {
+            'nodes': num_nodes,
+            'preset': preset,
+            'profile': profile,
+            'phase': phase,
+            'seconds': best[phase],
+            'us_per_node': 1e6 * best[phase] / num_nodes,
+            'peak_bytes': peaks[phase],
+            'counts': counts,
+        }
+        for phase in PHASES
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory of each phase of the tree diff.')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma-separated tree sizes (number of nodes), up to 1000000')
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help='comma-separated change profiles: ' + ', '.join(PROFILES))
+    parser.add_argument('--preset', help='generate trees in the format of this diff preset')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', help='path of the JSON file to save the results')
+    args = parser.parse_args()
+
+    results = []
+    print('{:>8} {:>15} {:>17} {:>10} {:>10} {:>10}'.format(
+        'nodes', 'profile', 'phase', 'ms', 'us/node', 'peak MB'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for profile in args.profiles.split(','):
+            for record in bench(size, profile, args.repeat, not args.no_memory, preset=args.preset):
+                results.append(record)
+                peak = record['peak_bytes']
+                print('{:>8} {:>15} {:>17} {:>10.1f} {:>10.2f} {:>10}'.format(
+                    record['nodes'], profile, record['phase'], 1e3 * record['seconds'],
+                    record['us_per_node'], '-' if peak is None else '{:.1f}'.format(peak / 1e6)))
+
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump({'python': platform.python_version(), 'results': results}, outfile, indent=2)
+        print('Saved results to ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+Measure the per-node overhead of the tree diff traversal (PHASE 1) on a large
+balanced tree and on a very deep tree (a chain of topics), for example:
+
+    python benchmarks/bench_traversal.py --width 8 --depth 5 --chain 20000
+
+Reports the time per node visited in microseconds (best of `--repeat` runs).
+"""
+import argparse
+import copy
+import time
+
+from treediffer.treediffs import diff_subtree
+
+
+def make_balanced_tree(width, depth, prefix='n'):
+    node = {
+        'node_id': prefix,
+        'content_id': prefix + '_cid',
+        'title': 'Node ' + prefix,
+        'description': 'Description of node ' + prefix,
+        'language': 'en',
+        'tags': ['tag1', 'tag2'],
+    }
+    if depth > 0:
+        node['children'] = [make_balanced_tree(width, depth - 1, prefix + '_' + str(i)) for i in range(width)]
+    return node
+
+
+def make_chain_tree(length):
+    root = make_balanced_tree(0, 0, 'c')
+    node = root
+    for i in range(length):
+        child = make_balanced_tree(0, 0, 'c' + str(i))
+        node['children'] = [child]
+        node = child
+    return root
+
+
+def count_nodes(tree):
+    count, stack = 0, [tree]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.get('children', []))
+    return count
+
+
+def time_diff(treeA, treeB, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        diff_subtree(None, treeA, None, treeB, root=True)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Per-node overhead of the diff traversal.')
+    parser.add_argument('--width', type=int, default=8, help='children per topic in balanced tree')
+    parser.add_argument('--depth', type=int, default=5, help='depth of balanced tree')
+    parser.add_argument('--chain', type=int, default=20000, help='depth of chain tree')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs')
+    args = parser.parse_args()
+
+    treeA = make_balanced_tree(args.width, args.depth)
+    treeB = copy.deepcopy(treeA)
+    num_nodes = count_nodes(treeA)
+    elapsed = time_diff(treeA, treeB, args.repeat)
+    print('balanced tree: {} nodes, {:.2f} us/node'.format(num_nodes, 1e6 * elapsed / num_nodes))
+
+    treeA = make_chain_tree(args.chain)
+    treeB = make_chain_tree(args.chain)
+    num_nodes = count_nodes(treeA)
+    try:
+        elapsed = time_diff(treeA, treeB, args.repeat)
+        print('chain tree: {} nodes, {:.2f} us/node'.format(num_nodes, 1e6 * elapsed / num_nodes))
+    except RecursionError:
+        print('chain tree: {} nodes, RecursionError'.format(num_nodes))
+
+
+if __name__ == '__main__':
+    main()
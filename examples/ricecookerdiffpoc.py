@@ -20,6 +20,7 @@ import os
 import subprocess
 from treediffer import treediff
 from treediffer.diffutils import print_diff
+from treediffer.loaders import load_tree
 import pprint
 import requests
 
@@ -45,9 +46,9 @@ def ensure_filename_exists(filename):
 
 def get_trees():
     pathA = ensure_filename_exists(OLD_TREE_FILENAME)
-    treeA = json.load(open(pathA))
+    treeA = load_tree(pathA, preset="ricecooker").root
     pathB = ensure_filename_exists(NEW_TREE_FILENAME)
-    treeB = json.load(open(pathB))
+    treeB = load_tree(pathB, preset="ricecooker").root
     return treeA, treeB
 
 
@@ -65,17 +66,13 @@ if __name__ == '__main__':
     with open(diff_filename, 'w') as jsonf:
          json.dump(diff, jsonf, indent=2, ensure_ascii=False)
 
-    nodes_deleted = diff['nodes_deleted']
-    nodes_added = diff['nodes_added']
-    nodes_moved = diff['nodes_moved']
-    nodes_modified = diff['nodes_modified']
-
+    summary = treediff(treeA, treeB, preset="ricecooker", format="summary")
     print('SUMMARY:')
     print('#'*80)
-    print('nodes_added:', len(nodes_added))
-    print('nodes_deleted:', len(nodes_deleted))
-    print('nodes_moved:', len(nodes_moved))
-    print('nodes_modified:', len(nodes_modified))
+    print('nodes_added:', summary['nodes_added']['count'], summary['nodes_added']['by_kind'])
+    print('nodes_deleted:', summary['nodes_deleted']['count'], summary['nodes_deleted']['by_kind'])
+    print('nodes_moved:', summary['nodes_moved']['count'], summary['nodes_moved']['by_kind'])
+    print('nodes_modified:', summary['nodes_modified']['count'], summary['nodes_modified']['by_attribute'])
 
     print('\nRESTRUCTUREDDIFF:')
     print('#'*80)
@@ -19,6 +19,8 @@ then run
 
 to generate the detailed tree diff to the file `khan_academy_tree_diff_fr.json`
 and print the diff including nodes deleted, added, moved, and modified.
+Pass several language codes (e.g. `--lang fr es pt-BR`) to compute the diffs of
+all the languages in parallel.
 """
 
 import argparse
@@ -29,6 +31,7 @@ import json
 import os
 import subprocess
 from treediffer import treediff
+from treediffer.batch import treediff_many
 from treediffer.diffutils import print_diff
 import pprint
 
@@ -69,48 +72,46 @@ def de_ariclefy(subtree):
         subtree['children'] = new_children
 
 
-if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='KA topic tree differ')
-    parser.add_argument('--lang', required=True, help="language code")
-    args = parser.parse_args()
-
-    treeA, treeB = get_trees(args.lang)
+def get_preprocessed_trees(lang):
+    treeA, treeB = get_trees(lang)
     print('loaded old tree with ', len(treeA), 'level 1 topics (KA domains)')
     print('loaded new tree with ', len(treeB), 'level 1 topics (KA domains)')
-
-
     listify_assessment_items(treeA)
     de_ariclefy(treeA)
     de_ariclefy(treeB)
+    return treeA, treeB
 
-    khan_api_json_exclude_attrs = [
-        'download_urls',
-        'listed',
-        'license',  # or map manually ...
-        'source_url',
-        'thumbnail',
-        # 'youtube_id',
-    ]
-
-    khan_api_json_map = {
-        "root.node_id": "id",
-        "root.content_id": "slug",
-        "node_id": "id",
-        "content_id": "slug",
-    }
-
-    diff = treediff(treeA, treeB,
-            format="restructured",
-            sort_order_changes=False,
-            attrs=None,
-            exclude_attrs=khan_api_json_exclude_attrs,
-            mapA=khan_api_json_map.copy(),
-            mapB=khan_api_json_map.copy(),
-            assessment_items_key=None,
-            setlike_attrs=['tags', 'assessment_items'],
-    )
 
-    diff_filename = 'khan_academy_tree_diff_' + args.lang + '.json'
+khan_api_json_exclude_attrs = [
+    'download_urls',
+    'listed',
+    'license',  # or map manually ...
+    'source_url',
+    'thumbnail',
+    # 'youtube_id',
+]
+
+khan_api_json_map = {
+    "root.node_id": "id",
+    "root.content_id": "slug",
+    "node_id": "id",
+    "content_id": "slug",
+}
+
+khan_api_diff_kwargs = dict(
+    format="restructured",
+    sort_order_changes=False,
+    attrs=None,
+    exclude_attrs=khan_api_json_exclude_attrs,
+    mapA=khan_api_json_map.copy(),
+    mapB=khan_api_json_map.copy(),
+    assessment_items_key=None,
+    setlike_attrs=['tags', 'assessment_items'],
+)
+
+
+def print_lang_diff(lang, diff):
+    diff_filename = 'khan_academy_tree_diff_' + lang + '.json'
     with open(diff_filename, 'w') as jsonf:
         json.dump(diff, jsonf, indent=2, ensure_ascii=False)
 
@@ -137,3 +138,26 @@ if __name__ == '__main__':
         attrs=['title', 'kind'],
         ids=['node_id', 'parent_id']
     )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='KA topic tree differ')
+    parser.add_argument('--lang', required=True, nargs='+', help="language code(s)")
+    args = parser.parse_args()
+
+    if len(args.lang) == 1:
+        lang = args.lang[0]
+        treeA, treeB = get_preprocessed_trees(lang)
+        diff = treediff(treeA, treeB, **khan_api_diff_kwargs)
+        print_lang_diff(lang, diff)
+    else:
+        # trees are loaded one language at a time as the workers become free
+        pairs = (get_preprocessed_trees(lang) for lang in args.lang)
+        for result in treediff_many(pairs, **khan_api_diff_kwargs):
+            lang = args.lang[result.index]
+            if result.error:
+                print('Diff for lang', lang, 'failed after', result.seconds, 'seconds:')
+                print(result.error)
+                continue
+            print('Diff for lang', lang, 'took', round(result.seconds, 1), 'seconds')
+            print_lang_diff(lang, result.diff)
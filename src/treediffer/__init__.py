@@ -2,5 +2,13 @@ __version__ = '0.0.1'
 
 
 # PUBLIC API
-from .treediffs import treediff
+from .treediffs import treediff, treediff_files
+from .streaming import iter_treediff
+from .parallel import treediff_parallel
+from .batch import treediff_many
+from .prepared import prepare_tree
+from .incremental import IncrementalDiffer
+from .patching import apply_diff
+from .composition import compose_diffs
+from .stats import DiffStats
 from .diffutils import print_diff
\ No newline at end of file
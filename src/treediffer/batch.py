@@ -0,0 +1,115 @@
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
+import time
+import traceback
+
+from .loaders import load_tree
+from .plans import LL_DEFAULTS
+from .treediffs import treediff
+
+
+# BATCH DIFFS
+################################################################################
+# The `treediff_many` generator computes the diffs of many independent pairs of
+# trees (e.g. all the language versions of a channel) using a pool of worker
+# processes. At most `max_pending` jobs are submitted to the pool at a time, so
+# the `pairs` can be a generator that loads the trees as needed, and the results
+# are yielded as soon as each job is done. A job that fails is reported in its
+# `JobResult` and does not stop the other jobs. The worker processes are reused
+# for many jobs, so the compiled diff plans (see `get_plan`) are shared by all
+# the jobs that use the same preset in the same worker.
+
+class JobResult(namedtuple('JobResult', ['index', 'diff', 'error', 'seconds'])):
+    """
+    The result of the job at position `index` in the `pairs` given to `treediff_many`:
+    the `diff` (None if the job failed), the `error` traceback (None if successful),
+    and the number of `seconds` the job took (including loading the trees).
+    """
+    __slots__ = ()
+
+
+def treediff_many(pairs, workers=None, max_pending=None, **kwargs):
+    """
+    Compute the diffs of the `pairs` of trees using `workers` processes (defaults
+    to the number of CPUs). Each pair is a tuple (treeA, treeB) or (treeA, treeB,
+    options) where the trees are tree dicts or paths to JSON tree files, and the
+    `options` dict contains the `treediff` kwargs for this pair (which override
+    the common `kwargs`). Yields a `JobResult` for each pair in the order they
+    finish. Use `workers=1` to run the jobs one by one in the current process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if max_pending is None:
+        max_pending = 2 * workers
+    jobs = (_make_job(index, pair, kwargs) for index, pair in enumerate(pairs))
+    if workers <= 1:
+        for job in jobs:
+            yield job if isinstance(job, JobResult) else _run_job(job)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}  # future --> job index
+        for job in jobs:
+            if isinstance(job, JobResult):
+                yield job   # invalid pair
+                continue
+            while len(pending) >= max_pending:
+                for result in _wait_for_results(pending):
+                    yield result
+            pending[executor.submit(_run_job, job)] = job[0]
+        while pending:
+            for result in _wait_for_results(pending):
+                yield result
+
+
+def _make_job(index, pair, kwargs):
+    """
+    Return the job tuple for `pair`, or a failed `JobResult` if `pair` is invalid.
+    """
+    try:
+        if len(pair) not in (2, 3):
+            raise ValueError('Expected (treeA, treeB) or (treeA, treeB, options) but got ' + repr(pair))
+        options = dict(kwargs)
+        if len(pair) == 3:
+            options.update(pair[2])
+    except Exception:
+        return JobResult(index, None, traceback.format_exc(), None)
+    return (index, pair[0], pair[1], options)
+
+
+def _wait_for_results(pending):
+    """
+    Wait until at least one of the `pending` futures is done and return the
+    results of the finished jobs (removing them from `pending`).
+    """
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    results = []
+    for future in done:
+        index = pending.pop(future)
+        try:
+            results.append(future.result())
+        except Exception:
+            # the job could not be sent to or run by the worker process
+            results.append(JobResult(index, None, traceback.format_exc(), None))
+    return results
+
+
+def _run_job(job):
+    """
+    Load the trees (if given as paths) and compute their diff.
+    """
+    index, treeA, treeB, options = job
+    start = time.time()
+    try:
+        if isinstance(treeA, str) or isinstance(treeB, str):
+            load_kwargs = dict((key, val) for key, val in options.items() if key in LL_DEFAULTS)
+            preset = options.get('preset', None)
+            if isinstance(treeA, str):
+                treeA = load_tree(treeA, preset=preset, side="A", **load_kwargs)
+            if isinstance(treeB, str):
+                treeB = load_tree(treeB, preset=preset, side="B", **load_kwargs)
+        diff = treediff(treeA, treeB, **options)
+        return JobResult(index, diff, None, time.time() - start)
+    except Exception:
+        return JobResult(index, None, traceback.format_exc(), time.time() - start)
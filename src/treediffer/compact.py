@@ -0,0 +1,290 @@
+from array import array
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+import pickle
+import sys
+import zlib
+
+from .hashing import node_fingerprint
+from .plans import get_plan
+
+
+# COMPACT TREES
+################################################################################
+# A `CompactTree` stores a tree in a few flat arrays indexed by the pre-order
+# position of each node instead of a nested structure of dicts:
+#   - `node_ids` and `content_ids`: lists of (interned) id strings
+#   - `parents`, `first_children`, `next_siblings`: int arrays (-1 for none)
+#   - `sort_orders`: double array + `sort_order_types` (missing/float/int/other)
+#   - `fingerprints`: 20-byte sha1 digest of the diff-relevant info of each node
+#   - payloads: all the other node attributes, pickled and zlib-compressed in
+#     blocks of `BLOCK_SIZE` nodes, which are only decompressed when needed.
+# The nodes are accessed using `CompactNode` views that behave like (read-only)
+# node dicts, so all the diff functions work on compact trees without changes.
+# When both trees are compact, the diff compares the node fingerprints first and
+# only loads the attributes of nodes that have changed.
+
+BLOCK_SIZE = 64             # nodes per compressed payload block
+CACHED_BLOCKS = 32          # number of decompressed payload blocks to keep
+
+NO_NODE = -1
+SORT_ORDER_MISSING, SORT_ORDER_FLOAT, SORT_ORDER_INT, SORT_ORDER_OTHER = 0, 1, 2, 3
+HAS_CHILDREN_KEY = 1        # flag for nodes with a `children` key (maybe empty)
+
+_MISSING = object()     # marks missing values in the arrays
+_ABSENT = object()      # default value used to check if a key exists
+
+
+def _intern(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+
+class CompactTree(object):
+    """
+    Compact, read-only representation of a tree. Use `CompactTree.from_tree` to
+    convert a tree dict, and `root` to get the root node view.
+    """
+
+    def __init__(self, plan, side="A"):
+        self.plan_key = plan.key
+        self.side_key = plan.side_key(side)
+        amap = plan.mapA if side == "A" else plan.mapB
+        self.node_id_key = amap.get('node_id', 'node_id')
+        self.content_id_key = amap.get('content_id', 'content_id')
+        self.sort_order_key = amap.get('sort_order', 'sort_order')
+        self.node_ids = []
+        self.content_ids = []
+        self.parents = array('l')
+        self.first_children = array('l')
+        self.next_siblings = array('l')
+        self.sort_orders = array('d')
+        self.sort_order_types = bytearray()
+        self.flags = bytearray()
+        self.fingerprints = bytearray()
+        self.blocks = []                    # compressed payload blocks
+        self._block_cache = OrderedDict()   # block number --> list of payloads
+
+    @classmethod
+    def from_tree(cls, tree, preset=None, side="A", **kwargs):
+        """
+        Convert the tree dict `tree` to a compact tree. The node fingerprints are
+        computed for diffs with the `preset` (and/or low level API kwargs).
+        """
+        plan = get_plan(preset=preset, **kwargs)
+        ctree = cls(plan, side=side)
+        signatures = {}
+        payloads = []
+        last_children = array('l')   # position of the last child of each node so far
+        stack = [(tree, NO_NODE)]
+        while stack:
+            node, parent_pos = stack.pop()
+            pos = ctree._append(node, parent_pos, plan, side, signatures)
+            last_children.append(NO_NODE)
+            if parent_pos != NO_NODE:
+                prev_pos = last_children[parent_pos]
+                if prev_pos == NO_NODE:
+                    ctree.first_children[parent_pos] = pos
+                else:
+                    ctree.next_siblings[prev_pos] = pos
+                last_children[parent_pos] = pos
+            payloads.append(ctree._payload_for(node, pos))
+            if len(payloads) == BLOCK_SIZE:
+                ctree._add_block(payloads)
+                payloads = []
+            if 'children' in node:
+                for child in reversed(node['children']):
+                    stack.append((child, pos))
+        if payloads:
+            ctree._add_block(payloads)
+        return ctree
+
+    def _append(self, node, parent_pos, plan, side, signatures):
+        pos = len(self.node_ids)
+        self.node_ids.append(_intern(node.get(self.node_id_key, _MISSING)))
+        self.content_ids.append(_intern(node.get(self.content_id_key, _MISSING)))
+        self.parents.append(parent_pos)
+        self.first_children.append(NO_NODE)
+        self.next_siblings.append(NO_NODE)
+        sort_order = node.get(self.sort_order_key, _MISSING)
+        if sort_order is _MISSING:
+            self.sort_orders.append(0.0)
+            self.sort_order_types.append(SORT_ORDER_MISSING)
+        elif isinstance(sort_order, float):
+            self.sort_orders.append(sort_order)
+            self.sort_order_types.append(SORT_ORDER_FLOAT)
+        elif isinstance(sort_order, int) and not isinstance(sort_order, bool) \
+                and float(sort_order) == sort_order:
+            self.sort_orders.append(float(sort_order))
+            self.sort_order_types.append(SORT_ORDER_INT)
+        else:
+            self.sort_orders.append(0.0)
+            self.sort_order_types.append(SORT_ORDER_OTHER)   # look up in payload
+        self.flags.append(HAS_CHILDREN_KEY if 'children' in node else 0)
+        self.fingerprints.extend(node_fingerprint(node, plan, side=side, signatures=signatures))
+        return pos
+
+    def _payload_for(self, node, pos):
+        """
+        Returns the attributes of `node` to store in the payload, i.e. without
+        the children and the values already stored in the arrays.
+        """
+        skip_keys = set(['children'])
+        if self.node_ids[pos] is not _MISSING:
+            skip_keys.add(self.node_id_key)
+        if self.content_ids[pos] is not _MISSING:
+            skip_keys.add(self.content_id_key)
+        if self.sort_order_types[pos] in (SORT_ORDER_FLOAT, SORT_ORDER_INT):
+            skip_keys.add(self.sort_order_key)
+        return dict((key, val) for key, val in node.items() if key not in skip_keys)
+
+    def _add_block(self, payloads):
+        data = pickle.dumps(payloads, protocol=pickle.HIGHEST_PROTOCOL)
+        self.blocks.append(zlib.compress(data))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def root(self):
+        return CompactNode(self, 0)
+
+    def node(self, pos):
+        return CompactNode(self, pos)
+
+    def payload(self, pos):
+        """
+        Returns the dict of attributes of the node at `pos` (without children).
+        """
+        block_num, offset = divmod(pos, BLOCK_SIZE)
+        cache = self._block_cache
+        payloads = cache.get(block_num)
+        if payloads is None:
+            payloads = pickle.loads(zlib.decompress(self.blocks[block_num]))
+            cache[block_num] = payloads
+            if len(cache) > CACHED_BLOCKS:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(block_num)
+        return payloads[offset]
+
+    def keys(self, pos):
+        """
+        Returns the list of keys of the node at `pos`.
+        """
+        keys = []
+        if self.node_ids[pos] is not _MISSING:
+            keys.append(self.node_id_key)
+        if self.content_ids[pos] is not _MISSING:
+            keys.append(self.content_id_key)
+        if self.sort_order_types[pos] in (SORT_ORDER_FLOAT, SORT_ORDER_INT):
+            keys.append(self.sort_order_key)
+        keys.extend(self.payload(pos))
+        if self.flags[pos] & HAS_CHILDREN_KEY:
+            keys.append('children')
+        return keys
+
+    def children(self, pos):
+        children = []
+        child_pos = self.first_children[pos]
+        while child_pos != NO_NODE:
+            children.append(CompactNode(self, child_pos))
+            child_pos = self.next_siblings[child_pos]
+        return children
+
+    def fingerprint(self, pos):
+        return bytes(self.fingerprints[20 * pos:20 * pos + 20])
+
+    def lookup(self, pos, key, default=_MISSING):
+        """
+        Returns the value of `key` for the node at `pos` using the arrays for ids,
+        sort orders, and children and the payloads for all other keys.
+        """
+        if key == self.node_id_key:
+            value = self.node_ids[pos]
+        elif key == self.content_id_key:
+            value = self.content_ids[pos]
+        elif key == self.sort_order_key and self.sort_order_types[pos] != SORT_ORDER_OTHER:
+            sort_order_type = self.sort_order_types[pos]
+            if sort_order_type == SORT_ORDER_MISSING:
+                value = _MISSING
+            elif sort_order_type == SORT_ORDER_INT:
+                value = int(self.sort_orders[pos])
+            else:
+                value = self.sort_orders[pos]
+        elif key == 'children':
+            value = self.children(pos) if self.flags[pos] & HAS_CHILDREN_KEY else _MISSING
+        else:
+            value = self.payload(pos).get(key, _MISSING)
+        if value is _MISSING:
+            if default is _MISSING:
+                raise KeyError(key)
+            return default
+        return value
+
+    def compatible(self, plan, side="A"):
+        """
+        Check if the node fingerprints can be used for diffs using `plan`.
+        """
+        return self.side_key == plan.side_key(side)
+
+    def to_tree(self):
+        """
+        Convert back to a tree of dicts.
+        """
+        nodes = []
+        for pos in range(len(self)):
+            node = dict((key, self.lookup(pos, key)) for key in self.keys(pos) if key != 'children')
+            if self.flags[pos] & HAS_CHILDREN_KEY:
+                node['children'] = []
+            nodes.append(node)
+            if self.parents[pos] != NO_NODE:
+                nodes[self.parents[pos]]['children'].append(node)
+        return nodes[0]
+
+
+class CompactNode(Mapping):
+    """
+    Read-only dict-like view of the node at position `pos` in a `CompactTree`.
+    """
+    __slots__ = ('tree', 'pos')
+
+    def __init__(self, tree, pos):
+        self.tree = tree
+        self.pos = pos
+
+    def __getitem__(self, key):
+        return self.tree.lookup(self.pos, key)
+
+    def get(self, key, default=None):
+        return self.tree.lookup(self.pos, key, default)
+
+    def __contains__(self, key):
+        if key == 'children':
+            # check the flag instead of building the views of the children
+            return bool(self.tree.flags[self.pos] & HAS_CHILDREN_KEY)
+        return self.tree.lookup(self.pos, key, _ABSENT) is not _ABSENT
+
+    def __iter__(self):
+        return iter(self.tree.keys(self.pos))
+
+    def __len__(self):
+        return len(self.tree.keys(self.pos))
+
+    def __repr__(self):
+        return 'CompactNode(' + repr(self.tree.node_ids[self.pos]) + ')'
+
+    @property
+    def fingerprint(self):
+        return self.tree.fingerprint(self.pos)
+
+
+def compact_tree(tree, preset=None, side="A", **kwargs):
+    """
+    Convert the tree dict `tree` to a `CompactTree` for diffs using `preset`.
+    """
+    return CompactTree.from_tree(tree, preset=preset, side=side, **kwargs)
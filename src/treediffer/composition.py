@@ -0,0 +1,318 @@
+from .patching import iter_diff_nodes
+from .plans import get_plan
+from .treediffs import DiffContext, diff_attributes, finish_diff, modified_node
+
+
+# DIFF COMPOSITION
+################################################################################
+# The diffs `treediff(tree1, tree2)` and `treediff(tree2, tree3)` can be composed
+# into the diff between `tree1` and `tree3` without the trees. The diffs describe
+# all the parts of the trees that changed: the deleted and added lists have the
+# full attributes of the nodes at the positions (parent_id, node_id, sort_order)
+# that changed (and of all the nodes in their subtrees), and the modified nodes
+# have the old and new values of all the attributes compared. From them we build
+# the parts of tree2 that are known, and get the same parts of tree1 by undoing
+# the first diff and of tree3 by applying the second one:
+#   - a node of tree2 is in tree1 at the same position, unless it was added by
+#     the first diff, with the modifications of the first diff undone;
+#   - a node of tree2 is in tree3 at the same position, unless it was deleted by
+#     the second diff, with the modifications of the second diff applied;
+#   - the nodes deleted by the first diff are in tree1, and the nodes added by
+#     the second diff are in tree3.
+# The parents that are not known (the nodes whose position did not change) are
+# placeholders kept in both partial trees. The partial trees are then diffed as
+# usual, so the result is the same as `treediff(tree1, tree3)`: a subtree whose
+# position changed between tree1 and tree3 was deleted or added by one of the
+# diffs, so its nodes are all known. The work is proportional to the size of
+# the two diffs.
+
+ROOT_KEY = (None,)    # key of the root node in the dicts of modified nodes
+
+
+def compose_diffs(diff1, diff2, preset=None, format="simplified", sort_order_changes=False, **kwargs):
+    """
+    Compose the diff `diff1` from tree1 to tree2 and the diff `diff2` from tree2
+    to tree3 into the diff from tree1 to tree3 in the `raw` or `simplified`
+    `format`. Use the same `preset` and low level API kwargs that were used to
+    compute both diffs. The input diffs can be in the `raw`, `simplified`, or
+    `restructured` format, but must include the nodes whose sort order changed
+    (`raw` format or `sort_order_changes=True`). The other formats only have the
+    new attributes of the moved nodes, so the old attributes of a node moved to
+    another parent by `diff1` are taken to be its attributes in tree2.
+    """
+    if format not in ['raw', 'simplified']:
+        raise ValueError('Composed diffs are only available in the raw and simplified formats')
+    for diff in [diff1, diff2]:
+        if not isinstance(diff.get('nodes_deleted'), list):
+            raise ValueError('Cannot compose a diff in the summary format')
+    plan = get_plan(preset=preset, **kwargs)
+    nodes_deleted1, nodes_added1, modified1 = diff_changes(diff1, plan)
+    nodes_deleted2, nodes_added2, modified2 = diff_changes(diff2, plan)
+
+    # 1. the known nodes of tree2, tree1, and tree3
+    tree2 = {}  # (parent_id, node_id) --> (sort_order, node attributes)
+    for na in nodes_added1:
+        tree2.setdefault((na['parent_id'], na['node_id']), (na['sort_order'], _node(na)))
+    for nd in nodes_deleted2:
+        tree2.setdefault((nd['old_parent_id'], nd['old_node_id']), (nd['old_sort_order'], _node(nd)))
+    # the other modified nodes are in the three trees at the same position
+    for modified, side in [(modified1, "B"), (modified2, "A")]:
+        for key, nm in modified.items():
+            if key not in tree2 and key != ROOT_KEY:
+                tree2[key] = (None, _modified_node(nm, plan, side=side))
+    tree1 = {}
+    for nd in nodes_deleted1:
+        tree1.setdefault((nd['old_parent_id'], nd['old_node_id']), (nd['old_sort_order'], _node(nd)))
+    added1 = set((na['parent_id'], na['node_id']) for na in nodes_added1)
+    for key, (sort_order, node) in tree2.items():
+        if key not in added1 and key not in tree1:
+            tree1[key] = (sort_order, _undo_modified(node, modified1.get(key), plan))
+    tree3 = {}
+    for na in nodes_added2:
+        tree3.setdefault((na['parent_id'], na['node_id']), (na['sort_order'], _node(na)))
+    deleted2 = set((nd['old_parent_id'], nd['old_node_id']) for nd in nodes_deleted2)
+    for key, (sort_order, node) in tree2.items():
+        if key not in deleted2 and key not in tree3:
+            tree3[key] = (sort_order, _redo_modified(node, modified2.get(key), plan))
+
+    # 2. diff the partial trees
+    ctx = ComposedDiffContext(plan)
+    rootA = ctx.build_tree(tree1, tree3)
+    rootB = ctx.build_tree(tree3, tree1)
+    ctx.push(None, rootA, None, rootB)
+    ctx.run()
+
+    # 3. the root node is modified from its attributes in tree1 to tree3
+    root1, root2 = modified1.get(ROOT_KEY), modified2.get(ROOT_KEY)
+    if root1 is not None and root2 is not None:
+        nodeA = _modified_node(root1, plan, side="A")
+        nodeB = _modified_node(root2, plan, side="B")
+        attrs_diff = diff_attributes(nodeA, nodeB, root=True, plan=plan)
+        nm = modified_node(root2['node_id'], None, root2['content_id'], attrs_diff)
+    else:
+        nm = root1 if root2 is None else root2
+    if nm is not None:
+        ctx.nodes_modified.insert(0, nm)
+
+    return finish_diff(ctx, None, None, format=format, sort_order_changes=sort_order_changes)
+
+
+def diff_changes(diff, plan):
+    """
+    Returns the lists of deleted and added diff nodes in `diff` as in the raw
+    format (moved nodes are both deleted and added) and the dict of the modified
+    nodes by (parent_id, node_id), the root by (None,).
+    """
+    nodes_deleted = list(iter_diff_nodes(diff['nodes_deleted']))
+    nodes_added = list(iter_diff_nodes(diff['nodes_added']))
+    nodes_moved = list(iter_diff_nodes(diff.get('nodes_moved', [])))
+    modified = {}
+    for nm in diff['nodes_modified']:
+        if nm['parent_id'] is None:
+            modified.setdefault(ROOT_KEY, nm)
+        else:
+            modified.setdefault((nm['parent_id'], nm['node_id']), nm)
+    if nodes_moved:
+        # moved nodes are already in the added and deleted lists of raw diffs
+        deleted = set((nd['old_parent_id'], nd['old_node_id'], nd['old_sort_order'])
+                      for nd in nodes_deleted)
+        added = set((na['parent_id'], na['node_id'], na['sort_order']) for na in nodes_added)
+        moved_from = {}     # old position --> moved node (the node itself if not cloned)
+        for nm in nodes_moved:
+            position = (nm['old_parent_id'], nm['old_node_id'], nm['old_sort_order'])
+            if nm['old_node_id'] == nm['node_id'] or position not in moved_from:
+                moved_from[position] = nm
+            if (nm['parent_id'], nm['node_id'], nm['sort_order']) not in added:
+                nodes_added.append(nm)
+        for position, nm in moved_from.items():
+            if position not in deleted:
+                nodes_deleted.append(_moved_from(nm, modified, plan))
+    return nodes_deleted, nodes_added, modified
+
+
+def _moved_from(nm, modified, plan):
+    """
+    Returns the deleted diff node at the old position of the moved node `nm`.
+    When the node moved under the same parent, the modifications of its
+    attributes are in `modified` and are undone, otherwise the attributes are
+    the new ones (but for the node_id and sort_order of the old position).
+    """
+    attributes = dict(nm['attributes'])
+    attributes[plan.node_id_keyA] = {'value': nm['old_node_id']}
+    if attributes.get(plan.sort_order_keyB, {}).get('value') is not None:
+        # the sort order of the position is the sort_order of the node
+        attributes[plan.sort_order_keyA] = {'value': nm['old_sort_order']}
+    node = _undo_modified(attributes, modified.get((nm['old_parent_id'], nm['old_node_id'])), plan,
+                          wrap=True)
+    return {
+        'old_node_id': nm['old_node_id'],
+        'old_parent_id': nm['old_parent_id'],
+        'old_sort_order': nm['old_sort_order'],
+        'content_id': nm['content_id'],
+        'attributes': node,
+    }
+
+
+class ComposedDiffContext(DiffContext):
+    """
+    Diff traversal of the partial trees built from two diffs, whose children
+    lists only have the known nodes: the sort order of each node is its position
+    in the diffs instead of its index, and the placeholder nodes are not diffed.
+    """
+
+    def __init__(self, plan):
+        DiffContext.__init__(self, plan)
+        self.sort_orders = {}       # id(node) --> sort_order
+        self.placeholders = set()   # id of the placeholder nodes
+
+    def build_tree(self, tree, other_tree):
+        """
+        Build the partial tree of the known nodes in `tree`, a dict (parent_id,
+        node_id) --> (sort_order, node attributes). The parents that are not in
+        `tree` are placeholders under a placeholder root, and so are the parents
+        of the nodes in `other_tree` that are in neither tree (so the partial
+        trees have the same placeholders).
+        """
+        nodes = {}  # node_id --> first node with node_id
+        items = []
+        for (parent_id, node_id), (sort_order, attributes) in tree.items():
+            node = dict(attributes)
+            node['children'] = []
+            self.sort_orders[id(node)] = sort_order
+            nodes.setdefault(node_id, node)
+            items.append((parent_id, node))
+        other_node_ids = set(node_id for _, node_id in other_tree)
+        root = self._placeholder(None)
+        for parent_id, _ in other_tree:
+            if parent_id not in nodes and parent_id not in other_node_ids:
+                nodes[parent_id] = self._placeholder(parent_id)
+                root['children'].append(nodes[parent_id])
+        for parent_id, node in items:
+            parent = nodes.get(parent_id)
+            if parent is None:
+                parent = nodes[parent_id] = self._placeholder(parent_id)
+                root['children'].append(parent)
+            parent['children'].append(node)
+        sort_orders = self.sort_orders
+        for node in [root] + list(nodes.values()):
+            node['children'].sort(key=lambda child: (sort_orders[id(child)] is None,
+                                                     sort_orders[id(child)]))
+        return root
+
+    def _placeholder(self, node_id):
+        node = {self.plan.node_id_keyA: node_id, self.plan.node_id_keyB: node_id, 'children': []}
+        self.sort_orders[id(node)] = None
+        self.placeholders.add(id(node))
+        return node
+
+    def visit(self, parent_idA, nodeA, parent_idB, nodeB, root=False):
+        if id(nodeA) in self.placeholders:
+            node_id = nodeA[self.plan.node_id_keyA]
+            self.visit_children(node_id, nodeA['children'], node_id, nodeB['children'])
+        else:
+            DiffContext.visit(self, parent_idA, nodeA, parent_idB, nodeB)
+
+    def children_itemsA(self, childrenA):
+        return self._children_items(childrenA, self.plan.node_id_keyA)
+
+    def children_itemsB(self, childrenB):
+        return self._children_items(childrenB, self.plan.node_id_keyB)
+
+    def _children_items(self, children, node_id_key):
+        items = [(node[node_id_key], self.sort_orders[id(node)], node) for node in children]
+        positions = set((node_id, sort_order) for node_id, sort_order, _ in items)
+        return items, positions
+
+    def subtree_deleted(self, parent_idA, sort_order, nodeA):
+        self.nodes_deleted.extend(self._flatten(parent_idA, sort_order, nodeA, self.plan.node_id_keyA,
+                                                self.plan.content_id_keyA, kind="deleted"))
+
+    def subtree_added(self, parent_idB, sort_order, nodeB):
+        self.nodes_added.extend(self._flatten(parent_idB, sort_order, nodeB, self.plan.node_id_keyB,
+                                              self.plan.content_id_keyB, kind="added"))
+
+    def _flatten(self, parent_id, sort_order, subtree, node_id_key, content_id_key, kind):
+        """
+        Flatten the `subtree` like `flatten_subtree` (using the known sort orders).
+        """
+        if kind == "deleted":
+            node_id_attr, parent_id_attr, sort_order_attr = 'old_node_id', 'old_parent_id', 'old_sort_order'
+        else:
+            node_id_attr, parent_id_attr, sort_order_attr = 'node_id', 'parent_id', 'sort_order'
+        flatlist = []
+        stack = [(parent_id, sort_order, subtree)]
+        while stack:
+            parent_id, sort_order, node = stack.pop()
+            flatlist.append({
+                node_id_attr: node[node_id_key],
+                parent_id_attr: parent_id,
+                sort_order_attr: sort_order,
+                'content_id': node[content_id_key],
+                'attributes': dict((attr, {'value': val}) for attr, val in node.items()
+                                   if attr != 'children'),
+            })
+            for child in reversed(node['children']):
+                stack.append((node[node_id_key], self.sort_orders[id(child)], child))
+        return flatlist
+
+
+def _node(diff_node):
+    """
+    Returns the attributes of the node of a deleted or added `diff_node`.
+    """
+    return dict((attr, val['value']) for attr, val in diff_node['attributes'].items())
+
+
+def _modified_node(nm, plan, side):
+    """
+    Returns the attributes of the modified node `nm` before (side A) or after
+    (side B) the modification, with its node_id and content_id.
+    """
+    amap = plan.mapA if side == "A" else plan.mapB
+    missing = nm.get('added', []) if side == "A" else nm.get('deleted', [])
+    node = {}
+    if nm['parent_id'] is not None:
+        node[amap.get('node_id', 'node_id')] = nm['node_id']
+        node[amap.get('content_id', 'content_id')] = nm['content_id']
+    for attr, val in nm['attributes'].items():
+        if attr in missing:
+            continue
+        if side == "A" and 'old_value' in val:
+            node[amap.get(attr, attr)] = val['old_value']
+        else:
+            node[amap.get(attr, attr)] = val['value']
+    return node
+
+
+def _undo_modified(node, nm, plan, wrap=False):
+    """
+    Returns the attributes of `node` before the modification `nm` (if any).
+    Use `wrap=True` for the attributes of a diff node ({'value': value} dicts).
+    """
+    if nm is None:
+        return node
+    node = dict(node)
+    attributes = nm['attributes']
+    for attr in nm.get('added', []):
+        node.pop(plan.mapB.get(attr, attr), None)
+    for attr in nm.get('deleted', []) + nm.get('modified', []):
+        node.pop(plan.mapB.get(attr, attr), None)
+        value = attributes[attr]['old_value']
+        node[plan.mapA.get(attr, attr)] = {'value': value} if wrap else value
+    return node
+
+
+def _redo_modified(node, nm, plan):
+    """
+    Returns the attributes of `node` after the modification `nm` (if any).
+    """
+    if nm is None:
+        return node
+    node = dict(node)
+    attributes = nm['attributes']
+    for attr in nm.get('deleted', []):
+        node.pop(plan.mapA.get(attr, attr), None)
+    for attr in nm.get('added', []) + nm.get('modified', []):
+        node.pop(plan.mapA.get(attr, attr), None)
+        node[plan.mapB.get(attr, attr)] = attributes[attr]['value']
+    return node
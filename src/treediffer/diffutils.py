@@ -63,6 +63,21 @@ def contains(container, item, by="node_id"):
         return False
 
 
+def freeze(value):
+    """
+    Convert `value` into a hashable canonical form that can be used as a key in
+    hash sets and dicts: dicts become frozensets of their items, lists become
+    tuples. Frozen JSON-like values are equal iff the original values are equal.
+    """
+    if isinstance(value, dict):
+        return frozenset((key, freeze(val)) for key, val in value.items())
+    elif isinstance(value, (list, tuple)):
+        return tuple(freeze(val) for val in value)
+    elif isinstance(value, set):
+        return frozenset(freeze(val) for val in value)
+    return value
+
+
 def rget(dict_obj, attrpath):
     """
     A fancy version of `get` that allows getting dot-separated nested attributes
@@ -83,11 +98,109 @@ def rget(dict_obj, attrpath):
 # TREE UTILS
 ################################################################################
 
-def treefindby(subtree, value, by="node_id"):
+class TreeIndex(object):
+    """
+    Index of all the nodes in a tree, built in a single pre-order traversal.
+    Stores the pre-order position, parent, depth, and subtree size of each node
+    so that lookups by `by` (node_id) and "is descendant" checks take O(1) time.
+    The descendants of the node at position `pos` are the nodes in positions
+    `pos+1` to `pos+size-1` (Euler-tour interval of the subtree).
+    """
+
+    def __init__(self, tree, by="node_id"):
+        self.by = by
+        self.nodes = []       # all nodes in pre-order
+        self.parents = []     # position of parent node (None for the root)
+        self.depths = []      # root node has depth 0
+        self.sizes = []       # number of nodes in subtree (including self)
+        self.positions = {}   # node_id --> position of first occurence
+        self.duplicates = {}  # node_id --> positions (only for repeated ids)
+        stack = [(tree, None, 0)]
+        while stack:
+            node, parent_pos, depth = stack.pop()
+            pos = len(self.nodes)
+            self.nodes.append(node)
+            self.parents.append(parent_pos)
+            self.depths.append(depth)
+            self.sizes.append(1)
+            if by in node:
+                node_id = node[by]
+                if node_id in self.positions:
+                    first_pos = self.positions[node_id]
+                    self.duplicates.setdefault(node_id, [first_pos]).append(pos)
+                else:
+                    self.positions[node_id] = pos
+            if 'children' in node:
+                for child in reversed(node['children']):
+                    stack.append((child, pos, depth + 1))
+        # accumulate subtree sizes bottom-up (children always come after parent)
+        for pos in range(len(self.nodes) - 1, 0, -1):
+            self.sizes[self.parents[pos]] += self.sizes[pos]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.positions
+
+    def get(self, node_id):
+        """
+        Returns the first node (in tree order) with `by` equal to `node_id`.
+        """
+        pos = self.positions.get(node_id)
+        if pos is None:
+            return None
+        return self.nodes[pos]
+
+    def getall(self, node_id):
+        """
+        Returns all the nodes (in tree order) with `by` equal to `node_id`.
+        """
+        if node_id in self.duplicates:
+            return [self.nodes[pos] for pos in self.duplicates[node_id]]
+        pos = self.positions.get(node_id)
+        if pos is None:
+            return []
+        return [self.nodes[pos]]
+
+    def parent(self, node_id):
+        parent_pos = self.parents[self.positions[node_id]]
+        if parent_pos is None:
+            return None
+        return self.nodes[parent_pos]
+
+    def depth(self, node_id):
+        return self.depths[self.positions[node_id]]
+
+    def size(self, node_id):
+        return self.sizes[self.positions[node_id]]
+
+    def is_descendant(self, node_id, ancestor_id):
+        """
+        Check if `node_id` is in the subtree rooted at `ancestor_id` (excluding
+        the ancestor itself) by comparing their Euler-tour intervals.
+        """
+        pos = self.positions.get(node_id)
+        ancestor_pos = self.positions.get(ancestor_id)
+        if pos is None or ancestor_pos is None:
+            return False
+        return ancestor_pos < pos < ancestor_pos + self.sizes[ancestor_pos]
+
+    def descendants(self, node_id, include_self=False):
+        """
+        Returns the nodes in the subtree rooted at `node_id` in pre-order.
+        """
+        pos = self.positions[node_id]
+        start = pos if include_self else pos + 1
+        return self.nodes[start:pos + self.sizes[pos]]
+
+
+def treefindby(subtree, value, by="node_id", index=None):
     """
     Returns node in `subtree` that has attribute `by` equal to `value`.
+    Pass in a `TreeIndex` of `subtree` as `index` to avoid scanning the tree.
     """
-    results = treefindallby(subtree, value, by=by)
+    results = treefindallby(subtree, value, by=by, index=index)
     if len(results) == 1:
         return results[0]
     elif len(results) > 1:
@@ -98,37 +211,56 @@ def treefindby(subtree, value, by="node_id"):
         return None
 
 
-def treefindallby(subtree, value, by="node_id"):
+def treefindallby(subtree, value, by="node_id", index=None):
     """
     Returns all node in `subtree` that have attribute `by` equal to `value`.
+    Pass in a `TreeIndex` of `subtree` as `index` to avoid scanning the tree.
     """
+    if index is not None and index.by == by:
+        return index.getall(value)
     results = []
-    if by in subtree and subtree[by] == value:
-        results.append(subtree)
-    if 'children' in subtree:
-        for child in subtree['children']:
-            child_results = treefindallby(child, value, by=by)
-            results.extend(child_results)
+    stack = [subtree]
+    while stack:
+        node = stack.pop()
+        if by in node and node[by] == value:
+            results.append(node)
+        if 'children' in node:
+            stack.extend(reversed(node['children']))
     return results
 
 
-def get_descendants(node, include_self=True):
+def get_descendants(node, include_self=True, index=None, detached=False):
     """
     Return a flat list including `node` and all its descendants. Nodes returned
-    are modified to remove the tree structure between them (set `children=[]`).
+    are shallow copies with the tree structure removed (set `children=[]`), so
+    attribute values are shared with the tree unless `detached=True` is used.
+    Pass in a `TreeIndex` of the tree as `index` to avoid the recursive walk.
     """
+    if index is not None and index.by in node and index.get(node[index.by]) is node:
+        descendants = index.descendants(node[index.by], include_self=include_self)
+        return [_strip_children(dnode, detached=detached) for dnode in descendants]
     results = []
-    if include_self:
-        node_copy = copy.deepcopy(node)
-        node_copy['children'] = []
-        results.append(node_copy)
-    if 'children' in node:
-        for child in node['children']:
-            child_results = get_descendants(child, include_self=True)
-            results.extend(child_results)
+    stack = [node]
+    while stack:
+        dnode = stack.pop()
+        if dnode is not node or include_self:
+            results.append(_strip_children(dnode, detached=detached))
+        if 'children' in dnode:
+            stack.extend(reversed(dnode['children']))
     return results
 
 
+def _strip_children(node, detached=False):
+    """
+    Return a copy of `node` with `children=[]` without copying the children.
+    """
+    node_copy = dict((key, val) for key, val in node.items() if key != 'children')
+    if detached:
+        node_copy = copy.deepcopy(node_copy)
+    node_copy['children'] = []
+    return node_copy
+
+
 # DIFF PRINTING
 ################################################################################
 
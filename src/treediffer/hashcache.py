@@ -0,0 +1,152 @@
+import binascii
+import hashlib
+import logging
+import os
+import tempfile
+
+from .hashing import SubtreeHashes
+
+logger = logging.getLogger('treediffs')
+
+
+# SUBTREE HASH CACHE
+################################################################################
+# Computing the subtree hashes of a large tree takes about as long as diffing it,
+# so when the same old tree is diffed many times (e.g. the main tree of a channel
+# against a new staging tree) we store its hashes on disk. Cache entries are keyed
+# by the content hash of the tree file and the part of the diff plan that applies
+# to the tree (see `DiffPlan.side_key`), so the hashes of a tree computed when it
+# was the new tree `treeB` are reused when it becomes the old tree `treeA`, and
+# store the subtree hashes in pre-order as concatenated 20-byte sha1 digests.
+# Entries are evicted in least-recently-used order (using file mtimes) when the
+# cache is larger than `max_bytes` or has more than `max_entries` entries.
+
+DIGEST_SIZE = 20                    # bytes in a sha1 digest
+CACHE_EXT = '.hashes'
+DEFAULT_MAX_BYTES = 200 * 1024**2   # 200MB
+
+
+def file_content_hash(path, chunk_size=1024**2):
+    """
+    Returns the sha1 hex digest of the contents of the file at `path`.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as infile:
+        chunk = infile.read(chunk_size)
+        while chunk:
+            sha1.update(chunk)
+            chunk = infile.read(chunk_size)
+    return sha1.hexdigest()
+
+
+class HashCache(object):
+    """
+    On-disk cache of `SubtreeHashes` stored in `cache_dir` (e.g. `chefdata/`).
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def entry_path(self, content_hash, plan, side):
+        key = hashlib.sha1(repr((content_hash, plan.side_key(side))).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + CACHE_EXT)
+
+    def get(self, content_hash, plan, side="A"):
+        """
+        Returns the list of subtree hashes (in pre-order) for the tree with
+        `content_hash` and the `plan`, or None if not in the cache.
+        """
+        path = self.entry_path(content_hash, plan, side)
+        try:
+            with open(path, 'rb') as infile:
+                data = infile.read()
+        except (IOError, OSError):
+            return None
+        if not data or len(data) % DIGEST_SIZE != 0:
+            logger.warning('Removing corrupt subtree hash cache entry ' + path)
+            self._remove(path)
+            return None
+        os.utime(path, None)  # mark as recently used
+        hexdata = binascii.hexlify(data).decode('ascii')
+        step = 2 * DIGEST_SIZE
+        return [hexdata[i:i + step] for i in range(0, len(hexdata), step)]
+
+    def put(self, content_hash, plan, side, digests):
+        """
+        Store the list of subtree hashes `digests` then evict old entries.
+        """
+        path = self.entry_path(content_hash, plan, side)
+        data = binascii.unhexlify(''.join(digests).encode('ascii'))
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as outfile:
+                outfile.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict(keep=path)
+
+    def subtree_hashes(self, tree, content_hash, plan, side="A"):
+        """
+        Returns the `SubtreeHashes` of `tree` (loaded from a file with contents
+        hash `content_hash`), computing and storing them on a cache miss.
+        """
+        digests = self.get(content_hash, plan, side=side)
+        if digests is not None:
+            try:
+                return SubtreeHashes(tree, plan, side=side, digests=digests)
+            except ValueError:
+                logger.warning('Ignoring subtree hash cache entry that does not match tree')
+        hashes = SubtreeHashes(tree, plan, side=side)
+        self.put(content_hash, plan, side, hashes.digests)
+        return hashes
+
+    def entries(self):
+        """
+        Returns a list of (mtime, size, path) for all cache entries, oldest first.
+        """
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(CACHE_EXT):
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries until the cache is within limits.
+        The entry at path `keep` (the one just written) is never removed.
+        """
+        entries = self.entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        num_entries = len(entries)
+        for _, size, path in entries:
+            over_bytes = self.max_bytes is not None and total_bytes > self.max_bytes
+            over_entries = self.max_entries is not None and num_entries > self.max_entries
+            if not (over_bytes or over_entries):
+                break
+            if path == keep:
+                continue
+            self._remove(path)
+            total_bytes -= size
+            num_entries -= 1
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,193 @@
+import hashlib
+import json
+
+from .plans import MAX_SIGNATURES
+
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=repr)
+
+
+# SUBTREE HASHES
+################################################################################
+# A Merkle hash of a subtree covers all the information the diff logic looks at:
+# the attributes of the root node of the subtree (after applying the attr-maps
+# and `exclude_attrs` of the plan), its files and assessment items (without the
+# excluded `files.*` and `assessment_items.*` keys), and the `node_id`s, sort
+# orders and hashes of all its children in order. Two subtrees with the same hash
+# have no differences, so the diff can skip them without visiting their nodes.
+# Note the hashes are stricter than the diff logic (e.g. reordering the tags of a
+# node changes its hash), which is fine since this only means a subtree with a
+# different hash will be diffed as usual.
+
+
+class SubtreeHashes(object):
+    """
+    The Merkle hashes of all the subtrees in `tree` computed using the `plan`.
+    Use `side="A"` for old trees (uses `mapA`) and `side="B"` for new trees.
+    The hashes are available in pre-order in the list `digests` and by node
+    using the `get` method.
+    """
+
+    def __init__(self, tree, plan, side="A", digests=None):
+        self.plan_key = plan.key
+        self.side = side
+        nodes, children_positions = _preorder(tree)
+        if digests is None:
+            digests = _compute_digests(nodes, children_positions, plan, side)
+        elif len(digests) != len(nodes):
+            raise ValueError('Got ' + str(len(digests)) + ' digests for tree with ' + str(len(nodes)) + ' nodes')
+        self.digests = digests
+        # nodes of compact trees are views that are created on access, so look up
+        # their hashes by position (see `treediffer.compact.CompactNode`)
+        self.compact_tree = getattr(tree, 'tree', None)
+        if self.compact_tree is None:
+            self._by_id = dict((id(node), digest) for node, digest in zip(nodes, digests))
+
+    def __len__(self):
+        return len(self.digests)
+
+    def get(self, node):
+        """
+        Returns the hash of the subtree rooted at `node` (None if not in tree).
+        """
+        if self.compact_tree is not None:
+            if getattr(node, 'tree', None) is not self.compact_tree:
+                return None
+            return self.digests[node.pos]
+        return self._by_id.get(id(node))
+
+    @property
+    def root_digest(self):
+        return self.digests[0]
+
+
+def _preorder(tree):
+    """
+    Returns the list of nodes of `tree` in pre-order and the list of positions
+    of the children of each node.
+    """
+    nodes, children_positions = [], []
+    stack = [(tree, None)]
+    while stack:
+        node, parent_pos = stack.pop()
+        pos = len(nodes)
+        nodes.append(node)
+        children_positions.append([])
+        if parent_pos is not None:
+            children_positions[parent_pos].append(pos)
+        if 'children' in node:
+            for child in reversed(node['children']):
+                stack.append((child, pos))
+    return nodes, children_positions
+
+
+def _compute_digests(nodes, children_positions, plan, side):
+    digests = [None] * len(nodes)
+    if side == "A":
+        node_id_key, sort_order_key = plan.node_id_keyA, plan.sort_order_keyA
+    else:
+        node_id_key, sort_order_key = plan.node_id_keyB, plan.sort_order_keyB
+    signatures = {}  # node keys --> regular attrs (attr, key) pairs
+    # children come after their parents in pre-order, so go backwards
+    for pos in range(len(nodes) - 1, -1, -1):
+        children = []
+        for i, child_pos in enumerate(children_positions[pos]):
+            child = nodes[child_pos]
+            sort_order = child.get(sort_order_key, None)
+            if sort_order is None:
+                sort_order = float(i + 1)  # 1-based indexitng
+            children.append([child[node_id_key], sort_order, digests[child_pos]])
+        digests[pos] = node_digest(nodes[pos], plan, side=side, children=children,
+                                   signatures=signatures)
+    return digests
+
+
+def node_digest(node, plan, side="A", children=None, signatures=None):
+    """
+    Returns the hash (hex string) of the information in `node` used by the diff
+    logic: the regular attributes, set-like attributes, files, assessment items,
+    plus the `children` info provided by the caller.
+    """
+    payload = node_payload(node, plan, side=side, signatures=signatures)
+    payload.append(children or [])
+    encoded = _encoder.encode(payload)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def node_fingerprint(node, plan, side="A", signatures=None):
+    """
+    Returns the 20-byte sha1 digest of the diff-relevant info in `node` without
+    its children. Two nodes with the same fingerprint have no attribute changes.
+    """
+    encoded = _encoder.encode(node_payload(node, plan, side=side, signatures=signatures))
+    return hashlib.sha1(encoded.encode('utf-8')).digest()
+
+
+def node_payload(node, plan, side="A", signatures=None):
+    """
+    Returns a JSON-serializable list with the diff-relevant info in `node`.
+    Pass in a dict as `signatures` to cache the regular attributes per node keys.
+    """
+    amap = plan.mapA if side == "A" else plan.mapB
+
+    # 1. Regular attributes
+    pairs = None
+    if signatures is not None:
+        signature = tuple(node)
+        pairs = signatures.get(signature)
+    if pairs is None:
+        pairs = _regular_pairs(node, plan, side)
+        if signatures is not None:
+            if len(signatures) >= MAX_SIGNATURES:
+                signatures.clear()
+            signatures[signature] = pairs
+    regular = [[attr, node[key]] for attr, key in pairs if key in node]
+
+    # 2. Set-like attributes
+    setlike = []
+    for attr in plan.setlike_attrs:
+        key = amap.get(attr, attr)
+        if key in node:
+            setlike.append([attr, node[key]])
+
+    # 3. Files
+    files = None
+    if plan.diff_files and 'files' in node:
+        exclude_keys = plan.files_exclude_keys
+        files = [_strip(file, exclude_keys) for file in node['files']]
+
+    # 4. Assessment items
+    assessment_items = None
+    ai_key = plan.assessment_items_key
+    if ai_key and ai_key in node:
+        exclude_keys = plan.assessment_items_exclude_keys.union(['files'])
+        files_exclude_keys = plan.files_exclude_keys
+        assessment_items = []
+        for ai in node[ai_key]:
+            ai_payload = _strip(ai, exclude_keys)
+            if 'files' in ai:
+                ai_payload['files'] = [_strip(file, files_exclude_keys) for file in ai['files']]
+            assessment_items.append(ai_payload)
+
+    return [regular, setlike, files, assessment_items]
+
+
+def _regular_pairs(node, plan, side):
+    """
+    Returns the (attr, key) pairs of the regular attributes of `node` to hash.
+    """
+    if side == "A":
+        amap, map_vals = plan.mapA, plan.mapA_vals
+    else:
+        amap, map_vals = plan.mapB, plan.mapB_vals
+    if plan.attrs is not None:
+        attrs = plan.attrs
+    else:
+        attrs = set(plan.map_keys)
+        attrs.update(key for key in node if key not in map_vals)
+        attrs = sorted(attrs)
+    return [(attr, amap.get(attr, attr)) for attr in attrs if attr not in plan.skip_attrs]
+
+
+def _strip(adict, exclude_keys):
+    return dict((key, val) for key, val in adict.items() if key not in exclude_keys)
@@ -0,0 +1,298 @@
+from .loaders import get_root
+from .prepared import PreparedContext, PreparedTree
+from .treediffs import DiffContext, finish_diff
+
+
+# INCREMENTAL DIFFS
+################################################################################
+# The raw diff is the concatenation of the changes found when visiting each pair
+# of matched nodes (nodeA, nodeB) in depth-first order: the attribute changes of
+# the pair, and the subtrees deleted and added among their children. The
+# `IncrementalDiffer` keeps the changes of each pair in a tree of `_Pair`s, so
+# when a few nodes of `treeB` are edited only the pairs that contain them need to
+# be visited again (along with any new pairs below them). Each pair also keeps
+# the number of diff nodes in its subtree of pairs, so the raw diff lists can be
+# put back together by visiting only the pairs with changes, and the moves are
+# detected again on the updated lists.
+
+
+class _Pair(object):
+    """
+    A pair of matched nodes with the changes found when visiting them.
+    """
+    __slots__ = ('args', 'sort_order', 'depth', 'parent', 'children', 'changes', 'added_roots',
+                 'total', 'alive')
+
+    def __init__(self, args, parent=None, sort_order=None):
+        self.args = args            # (parent_idA, nodeA, parent_idB, nodeB, root)
+        self.sort_order = sort_order    # sort order of nodeB among its siblings
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.children = []          # child pairs in traversal order
+        self.changes = ([], [], [])  # (nodes_deleted, nodes_added, nodes_modified)
+        self.added_roots = set()    # id of the children of nodeB reported as added
+        self.total = 0              # number of diff nodes in this subtree of pairs
+        self.alive = True
+
+    @property
+    def own_total(self):
+        return sum(len(nodes) for nodes in self.changes)
+
+
+class _PairContext(PreparedContext):
+    """
+    Diff context for visiting a single pair that records the added children and
+    the sort orders of the children of nodeB.
+    """
+
+    def __init__(self, prepared):
+        PreparedContext.__init__(self, prepared)
+        self.added_roots = set()
+        self.sort_ordersB = {}      # id(child of nodeB) --> sort_order
+
+    def children_itemsB(self, childrenB):
+        items, positions = PreparedContext.children_itemsB(self, childrenB)
+        for _, sort_order, node in items:
+            self.sort_ordersB[id(node)] = sort_order
+        return items, positions
+
+    def subtree_added(self, parent_idB, sort_order, nodeB):
+        self.added_roots.add(id(nodeB))
+        PreparedContext.subtree_added(self, parent_idB, sort_order, nodeB)
+
+
+class IncrementalDiffer(object):
+    """
+    Stateful differ for an old tree `treeA` and a new tree `treeB` that is being
+    edited in place. After editing `treeB`, call `update(touched_node_ids)` with
+    the `node_id`s of the nodes whose attributes or children were changed (when
+    a node is added, removed, moved, reordered, or its `node_id` or `sort_order`
+    changes, the parent nodes are touched). The updated diff is in `diff`.
+    """
+
+    def __init__(self, treeA, treeB, preset=None, format="simplified", sort_order_changes=False,
+                 **kwargs):
+        if format not in ('raw', 'simplified', 'restructured'):
+            raise ValueError('Incremental diffs support the raw, simplified, and restructured formats')
+        self.prepared = PreparedTree(treeA, preset=preset, **kwargs)
+        self.plan = self.prepared.plan
+        self.treeA = self.prepared.tree
+        self.treeB = get_root(treeB)
+        self.format = format
+        self.sort_order_changes = sort_order_changes
+        # index of treeB
+        self.nodesB = {}            # node_id --> node
+        self.node_idsB = {}         # id(node) --> node_id
+        self.parentsB = {}          # id(node) --> parent node
+        self.childrenB = {}         # id(node) --> list of children (copy)
+        self.pairs_by_nodeB = {}    # id(nodeB) --> list of pairs
+        self._register_subtree(self.treeB, None)
+        self.root = self._build_pairs((None, self.treeA, None, self.treeB, True), None)
+        self.diff = self._get_diff()
+
+    # treeB index
+    ############################################################################
+
+    def _register_subtree(self, subtree, parent):
+        node_id_key = self.plan.node_id_keyB
+        stack = [(subtree, parent)]
+        while stack:
+            node, parent = stack.pop()
+            node_id = node.get(node_id_key)
+            self.nodesB.setdefault(node_id, node)
+            self.node_idsB[id(node)] = node_id
+            self.parentsB[id(node)] = parent
+            if 'children' in node:
+                self.childrenB[id(node)] = list(node['children'])
+                for child in node['children']:
+                    stack.append((child, node))
+
+    def _unregister_subtree(self, subtree):
+        stack = [subtree]
+        while stack:
+            node = stack.pop()
+            node_id = self.node_idsB.pop(id(node))
+            if self.nodesB.get(node_id) is node:
+                del self.nodesB[node_id]
+            del self.parentsB[id(node)]
+            for child in self.childrenB.pop(id(node), []):
+                if self.parentsB.get(id(child)) is node:   # (unless moved to a new parent)
+                    stack.append(child)
+
+    def _refresh_node(self, node):
+        """
+        Update the index of treeB for the changes to the children of `node`.
+        """
+        old_children = self.childrenB.get(id(node), [])
+        new_children = node.get('children', [])
+        new_ids = set(id(child) for child in new_children)
+        old_ids = set(id(child) for child in old_children)
+        for child in old_children:
+            if id(child) not in new_ids and self.parentsB.get(id(child)) is node:
+                self._unregister_subtree(child)    # (unless moved to a new parent)
+        for child in new_children:
+            if id(child) not in old_ids:
+                self._register_subtree(child, node)
+        if 'children' in node:
+            self.childrenB[id(node)] = list(new_children)
+        else:
+            self.childrenB.pop(id(node), None)
+        # update the index for children whose node_id has changed
+        node_id_key = self.plan.node_id_keyB
+        for child in [node] + list(new_children):
+            old_node_id = self.node_idsB[id(child)]
+            new_node_id = child.get(node_id_key)
+            if new_node_id != old_node_id:
+                if self.nodesB.get(old_node_id) is child:
+                    del self.nodesB[old_node_id]
+                self.nodesB.setdefault(new_node_id, child)
+                self.node_idsB[id(child)] = new_node_id
+
+    # pairs
+    ############################################################################
+
+    def _visit(self, pair):
+        """
+        Visit the nodes in `pair` and return the (args, sort order of nodeB) of the
+        child pairs.
+        """
+        ctx = _PairContext(self.prepared)
+        ctx.visit(*pair.args)
+        pair.changes = (ctx.nodes_deleted, ctx.nodes_added, ctx.nodes_modified)
+        pair.added_roots = ctx.added_roots
+        return [(args, ctx.sort_ordersB[id(args[3])]) for args in reversed(ctx.stack)]
+
+    def _build_pairs(self, args, parent, sort_order=None):
+        """
+        Create the pair for `args` and all the pairs below it.
+        """
+        top = _Pair(args, parent, sort_order)
+        stack = [top]
+        built = []
+        while stack:
+            pair = stack.pop()
+            self.pairs_by_nodeB.setdefault(id(pair.args[3]), []).append(pair)
+            built.append(pair)
+            for child_args, sort_order in self._visit(pair):
+                pair.children.append(_Pair(child_args, pair, sort_order))
+            stack.extend(reversed(pair.children))
+        for pair in reversed(built):
+            pair.total = pair.own_total + sum(child.total for child in pair.children)
+        return top
+
+    def _drop_pairs(self, top):
+        stack = [top]
+        while stack:
+            pair = stack.pop()
+            pair.alive = False
+            pairs = self.pairs_by_nodeB[id(pair.args[3])]
+            pairs.remove(pair)
+            if not pairs:
+                del self.pairs_by_nodeB[id(pair.args[3])]
+            stack.extend(pair.children)
+
+    def _revisit(self, pair):
+        """
+        Visit `pair` again and update its child pairs. Returns the child pairs
+        that were kept but whose parent ids or sort orders have changed (e.g. the
+        children were reordered, so their `sort_order` attributes changed).
+        """
+        old_total = pair.total
+        old_children = dict(((id(child.args[1]), id(child.args[3])), child) for child in pair.children)
+        children, changed = [], []
+        for child_args, sort_order in self._visit(pair):
+            key = (id(child_args[1]), id(child_args[3]))
+            child = old_children.pop(key, None)
+            if child is None:
+                child = self._build_pairs(child_args, pair, sort_order)
+            elif (child.args[0] != child_args[0] or child.args[2] != child_args[2]
+                    or child.sort_order != sort_order):
+                child.args = child_args     # parent node_id or sort order changed
+                child.sort_order = sort_order
+                changed.append(child)
+            children.append(child)
+        for child in old_children.values():
+            self._drop_pairs(child)
+        pair.children = children
+        pair.total = pair.own_total + sum(child.total for child in children)
+        self._propagate(pair.parent, pair.total - old_total)
+        return changed
+
+    def _propagate(self, pair, delta):
+        while pair is not None and delta:
+            pair.total += delta
+            pair = pair.parent
+
+    def _owner_pairs(self, node):
+        """
+        Returns the pairs whose changes include `node`: the pairs of `node` and
+        the pairs of its ancestors where the subtree containing `node` was added.
+        """
+        owners = list(self.pairs_by_nodeB.get(id(node), []))
+        child, parent = node, self.parentsB.get(id(node))
+        while parent is not None:
+            for pair in self.pairs_by_nodeB.get(id(parent), []):
+                if id(child) in pair.added_roots:
+                    owners.append(pair)
+            child, parent = parent, self.parentsB.get(id(parent))
+        return owners
+
+    # public API
+    ############################################################################
+
+    def update(self, touched_node_ids):
+        """
+        Update the diff after the nodes with `touched_node_ids` in treeB have
+        been edited and return the updated diff. The work done depends on the
+        size of the touched subtrees and of the diff, not of the trees (except
+        for the `restructured` format, which needs to index treeB again).
+        """
+        # update the index of treeB (in rounds, since refreshing a node can add
+        # new nodes or node_ids to the index)
+        touched = []
+        pending = set(touched_node_ids)
+        while pending:
+            found = [node_id for node_id in pending if node_id in self.nodesB]
+            if not found:
+                break
+            for node_id in found:
+                pending.discard(node_id)
+                node = self.nodesB.get(node_id)
+                if node is not None:
+                    touched.append(node)
+                    self._refresh_node(node)
+
+        to_visit = []
+        for node in touched:
+            if id(node) not in self.node_idsB:
+                continue
+            for pair in self._owner_pairs(node):
+                to_visit.append(pair)
+                if pair.args[3] is node and pair.parent is not None:
+                    to_visit.append(pair.parent)   # node_id or sort_order may have changed
+        while to_visit:
+            # visit pairs closer to the root first, since they can drop or rebuild the pairs below
+            to_visit.sort(key=lambda pair: pair.depth, reverse=True)
+            pair = to_visit.pop()
+            if pair.alive:
+                to_visit.extend(self._revisit(pair))
+                to_visit = [other for other in to_visit if other is not pair]
+        self.diff = self._get_diff()
+        return self.diff
+
+    def _get_diff(self):
+        ctx = DiffContext(self.plan)
+        stack = [self.root]
+        while stack:
+            pair = stack.pop()
+            # shallow copies since restructuring modifies the diff nodes
+            nodes_deleted, nodes_added, nodes_modified = pair.changes
+            ctx.nodes_deleted.extend(dict(node) for node in nodes_deleted)
+            ctx.nodes_added.extend(dict(node) for node in nodes_added)
+            ctx.nodes_modified.extend(dict(node) for node in nodes_modified)
+            for child in reversed(pair.children):
+                if child.total:
+                    stack.append(child)
+        return finish_diff(ctx, self.treeA, self.treeB, format=self.format,
+                           sort_order_changes=self.sort_order_changes,
+                           indexA=self.prepared.index)
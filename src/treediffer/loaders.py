@@ -0,0 +1,304 @@
+import codecs
+import hashlib
+import json
+import re
+
+from .compact import CompactTree
+from .plans import get_plan
+
+
+# STREAMING TREE LOADER
+################################################################################
+# Loading a large JSON tree archive with `json.load` creates the full tree of dicts
+# in memory (several times the size of the file) before the diff can start. The
+# `load_tree` function reads the file incrementally in chunks and keeps only the
+# node attributes needed by the diff plan (ids and the attributes being compared,
+# without the excluded attributes and excluded `files.*` and `assessment_items.*`
+# keys). The structure of the tree (nodes and `children` lists) is parsed by the
+# `JSONStreamReader` below, while the value of each attribute is decoded at once
+# using the C-accelerated `json` decoder.
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = frozenset('0123456789.eE+-')
+_FIRST_KEY = re.compile(r'[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+_NEXT_KEY = re.compile(r'[ \t\n\r]*,[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:[ \t\n\r]*')
+
+
+class TreeStore(object):
+    """
+    A tree loaded using `load_tree`. The pruned tree of nodes is in `root`, and
+    `content_hash` is the sha1 of the file contents (and of the loader options
+    that change the values stored), which can be used as a cache key.
+    Tree stores can be passed to `treediff` directly instead of tree dicts.
+    """
+
+    def __init__(self, root, content_hash, num_nodes, plan_key=None):
+        self.root = root
+        self.content_hash = content_hash
+        self.num_nodes = num_nodes
+        self.plan_key = plan_key
+
+    def __len__(self):
+        return self.num_nodes
+
+
+def get_root(tree):
+    """
+    Returns the root node of `tree`, which is either a dict, a `TreeStore`, or
+    a `CompactTree`.
+    """
+    if isinstance(tree, (TreeStore, CompactTree)):
+        return tree.root
+    return tree
+
+
+class JSONStreamReader(object):
+    """
+    Incremental reader of JSON text from the binary or text file `infile`.
+    Keeps a buffer of the unread text and the sha1 of all the bytes read.
+    """
+
+    def __init__(self, infile, chunk_size=CHUNK_SIZE):
+        self.infile = infile
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.sha1 = hashlib.sha1()
+        self.utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+
+    def read_more(self, size=None):
+        """
+        Read the next chunk of the file into the buffer, returns False at EOF.
+        """
+        if self.eof:
+            return False
+        chunk = self.infile.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.buf = self.buf[self.pos:] + self.utf8_decoder.decode(b'', True)
+            self.pos = 0
+            return False
+        if isinstance(chunk, bytes):
+            self.sha1.update(chunk)
+            text = self.utf8_decoder.decode(chunk)
+        else:
+            self.sha1.update(chunk.encode('utf-8'))
+            text = chunk
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skip whitespace and return the next character ('' at the end of file).
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read_more():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError('Expected ' + repr(char) + ' but found ' + repr(found) + ' in JSON tree')
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Decode the next JSON value, reading more of the file when the value
+        continues past the end of the buffer.
+        """
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buf, self.pos)
+                if self.eof or (end < len(self.buf) and self.buf[end] not in _NUMBER_CHARS):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+                start = self.pos
+                if self.peek() and self.pos != start:
+                    continue  # skipped whitespace before the value
+            # the value continues in the next chunk (e.g. 12 could be part of 12.5)
+            self.read_more(size)
+            size *= 2
+
+    def read_member_key(self, first=False):
+        """
+        Read the key of the next member of an object (preceded by a comma if not
+        the `first` member) with a fast path for keys without escape sequences.
+        """
+        match = (_FIRST_KEY if first else _NEXT_KEY).match(self.buf, self.pos)
+        if match is not None:
+            self.pos = match.end()
+            return match.group(1)
+        if not first:
+            self.expect(',')
+        return self.read_key()
+
+    def read_key(self):
+        key = self.read_value()
+        if not isinstance(key, str):
+            raise ValueError('Expected an object key in JSON tree but found ' + repr(key))
+        self.expect(':')
+        return key
+
+    def content_hash(self):
+        """
+        Read the rest of the file and return the sha1 hex digest of its contents.
+        """
+        while self.read_more():
+            self.pos = len(self.buf)
+        return self.sha1.hexdigest()
+
+
+def load_tree(source, preset=None, side="A", children_key='children', fingerprint_attrs=[],
+              **kwargs):
+    """
+    Load the JSON tree in `source` (a path or a file object) incrementally and
+    return a `TreeStore` with the pruned tree that keeps only the attributes
+    needed to diff using `preset` (and/or the low level API kwargs in `kwargs`).
+    Use `side="B"` for new trees if the attr-maps mapA and mapB are different.
+    The values of the attributes in `fingerprint_attrs` (e.g. long descriptions)
+    are replaced by their sha1 hashes, so changes are still detected but the diff
+    will report the hashes instead of the values.
+    """
+    plan = get_plan(preset=preset, **kwargs)
+    keep = _node_filter(plan, side, children_key)
+    fingerprint_attrs = frozenset(fingerprint_attrs)
+    if isinstance(source, str):
+        with open(source, 'rb') as infile:
+            reader = JSONStreamReader(infile)
+            root, num_nodes = _read_tree(reader, keep, children_key, fingerprint_attrs)
+            content_hash = reader.content_hash()
+    else:
+        reader = JSONStreamReader(source)
+        root, num_nodes = _read_tree(reader, keep, children_key, fingerprint_attrs)
+        content_hash = reader.content_hash()
+    if fingerprint_attrs:
+        options = repr(sorted(fingerprint_attrs))
+        content_hash = hashlib.sha1((content_hash + options).encode('utf-8')).hexdigest()
+    return TreeStore(root, content_hash, num_nodes, plan_key=plan.key)
+
+
+def _read_tree(reader, keep, children_key, fingerprint_attrs):
+    """
+    Parse the tree iteratively (the `stack` contains the nodes whose children
+    are being read) and return the root node and the number of nodes.
+    """
+    reader.expect('{')
+    root = node = {}
+    num_nodes = 1
+    stack = []
+    first = True        # True when no members of `node` have been read yet
+    while True:
+        char = reader.peek()
+        if char == '}':
+            reader.pos += 1
+            if not stack:
+                return root, num_nodes
+            char = reader.peek()
+            if char == ',':
+                # next sibling node
+                reader.pos += 1
+                reader.expect('{')
+                node = {}
+                stack[-1][children_key].append(node)
+                num_nodes += 1
+                first = True
+            elif char == ']':
+                # back to the parent node
+                reader.pos += 1
+                node = stack.pop()
+                first = False
+            else:
+                raise ValueError('Expected , or ] but found ' + repr(char) + ' in JSON tree')
+            continue
+        key = reader.read_member_key(first=first)
+        first = False
+        if key == children_key and reader.peek() == '[':
+            reader.pos += 1
+            node[children_key] = []
+            if reader.peek() == ']':
+                reader.pos += 1
+                continue
+            reader.expect('{')
+            stack.append(node)
+            node = {}
+            stack[-1][children_key].append(node)
+            num_nodes += 1
+            first = True
+            continue
+        value = reader.read_value()
+        keep_key = keep(key)
+        if keep_key is False:
+            continue
+        if keep_key is not True:
+            value = keep_key(value)
+        if key in fingerprint_attrs:
+            value = _fingerprint(value)
+        node[key] = value
+
+
+def _node_filter(plan, side, children_key):
+    """
+    Returns a function that takes an attribute key and returns True to keep the
+    value, False to drop it, or a function to apply to the value before keeping it.
+    """
+    amap = plan.mapA if side == "A" else plan.mapB
+    always_keep = set(amap.values())
+    for attr in ['node_id', 'content_id', 'sort_order', 'kind', 'kind_id']:
+        always_keep.add(amap.get(attr, attr))
+    setlike_keys = set(amap.get(attr, attr) for attr in plan.setlike_attrs)
+    ai_key = plan.assessment_items_key
+    files_exclude_keys = plan.files_exclude_keys
+    ai_exclude_keys = plan.assessment_items_exclude_keys
+
+    def strip_files(files):
+        if not isinstance(files, list) or not files_exclude_keys:
+            return files
+        return [_strip(file, files_exclude_keys) for file in files]
+
+    def strip_assessment_items(ais):
+        if not isinstance(ais, list):
+            return ais
+        stripped = []
+        for ai in ais:
+            if isinstance(ai, dict):
+                ai = _strip(ai, ai_exclude_keys)
+                if 'files' in ai:
+                    ai['files'] = strip_files(ai['files'])
+            stripped.append(ai)
+        return stripped
+
+    def keep(key):
+        if key in always_keep or key in setlike_keys:
+            return True
+        if key == 'files':
+            return strip_files if plan.diff_files else False
+        if ai_key and key == ai_key:
+            return strip_assessment_items
+        if key in plan.exclude_attrs:
+            return False
+        if plan.attrs is not None:
+            return key in plan.attrs
+        return True
+
+    return keep
+
+
+def _strip(adict, exclude_keys):
+    return dict((key, val) for key, val in adict.items() if key not in exclude_keys)
+
+
+def _fingerprint(value):
+    encoded = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import os
+
+from .compact import CompactNode
+from .hashing import SubtreeHashes
+from .loaders import get_root
+from .plans import get_plan
+from .treediffs import DiffContext, SummaryContext, finish_diff, get_hashes
+
+
+# PARALLEL DIFFS
+################################################################################
+# The diff of the top-level topics of a channel are independent of each other:
+# the traversal visits the subtree of each common top-level node completely
+# before moving on to the next one, and moves are only detected after the
+# traversal is done. The `treediff_parallel` function diffs the root nodes in the
+# main process, sends the pairs of matched top-level nodes to a pool of worker
+# processes, and appends the partial diffs of the workers in the same order as
+# the serial traversal, so move detection (and the other phases of the diff)
+# give the same result as `treediff`.
+# The trees (and subtree hashes) are sent to each worker once when the worker
+# starts, and the tasks only refer to the top-level nodes by their positions.
+
+_worker_state = {}
+
+
+def treediff_parallel(treeA, treeB, preset=None, format="simplified", sort_order_changes=False,
+                      attrs=None, exclude_attrs=[], mapA={}, mapB={},
+                      assessment_items_key='assessment_items', setlike_attrs=['tags'],
+                      detached=False, skip_unchanged=False, hashesA=None, hashesB=None,
+                      workers=None):
+    """
+    Compute the same diff as `treediff` using `workers` processes (defaults to
+    the number of CPUs) to diff the matched top-level subtrees in parallel.
+    The diff nodes of the subtrees diffed by the workers are copies, but the
+    ones for the root nodes reference the values in the trees (see `detached`).
+    """
+    treeA, treeB = get_root(treeA), get_root(treeB)
+    plan = get_plan(preset=preset,
+                    attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
+                    assessment_items_key=assessment_items_key,
+                    setlike_attrs=setlike_attrs)
+    hashesA, hashesB = get_hashes(treeA, treeB, plan, skip_unchanged=skip_unchanged,
+                                  hashesA=hashesA, hashesB=hashesB)
+
+    # 1. diff the root nodes and match their children
+    context_class = SummaryContext if format == "summary" else DiffContext
+    ctx = context_class(plan, hashesA=hashesA, hashesB=hashesB)
+    ctx.check_fingerprints(treeA, treeB)
+    ctx.visit(None, treeA, None, treeB, root=True)
+
+    # 2. diff the common top-level subtrees in the order of the serial traversal
+    tasks = list(reversed(ctx.stack))
+    ctx.stack = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            ctx.push(*task)
+            ctx.run()
+    else:
+        positionsA = _positions(treeA.get('children', []))
+        positionsB = _positions(treeB.get('children', []))
+        jobs = [(parent_idA, positionsA[_node_key(nodeA)], parent_idB, positionsB[_node_key(nodeB)])
+                for parent_idA, nodeA, parent_idB, nodeB, _ in tasks]
+        digestsA = hashesA.digests if hashesA is not None else None
+        digestsB = hashesB.digests if hashesB is not None else None
+        initargs = (treeA, treeB, plan, context_class, digestsA, digestsB)
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                 initializer=_init_worker, initargs=initargs) as executor:
+            for state in executor.map(_diff_subtree, jobs):
+                ctx.merge_state(state)
+
+    # 3. detect moves and format the diff
+    diff = finish_diff(ctx, treeA, treeB, format=format, sort_order_changes=sort_order_changes)
+    if detached:
+        diff = copy.deepcopy(diff)
+    return diff
+
+
+def _node_key(node):
+    # views of compact tree nodes are created on access, so use their position
+    if isinstance(node, CompactNode):
+        return node.pos
+    return id(node)
+
+
+def _positions(children):
+    positions = {}
+    for i, child in enumerate(children):
+        positions[_node_key(child)] = i
+    return positions
+
+
+def _init_worker(treeA, treeB, plan, context_class, digestsA, digestsB):
+    """
+    Store the trees in the worker process and rebuild the subtree hashes (which
+    look up nodes by identity, so they can't be sent to the worker as they are).
+    """
+    _worker_state['treeA'] = treeA
+    _worker_state['treeB'] = treeB
+    _worker_state['plan'] = plan
+    _worker_state['context_class'] = context_class
+    _worker_state['hashesA'] = None
+    _worker_state['hashesB'] = None
+    if digestsA is not None and digestsB is not None:
+        _worker_state['hashesA'] = SubtreeHashes(treeA, plan, side="A", digests=digestsA)
+        _worker_state['hashesB'] = SubtreeHashes(treeB, plan, side="B", digests=digestsB)
+
+
+def _diff_subtree(job):
+    """
+    Diff the pair of top-level nodes in `job` and return the changes found.
+    """
+    parent_idA, positionA, parent_idB, positionB = job
+    state = _worker_state
+    treeA, treeB = state['treeA'], state['treeB']
+    ctx = state['context_class'](state['plan'], hashesA=state['hashesA'], hashesB=state['hashesB'])
+    ctx.check_fingerprints(treeA, treeB)
+    ctx.push(parent_idA, treeA['children'][positionA], parent_idB, treeB['children'][positionB])
+    ctx.run()
+    return ctx.get_state()
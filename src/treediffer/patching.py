@@ -0,0 +1,255 @@
+import copy
+
+from .compact import CompactNode
+from .diffutils import TreeIndex
+from .hashing import SubtreeHashes
+from .loaders import get_root
+from .plans import get_plan
+from .treediffs import children_items
+
+
+# PATCHES
+################################################################################
+# The diff `treediff(oldtree, newtree)` can be applied to `oldtree` as a patch to
+# get `newtree`. The old tree is indexed once, so every change in the diff is
+# applied using O(1) lookups: the children are indexed by their (parent_id,
+# node_id, sort_order) position (the same positions the diff uses to match
+# children), and the nodes by (parent_id, node_id). The deleted subtrees and the
+# old positions of moved nodes are removed, the modified attributes are updated,
+# and the added nodes and the new positions of moved nodes are created from their
+# attributes and merged into the children lists by sort order. The total work is
+# proportional to the size of the old tree plus the size of the diff.
+
+
+def apply_diff(tree, diff, preset=None, hashesB=None, detached=False, **kwargs):
+    """
+    Apply the `diff` between `tree` and a new tree to `tree` (modified in place)
+    and return the patched tree. Use the same `preset` and low level API kwargs
+    that were used to compute the diff. All the diff formats except `summary`
+    can be applied, but the nodes whose sort order changed are only included in
+    the `raw` format and in the other formats when `sort_order_changes=True`.
+    Pass in the `SubtreeHashes` of the new tree as `hashesB` to check that the
+    patched tree has the same root hash (raises ValueError otherwise).
+    The attribute values in the diff are used without copying them, so the patched
+    tree shares them with the new tree unless `detached=True`.
+    """
+    root = get_root(tree)
+    if isinstance(root, CompactNode):
+        raise ValueError('Compact trees are read-only and cannot be patched')
+    if not isinstance(diff.get('nodes_deleted'), list):
+        raise ValueError('Cannot apply a diff in the summary format')
+    plan = get_plan(preset=preset, **kwargs)
+    if hashesB is not None and hashesB.plan_key != plan.key:
+        raise ValueError('Subtree hashes were computed using a different diff plan')
+
+    nodes_moved = list(iter_diff_nodes(diff.get('nodes_moved', [])))
+    patch = PatchContext(root, plan, detached=detached)
+    patch.delete_nodes(list(iter_diff_nodes(diff['nodes_deleted'])) + nodes_moved)
+    patch.modify_nodes(diff['nodes_modified'])
+    patch.add_nodes(list(iter_diff_nodes(diff['nodes_added'])) + nodes_moved)
+    patch.update_children()
+
+    if hashesB is not None:
+        hashes = SubtreeHashes(root, plan, side="A")
+        if hashes.root_digest != hashesB.root_digest:
+            raise ValueError('Patched tree does not match the new tree: root hash '
+                             + hashes.root_digest + ' != ' + hashesB.root_digest)
+    return root
+
+
+class PatchContext(object):
+    """
+    The index of the tree being patched and the changes applied so far.
+    Children are only moved between lists by `update_children` at the end, so
+    all the lookups are done on the tree as it was before the patch.
+    """
+
+    def __init__(self, tree, plan, detached=False):
+        self.tree = tree
+        self.plan = plan
+        self.detached = detached
+        self.index = TreeIndex(tree, by=plan.node_id_keyA)
+        self.root_id = tree.get(plan.root_node_id_keyA)
+        self.root_idB = self.root_id    # updated if the root is modified
+        self.positions = {}         # (parent_id, node_id, sort_order) --> pos
+        self.node_positions = {}    # (parent_id, node_id) --> pos (first occurence)
+        self.deleted = set()        # id of the deleted nodes
+        self.parents = {}           # id(parent) --> parent whose children changed
+        self.added_children = {}    # id(parent) --> [(sort_order, node), ...]
+        self.positions_added = {}   # (id(parent), node_id, sort_order) --> node
+        self.keys = _node_keys(plan)
+        self._index_positions()
+
+    def _index_positions(self):
+        node_id_key, sort_order_key = self.plan.node_id_keyA, self.plan.sort_order_keyA
+        nodes, parents = self.index.nodes, self.index.parents
+        counts = [0] * len(nodes)   # number of children of each node seen so far
+        for pos in range(1, len(nodes)):
+            node, parent_pos = nodes[pos], parents[pos]
+            counts[parent_pos] += 1
+            sort_order = node.get(sort_order_key, None)
+            if sort_order is None:
+                sort_order = float(counts[parent_pos])  # 1-based indexitng
+            parent_id = self.root_id if parent_pos == 0 else nodes[parent_pos][node_id_key]
+            node_id = node[node_id_key]
+            self.positions.setdefault((parent_id, node_id, sort_order), pos)
+            self.node_positions.setdefault((parent_id, node_id), pos)
+
+    def delete_nodes(self, nodes_deleted):
+        """
+        Mark the nodes at the old positions of `nodes_deleted` as deleted.
+        """
+        nodes, parents = self.index.nodes, self.index.parents
+        for nd in nodes_deleted:
+            position = (nd['old_parent_id'], nd['old_node_id'], nd['old_sort_order'])
+            pos = self.positions.get(position)
+            if pos is None:
+                raise ValueError('Cannot delete node ' + repr(position) + ': not found in tree')
+            parent = nodes[parents[pos]]
+            self.deleted.add(id(nodes[pos]))
+            self.parents[id(parent)] = parent
+
+    def modify_nodes(self, nodes_modified):
+        """
+        Update the attributes of the nodes in `nodes_modified`.
+        """
+        amap = self.plan.mapA
+        for nm in nodes_modified:
+            if nm['parent_id'] is None:
+                node = self.tree
+                self.root_idB = nm['node_id']
+            else:
+                parent_id = nm['parent_id']
+                if parent_id == self.root_idB:
+                    parent_id = self.root_id
+                pos = self.node_positions.get((parent_id, nm['node_id']))
+                if pos is None:
+                    raise ValueError('Cannot modify node ' + repr(nm['node_id']) + ': not found in tree')
+                node = self.index.nodes[pos]
+            attributes = nm['attributes']
+            for attr in nm.get('added', []) + nm.get('modified', []):
+                node[amap.get(attr, attr)] = self._value(attributes[attr]['value'])
+            for attr in nm.get('deleted', []):
+                node.pop(amap.get(attr, attr), None)
+
+    def add_nodes(self, nodes_added):
+        """
+        Create the nodes in `nodes_added` and add them to their parents. The
+        parent of each node is the last added node with its `parent_id` (added
+        subtrees are flattened in pre-order), or else the node in the tree.
+        Raw diffs can report the same node more than once (moved nodes are also
+        in the added list, and the common nodes inside a subtree whose sort order
+        changed are diffed as well), so each position of a parent is added once.
+        """
+        created = {}    # node_id --> last created node
+        pending = []
+        for na in nodes_added:
+            node = dict((self.keys.get(key, key), self._value(val['value']))
+                        for key, val in na['attributes'].items())
+            parent = created.get(na['parent_id'])
+            if parent is None:
+                parent = self._tree_node(na['parent_id'])
+            if parent is None:
+                pending.append((na, node))  # parent is added later in the diff
+                created[na['node_id']] = node
+            elif self._add_child(parent, na['node_id'], na['sort_order'], node) is node:
+                created[na['node_id']] = node
+        for na, node in pending:
+            parent = created.get(na['parent_id'])
+            if parent is None:
+                raise ValueError('Cannot add node ' + repr(na['node_id']) + ': parent '
+                                 + repr(na['parent_id']) + ' not found')
+            added = self._add_child(parent, na['node_id'], na['sort_order'], node)
+            if added is not node:
+                # the position was added after this node got its children
+                self._merge_children(node, added)
+
+    def _tree_node(self, node_id):
+        """
+        Returns the first node of the tree with `node_id` that was not deleted.
+        """
+        if node_id == self.root_id or node_id == self.root_idB:
+            return self.tree
+        for node in self.index.getall(node_id):
+            if id(node) not in self.deleted:
+                return node
+        return None
+
+    def _add_child(self, parent, node_id, sort_order, node):
+        """
+        Add `node` to the children of `parent` unless the position was already
+        added. Returns the node at the position.
+        """
+        position = (id(parent), node_id, sort_order)
+        if position in self.positions_added:
+            return self.positions_added[position]
+        self.positions_added[position] = node
+        self.parents[id(parent)] = parent
+        self.added_children.setdefault(id(parent), []).append((sort_order, node))
+        return node
+
+    def _merge_children(self, source, target):
+        """
+        Move the children added to the `source` node to the `target` node.
+        """
+        node_id_key = self.plan.node_id_keyA
+        stack = [(source, target)]
+        while stack:
+            source, target = stack.pop()
+            for sort_order, child in self.added_children.pop(id(source), []):
+                added = self._add_child(target, child[node_id_key], sort_order, child)
+                if added is not child:
+                    stack.append((child, added))
+
+    def _value(self, value):
+        if self.detached:
+            return copy.deepcopy(value)
+        return value
+
+    def update_children(self):
+        """
+        Remove the deleted children and insert the added children (by sort order)
+        in the children lists of all the nodes whose children changed.
+        """
+        node_id_key, sort_order_key = self.plan.node_id_keyA, self.plan.sort_order_keyA
+        deleted = self.deleted
+        for key, parent in self.parents.items():
+            if id(parent) in deleted:
+                continue
+            children = parent.get('children', [])
+            added = self.added_children.get(key)
+            if not added:
+                parent['children'] = [child for child in children if id(child) not in deleted]
+                continue
+            items, _ = children_items(children, node_id_key, sort_order_key)
+            merged = [(sort_order, child) for _, sort_order, child in items if id(child) not in deleted]
+            merged.extend(added)
+            merged.sort(key=lambda item: item[0])
+            parent['children'] = [child for _, child in merged]
+
+
+def iter_diff_nodes(difflist):
+    """
+    Yields the diff nodes in `difflist` and the diff nodes nested in their
+    `children` (restructured diffs) in pre-order.
+    """
+    stack = list(reversed(difflist))
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.get('children', [])))
+
+
+def _node_keys(plan):
+    """
+    Returns the dict of the keys of new tree nodes (mapB) that are different in
+    the nodes of the old tree (mapA), used to rename the attributes of added nodes.
+    """
+    keys = {}
+    for attr in plan.map_keys:
+        if attr.startswith('root.'):
+            continue
+        keyA, keyB = plan.mapA.get(attr, attr), plan.mapB.get(attr, attr)
+        if keyA != keyB:
+            keys[keyB] = keyA
+    return keys
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+
+from .presets import diff_presets
+
+
+# DIFF PLANS
+################################################################################
+# A diff plan is the compiled form of the "low level" API kwargs (attrs,
+# exclude_attrs, mapA, mapB, assessment_items_key, setlike_attrs) that contains
+# everything the diff functions need to look up for every node pair precomputed
+# (frozen sets, attribute key pairs, id keys), so it is built once per treediff.
+
+LL_DEFAULTS = dict(
+    attrs=None,
+    exclude_attrs=[],
+    mapA={},
+    mapB={},
+    assessment_items_key='assessment_items',
+    setlike_attrs=['tags'],
+)
+
+MAX_SIGNATURES = 4096       # max number of key signatures cached per plan
+MAX_CACHED_PLANS = 32       # max number of plans kept (least recently used evicted)
+
+_plans_cache = OrderedDict()    # plan key --> DiffPlan
+
+
+class DiffPlan(object):
+    """
+    Immutable, precompiled version of the low level API kwargs. Create plans
+    using `compile_plan` or `get_plan` so that plans are cached and reused.
+    """
+
+    def __init__(self, attrs=None, exclude_attrs=[], mapA={}, mapB={},
+                 assessment_items_key='assessment_items', setlike_attrs=['tags']):
+        self.attrs = tuple(attrs) if attrs is not None else None
+        self.exclude_attrs = frozenset(exclude_attrs)
+        self.mapA = dict(mapA)
+        self.mapB = dict(mapB)
+        self.assessment_items_key = assessment_items_key
+        self.setlike_attrs = tuple(setlike_attrs)
+        self.key = _plan_key(attrs, exclude_attrs, mapA, mapB, assessment_items_key, setlike_attrs)
+
+        # id keys
+        self.node_id_keyA = mapA.get('node_id', 'node_id')
+        self.node_id_keyB = mapB.get('node_id', 'node_id')
+        self.content_id_keyA = mapA.get('content_id', 'content_id')
+        self.content_id_keyB = mapB.get('content_id', 'content_id')
+        self.sort_order_keyA = mapA.get('sort_order', 'sort_order')
+        self.sort_order_keyB = mapB.get('sort_order', 'sort_order')
+        self.root_node_id_keyA = mapA.get('root.node_id', 'node_id')
+        self.root_node_id_keyB = mapB.get('root.node_id', 'node_id')
+        self.root_content_id_keyB = mapB.get('root.content_id', 'content_id')
+
+        # assessment items keys
+        self.assessment_id_keyA = mapA.get('assessment_id', 'assessment_id')
+        self.assessment_id_keyB = mapB.get('assessment_id', 'assessment_id')
+        self.order_keyA = mapA.get('order', 'order')
+        self.order_keyB = mapB.get('order', 'order')
+
+        # nested exclusions for files and assessment items
+        self.diff_files = 'files' not in self.exclude_attrs
+        self.files_exclude_keys = _nested_keys(exclude_attrs, 'files.')
+        self.assessment_items_exclude_keys = _nested_keys(exclude_attrs, 'assessment_items.')
+
+        # attributes that are not compared as regular attributes
+        skip_attrs = set(self.exclude_attrs)
+        skip_attrs.update(self.setlike_attrs)
+        skip_attrs.update(['files', 'children'])
+        if assessment_items_key:
+            skip_attrs.add(assessment_items_key)
+        self.skip_attrs = frozenset(skip_attrs)
+        self.map_keys = frozenset(mapA.keys()).union(mapB.keys())
+        self.mapA_vals = frozenset(mapA.values())
+        self.mapB_vals = frozenset(mapB.values())
+
+        # comparator slots: (attr, attrA, attrB) key pairs for each comparison
+        self.setlike_pairs = tuple(self._key_pair(attr) for attr in self.setlike_attrs)
+        if self.attrs is not None:
+            self.regular_pairs = self._key_pairs(self.attrs)
+        else:
+            self.regular_pairs = None
+        self._signatures = {}   # (keysA, keysB) --> regular attrs key pairs
+
+    def _key_pair(self, attr):
+        return (attr, self.mapA.get(attr, attr), self.mapB.get(attr, attr))
+
+    def _key_pairs(self, attrs):
+        return tuple(self._key_pair(attr) for attr in attrs if attr not in self.skip_attrs)
+
+    def regular_attrs(self, nodeA, nodeB):
+        """
+        Returns the (attr, attrA, attrB) key pairs of the regular attributes to
+        compare for `nodeA` and `nodeB`. When `attrs` is None, the attributes are
+        computed from the keys of the nodes and cached per key signature.
+        """
+        if self.regular_pairs is not None:
+            return self.regular_pairs
+        signature = (tuple(nodeA), tuple(nodeB))
+        pairs = self._signatures.get(signature)
+        if pairs is None:
+            attrs = set(self.map_keys)
+            for keyA in signature[0]:
+                if keyA not in self.mapA_vals:
+                    attrs.add(keyA)
+            for keyB in signature[1]:
+                if keyB not in self.mapB_vals:
+                    attrs.add(keyB)
+            pairs = self._key_pairs(sorted(attrs))
+            if len(self._signatures) >= MAX_SIGNATURES:
+                self._signatures.clear()
+            self._signatures[signature] = pairs
+        return pairs
+
+    def side_key(self, side="A"):
+        """
+        Returns the part of the plan key that applies to one side of the diff,
+        i.e. the key with the attr-map of this tree and only the attribute names
+        (not the keys) of the attr-map of the other tree, since the attributes
+        compared for every node include all the mapped attributes.
+        """
+        attrs, exclude_attrs, mapA, mapB, assessment_items_key, setlike_attrs = self.key
+        amap = mapA if side == "A" else mapB
+        map_keys = tuple(sorted(self.map_keys))
+        return (attrs, exclude_attrs, amap, map_keys, assessment_items_key, setlike_attrs)
+
+    def kwargs(self):
+        """
+        Returns the low level API kwargs this plan was compiled from.
+        """
+        return dict(
+            attrs=list(self.attrs) if self.attrs is not None else None,
+            exclude_attrs=sorted(self.exclude_attrs),
+            mapA=dict(self.mapA),
+            mapB=dict(self.mapB),
+            assessment_items_key=self.assessment_items_key,
+            setlike_attrs=list(self.setlike_attrs),
+        )
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_signatures'] = {}
+        return state
+
+
+def _nested_keys(exclude_attrs, prefix):
+    return frozenset(attr[len(prefix):] for attr in exclude_attrs if attr.startswith(prefix))
+
+
+def _plan_key(attrs, exclude_attrs, mapA, mapB, assessment_items_key, setlike_attrs):
+    return (
+        tuple(attrs) if attrs is not None else None,
+        tuple(sorted(exclude_attrs)),
+        tuple(sorted(mapA.items())),
+        tuple(sorted(mapB.items())),
+        assessment_items_key,
+        tuple(setlike_attrs),
+    )
+
+
+def compile_plan(attrs=None, exclude_attrs=[], mapA={}, mapB={},
+                 assessment_items_key='assessment_items', setlike_attrs=['tags']):
+    """
+    Returns the `DiffPlan` for the low level API kwargs, reusing cached plans.
+    """
+    key = _plan_key(attrs, exclude_attrs, mapA, mapB, assessment_items_key, setlike_attrs)
+    plan = _plans_cache.get(key)
+    if plan is None:
+        plan = DiffPlan(attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
+                        assessment_items_key=assessment_items_key, setlike_attrs=setlike_attrs)
+        _plans_cache[key] = plan
+        if len(_plans_cache) > MAX_CACHED_PLANS:
+            _plans_cache.popitem(last=False)
+    else:
+        _plans_cache.move_to_end(key)
+    return plan
+
+
+def get_plan(preset=None, **kwargs):
+    """
+    Returns the `DiffPlan` for the diff `preset` (if specified), where the values
+    in the preset take precedence over the low level API kwargs in `kwargs`.
+    """
+    ll_kwargs = dict(LL_DEFAULTS)
+    ll_kwargs.update(kwargs)
+    if preset is not None and preset in diff_presets:
+        ll_kwargs.update(diff_presets[preset])
+    return compile_plan(**ll_kwargs)
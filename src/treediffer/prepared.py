@@ -0,0 +1,134 @@
+import copy
+
+from .compact import CompactNode
+from .diffutils import TreeIndex
+from .hashing import SubtreeHashes
+from .loaders import get_root
+from .plans import get_plan
+from .treediffs import DiffContext, SummaryContext, children_items, file_fingerprint, finish_diff
+
+
+# PREPARED TREES
+################################################################################
+# When the same old tree is diffed against several new trees (e.g. the Studio
+# main tree against the staging tree, a re-run, and an older publish), the work
+# that depends only on the old tree can be done once: compiling the plan,
+# building the `TreeIndex` used to restructure the diff, matching the children
+# of each node by (node_id, sort_order), computing the fingerprints of the files
+# (of nodes and assessment items), and computing the subtree hashes.
+# A `PreparedTree` keeps all of these so each diff only pays for the traversal
+# of the new tree. The prepared tree must not be modified after it is prepared.
+
+
+class PreparedTree(object):
+    """
+    The old tree `tree` prepared for diffs using `preset` (and/or the low level
+    API kwargs in `kwargs`). Use `diff(treeB, ...)` to diff it against new trees.
+    """
+
+    def __init__(self, tree, preset=None, **kwargs):
+        self.tree = get_root(tree)
+        self.plan = get_plan(preset=preset, **kwargs)
+        self.index = TreeIndex(self.tree, by=self.plan.node_id_keyA)
+        # children items of each node by the id of the children list (the nodes
+        # of compact trees create a new list on access so they are not cached)
+        self.children_items = {}
+        for node in self.index.nodes:
+            if 'children' in node and not isinstance(node, CompactNode):
+                children = node['children']
+                self.children_items[id(children)] = children_items(
+                    children, self.plan.node_id_keyA, self.plan.sort_order_keyA)
+        self.files_fingerprints = {}   # id(files list) --> file fingerprints
+        if not isinstance(self.tree, CompactNode):
+            self._add_files_fingerprints()
+        self._hashes = None
+
+    def _add_files_fingerprints(self):
+        plan = self.plan
+        exclude_keys = plan.files_exclude_keys
+        ai_key = plan.assessment_items_key
+        files_lists = []
+        for node in self.index.nodes:
+            if plan.diff_files and isinstance(node.get('files'), list):
+                files_lists.append(node['files'])
+            if ai_key and isinstance(node.get(ai_key), list):
+                for ai in node[ai_key]:
+                    if isinstance(ai, dict) and isinstance(ai.get('files'), list):
+                        files_lists.append(ai['files'])
+        for files in files_lists:
+            fingerprints = [file_fingerprint(file, exclude_keys) for file in files]
+            self.files_fingerprints[id(files)] = fingerprints
+
+    @property
+    def hashes(self):
+        """
+        The subtree hashes of the tree (computed on first use).
+        """
+        if self._hashes is None:
+            self._hashes = SubtreeHashes(self.tree, self.plan, side="A")
+        return self._hashes
+
+    def diff(self, treeB, format="simplified", sort_order_changes=False,
+             detached=False, skip_unchanged=False, hashesB=None):
+        """
+        Compute the diff between the prepared tree and the new tree `treeB`,
+        which is the same as `treediff(tree, treeB, ...)` with the prepared options.
+        """
+        treeA, treeB = self.tree, get_root(treeB)
+        plan = self.plan
+        hashesA = None
+        if skip_unchanged or hashesB is not None:
+            hashesA = self.hashes
+            if hashesB is None:
+                hashesB = SubtreeHashes(treeB, plan, side="B")
+            if hashesB.plan_key != plan.key:
+                raise ValueError('Subtree hashes were computed using a different diff plan')
+        if format == "summary":
+            ctx = PreparedSummaryContext(self, hashesA=hashesA, hashesB=hashesB)
+        else:
+            ctx = PreparedContext(self, hashesA=hashesA, hashesB=hashesB)
+        ctx.check_fingerprints(treeA, treeB)
+        ctx.push(None, treeA, None, treeB, root=True)
+        ctx.run()
+        diff = finish_diff(ctx, treeA, treeB, format=format, sort_order_changes=sort_order_changes,
+                           indexA=self.index)
+        if detached:
+            diff = copy.deepcopy(diff)
+        return diff
+
+
+class PreparedContext(DiffContext):
+    """
+    Diff traversal that uses the children items and file fingerprints of the
+    prepared old tree.
+    """
+
+    def __init__(self, prepared, hashesA=None, hashesB=None):
+        DiffContext.__init__(self, prepared.plan, hashesA=hashesA, hashesB=hashesB)
+        self.prepared_items = prepared.children_items
+        self.files_fingerprintsA = prepared.files_fingerprints
+
+    def children_itemsA(self, childrenA):
+        cached = self.prepared_items.get(id(childrenA))
+        if cached is None:
+            return DiffContext.children_itemsA(self, childrenA)
+        return cached
+
+
+class PreparedSummaryContext(PreparedContext, SummaryContext):
+    """
+    Summary diff traversal that uses the children items and file fingerprints
+    of the prepared old tree.
+    """
+
+    def __init__(self, prepared, hashesA=None, hashesB=None):
+        SummaryContext.__init__(self, prepared.plan, hashesA=hashesA, hashesB=hashesB)
+        self.prepared_items = prepared.children_items
+        self.files_fingerprintsA = prepared.files_fingerprints
+
+
+def prepare_tree(tree, preset=None, **kwargs):
+    """
+    Prepare the old tree `tree` to be diffed against several new trees.
+    """
+    return PreparedTree(tree, preset=preset, **kwargs)
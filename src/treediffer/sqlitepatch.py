@@ -0,0 +1,268 @@
+from bisect import bisect_left
+import json
+import logging
+import sqlite3
+
+from .patching import iter_diff_nodes
+from .plans import get_plan
+
+logger = logging.getLogger('treediffs')
+
+
+# SQLITE PATCHES
+################################################################################
+# Kolibri stores the content nodes of a channel as rows of the `ContentNode` table
+# linked by `parent_id`, with the MPTT annotations `lft`, `rght` (the pre-order
+# numbers of entering and leaving each node), `level`, and `tree_id`. To apply a
+# diff to a channel database, the deleted rows are removed, the added rows are
+# inserted, and the modified columns are updated using batched `executemany`
+# statements. Then the MPTT annotations are computed again by walking down from
+# the root only into the nodes whose subtrees contain a node whose children
+# changed: every other subtree is unchanged, so its rows are shifted by the
+# change in the numbering to its left using a single range update. This keeps
+# the work proportional to the size of the diff (and the depth of the tree).
+
+KOLIBRI_CONTENTNODE_TABLE = 'content_contentnode'
+MPTT_COLUMNS = ['lft', 'rght', 'level', 'tree_id']
+MAX_VARIABLES = 500     # max number of ids per SELECT ... IN (...) query
+
+
+def apply_diff_sqlite(db, diff, table=KOLIBRI_CONTENTNODE_TABLE, preset="kolibri", **kwargs):
+    """
+    Apply the `diff` between the tree stored in the ContentNode `table` of the
+    SQLite database `db` (a path or a `sqlite3.Connection`) and a new tree to
+    the rows of the table in a single transaction. Use the same `preset` and low
+    level API kwargs that were used to compute the diff. Only the columns of the
+    table are written, so attributes stored in other tables (e.g. tags, files,
+    assessment metadata) are not updated. As for `apply_diff`, the nodes whose
+    sort order changed are only included in the `raw` format and in the other
+    formats when `sort_order_changes=True`, so their rows keep the old sort order
+    when the diff was computed without it. Returns a dict with the number of rows
+    `deleted`, `inserted`, and `updated`.
+    """
+    if not isinstance(diff.get('nodes_deleted'), list):
+        raise ValueError('Cannot apply a diff in the summary format')
+    plan = get_plan(preset=preset, **kwargs)
+    conn = db if isinstance(db, sqlite3.Connection) else sqlite3.connect(db)
+    try:
+        with conn:  # commit, or roll back if anything fails
+            patch = SQLitePatch(conn, table, plan)
+            counts = patch.apply(diff)
+    finally:
+        if conn is not db:
+            conn.close()
+    logger.info('Applied diff to ' + table + ': ' + str(counts))
+    return counts
+
+
+class SQLitePatch(object):
+    """
+    Applies diffs to the rows of the ContentNode `table` using the connection
+    `conn` (the caller is responsible for the transaction).
+    """
+
+    def __init__(self, conn, table, plan):
+        self.conn = conn
+        self.table = _quote(table)
+        self.plan = plan
+        self.id_column = plan.node_id_keyA
+        self.sort_order_column = plan.sort_order_keyA
+        self.columns = set(row[1] for row in conn.execute('PRAGMA table_info(' + self.table + ')'))
+        required = [self.id_column, 'parent_id', self.sort_order_column] + MPTT_COLUMNS
+        missing = [column for column in required if column not in self.columns]
+        if missing:
+            raise ValueError('Table ' + table + ' is missing the columns ' + ', '.join(missing))
+        # columns that are set by the patch and not copied from the diff
+        self.computed_columns = frozenset([self.id_column, 'parent_id', self.sort_order_column] + MPTT_COLUMNS)
+
+    def apply(self, diff):
+        nodes_moved = list(iter_diff_nodes(diff.get('nodes_moved', [])))
+        nodes_deleted = list(iter_diff_nodes(diff['nodes_deleted'])) + nodes_moved
+        deleted_ids = set(nd['old_node_id'] for nd in nodes_deleted)
+        nodes_added = {}    # node_id --> diff node (raw diffs can report a node more than once)
+        for na in list(iter_diff_nodes(diff['nodes_added'])) + nodes_moved:
+            nodes_added.setdefault(na['node_id'], na)
+
+        # the rows whose children change (read before the rows are deleted)
+        parent_ids = set(nd['old_parent_id'] for nd in nodes_deleted)
+        parent_ids.update(na['parent_id'] for na in nodes_added.values())
+        dirty_ids = [parent_id for parent_id in parent_ids
+                     if parent_id not in deleted_ids and parent_id not in nodes_added]
+        dirty_rows = self.select_rows(dirty_ids, ['lft', 'tree_id'])
+
+        deleted = self.delete_rows(deleted_ids)
+        inserted = self.insert_rows(nodes_added.values())
+        updated = self.update_rows(diff['nodes_modified'])
+        if dirty_rows or nodes_added:
+            self.update_mptt(dirty_rows, set(nodes_added.keys()))
+        return {'deleted': deleted, 'inserted': inserted, 'updated': updated}
+
+    def select_rows(self, ids, columns):
+        """
+        Returns the list of rows (id, *columns) of the nodes with `ids`.
+        """
+        ids = list(ids)
+        rows = []
+        for start in range(0, len(ids), MAX_VARIABLES):
+            chunk = ids[start:start + MAX_VARIABLES]
+            sql = ('SELECT ' + ', '.join(_quote(col) for col in [self.id_column] + columns)
+                   + ' FROM ' + self.table + ' WHERE ' + _quote(self.id_column)
+                   + ' IN (' + ', '.join('?' * len(chunk)) + ')')
+            rows.extend(self.conn.execute(sql, chunk))
+        return rows
+
+    def delete_rows(self, deleted_ids):
+        sql = 'DELETE FROM ' + self.table + ' WHERE ' + _quote(self.id_column) + ' = ?'
+        cursor = self.conn.executemany(sql, [(node_id,) for node_id in deleted_ids])
+        return cursor.rowcount
+
+    def insert_rows(self, nodes_added):
+        """
+        Insert the rows of the added nodes with placeholder MPTT annotations.
+        """
+        batches = {}    # tuple of columns --> list of rows
+        for na in nodes_added:
+            row = dict((key, _column_value(val['value'])) for key, val in na['attributes'].items()
+                       if key in self.columns and key not in self.computed_columns)
+            row[self.id_column] = na['node_id']
+            row['parent_id'] = na['parent_id']
+            row[self.sort_order_column] = na['sort_order']
+            row.update(lft=0, rght=0, level=0, tree_id=0)
+            columns = tuple(sorted(row))
+            batches.setdefault(columns, []).append([row[col] for col in columns])
+        inserted = 0
+        for columns, rows in batches.items():
+            sql = ('INSERT INTO ' + self.table + ' (' + ', '.join(_quote(col) for col in columns)
+                   + ') VALUES (' + ', '.join('?' * len(columns)) + ')')
+            inserted += self.conn.executemany(sql, rows).rowcount
+        return inserted
+
+    def update_rows(self, nodes_modified):
+        """
+        Update the columns of the modified attributes (deleted attributes are
+        set to NULL).
+        """
+        amap = self.plan.mapA
+        batches = {}    # tuple of columns --> list of rows
+        for nm in nodes_modified:
+            attributes = nm['attributes']
+            row = {}
+            for attr in nm.get('added', []) + nm.get('modified', []):
+                row[amap.get(attr, attr)] = _column_value(attributes[attr]['value'])
+            for attr in nm.get('deleted', []):
+                row[amap.get(attr, attr)] = None
+            columns = tuple(sorted(col for col in row
+                                   if col in self.columns and col not in self.computed_columns))
+            if columns:
+                batches.setdefault(columns, []).append([row[col] for col in columns] + [nm['node_id']])
+        updated = 0
+        for columns, rows in batches.items():
+            sql = ('UPDATE ' + self.table + ' SET ' + ', '.join(_quote(col) + ' = ?' for col in columns)
+                   + ' WHERE ' + _quote(self.id_column) + ' = ?')
+            updated += self.conn.executemany(sql, rows).rowcount
+        return updated
+
+    # MPTT
+    ############################################################################
+
+    def update_mptt(self, dirty_rows, new_ids):
+        """
+        Compute the MPTT annotations of the trees that contain the `dirty_rows`
+        (id, lft, tree_id) whose children changed. The rows in `new_ids` were
+        inserted by the patch and have placeholder annotations.
+        """
+        dirty_lfts = {}     # tree_id --> sorted list of lft of the dirty rows
+        for _, lft, tree_id in dirty_rows:
+            dirty_lfts.setdefault(tree_id, []).append(lft)
+        assigned_ids = set()
+        for tree_id, lfts in dirty_lfts.items():
+            lfts.sort()
+            assigned_ids.update(self._update_tree_mptt(tree_id, lfts, new_ids))
+        orphans = new_ids - assigned_ids
+        if orphans:
+            raise ValueError('Cannot add nodes ' + repr(sorted(orphans)[:10]) + ': parents not found')
+
+    def _update_tree_mptt(self, tree_id, dirty_lfts, new_ids):
+        table, id_column = self.table, _quote(self.id_column)
+        root = self.conn.execute(
+            'SELECT ' + id_column + ', lft, rght, level FROM ' + table
+            + ' WHERE tree_id = ? AND parent_id IS NULL', (tree_id,)).fetchone()
+        if root is None:
+            raise ValueError('Root node of tree ' + str(tree_id) + ' not found')
+        dirty = set(dirty_lfts)
+        children_sql = ('SELECT ' + id_column + ', lft, rght, ' + _quote(self.sort_order_column)
+                        + ' FROM ' + table + ' WHERE parent_id = ?')
+
+        # 1. number the nodes in pre-order, skipping over the unchanged subtrees
+        counter = root[1]
+        segments = []   # (lft, rght, shift) of the unchanged subtrees
+        assigned = []   # (lft, rght, level, tree_id, id) of the visited nodes
+        stack = [(False, root[0], root[1], root[2], root[3])]
+        while stack:
+            leaving, node_id, lft, rght, level = stack.pop()
+            if leaving:
+                assigned.append((lft, counter, level, tree_id, node_id))
+                counter += 1
+                continue
+            is_new = node_id in new_ids
+            if not is_new:
+                pos = bisect_left(dirty_lfts, lft)
+                if pos == len(dirty_lfts) or dirty_lfts[pos] > rght:
+                    # unchanged subtree
+                    segments.append((lft, rght, counter - lft))
+                    counter += rght - lft + 1
+                    continue
+            stack.append((True, node_id, counter, None, level))
+            counter += 1
+            children = self.conn.execute(children_sql, (node_id,)).fetchall()
+            children.sort(key=lambda child: child[1])
+            if is_new or lft in dirty:
+                children.sort(key=_sort_key)
+            for child_id, child_lft, child_rght, _ in reversed(children):
+                stack.append((False, child_id, child_lft, child_rght, level + 1))
+
+        # 2. shift the unchanged subtrees: adjacent subtrees with the same shift are
+        #    merged into one range (the rows between them are visited nodes that
+        #    are set in step 3, or deleted rows)
+        ranges = []
+        for lft, rght, shift in sorted(segments):
+            if ranges and ranges[-1][2] == shift:
+                ranges[-1][1] = rght
+            else:
+                ranges.append([lft, rght, shift])
+        ranges = [shift_range for shift_range in ranges if shift_range[2] != 0]
+        shift_sql = ('UPDATE ' + table + ' SET lft = lft + ?, rght = rght + ?'
+                     ' WHERE tree_id = ? AND lft BETWEEN ? AND ?')
+        if len(ranges) == 1:
+            lft, rght, shift = ranges[0]
+            self.conn.execute(shift_sql, (shift, shift, tree_id, lft, rght))
+        elif ranges:
+            # move the rows above all the old and new numbers first, so the rows
+            # that were already shifted are not matched by the next ranges
+            offset = max(root[2], counter - 1) + 1
+            self.conn.executemany(
+                shift_sql, [(shift + offset, shift + offset, tree_id, lft, rght) for lft, rght, shift in ranges])
+            self.conn.execute(
+                'UPDATE ' + table + ' SET lft = lft - ?, rght = rght - ? WHERE tree_id = ? AND lft >= ?',
+                (offset, offset, tree_id, offset))
+
+        # 3. set the annotations of the visited nodes
+        self.conn.executemany(
+            'UPDATE ' + table + ' SET lft = ?, rght = ?, level = ?, tree_id = ? WHERE ' + id_column + ' = ?',
+            assigned)
+        return set(node_id for _, _, _, _, node_id in assigned if node_id in new_ids)
+
+
+def _sort_key(child):
+    sort_order = child[3]
+    return (sort_order is None, sort_order or 0)
+
+
+def _column_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
@@ -0,0 +1,106 @@
+import time
+
+
+# DIFF STATS
+################################################################################
+# Pass a `DiffStats` collector as `stats` to `treediff` to measure each phase of
+# the diff. The traversal (PHASE 1) is then done by a `StatsContext`, which counts
+# the work done as it visits the nodes, and the other phases are timed as they run.
+# When `stats` is None the plain diff contexts are used, so the traversal does
+# no extra work. The record of each phase is a dict with the counters:
+#   - seconds: wall time of the phase
+#   - nodes_visited: node pairs diffed and nodes in the added and deleted
+#     subtrees (PHASE 1), or diff nodes processed (other phases)
+#   - attribute_comparisons: regular and set-like attributes compared
+#   - file_comparisons: files compared (of both nodes)
+#   - assessment_item_comparisons: assessment items compared (of both nodes)
+#   - nodes_emitted: diff nodes emitted: the nodes of the added and deleted
+#     subtrees (records in the summary format) and the modified nodes (PHASE 1),
+#     or the moved nodes (PHASE 2)
+#   - nodes_copied: diff nodes deep-copied (detach)
+#   - sizes: the lengths of the diff lists after the phase (or the counts of the
+#     summary format)
+
+DIFF_LISTS = ['nodes_deleted', 'nodes_added', 'nodes_moved', 'nodes_modified']
+PHASE_COUNTERS = ['nodes_visited', 'attribute_comparisons', 'file_comparisons',
+                  'assessment_item_comparisons', 'nodes_emitted', 'nodes_copied']
+
+
+class DiffStats(object):
+    """
+    Collects the time and the counters of each phase of a diff in `phases`, a dict
+    phase --> record (see above) in the order the phases ran. The function `hook`
+    (if given) is called with (phase, record) at the end of each phase, e.g. to
+    forward the stats to a metrics system. Use a new collector for each diff.
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.phases = {}
+        self.start_time = None
+
+    def start(self, phase):
+        self.start_time = time.perf_counter()
+
+    def finish(self, phase, sizes=None, **counts):
+        """
+        Record the end of `phase` with the diff list `sizes` and the `counts`.
+        """
+        record = {'seconds': time.perf_counter() - self.start_time}
+        for counter in PHASE_COUNTERS:
+            record[counter] = counts.get(counter, 0)
+        record['sizes'] = sizes or {}
+        self.phases[phase] = record
+        if self.hook is not None:
+            self.hook(phase, record)
+        return record
+
+    @property
+    def seconds(self):
+        """
+        Total wall time of the phases.
+        """
+        return sum(record['seconds'] for record in self.phases.values())
+
+    def totals(self):
+        """
+        Returns the counters summed over all phases.
+        """
+        totals = dict((counter, 0) for counter in PHASE_COUNTERS)
+        for record in self.phases.values():
+            for counter in PHASE_COUNTERS:
+                totals[counter] += record[counter]
+        totals['seconds'] = self.seconds
+        return totals
+
+
+def new_counts():
+    return dict((counter, 0) for counter in PHASE_COUNTERS)
+
+
+def diff_sizes(diff):
+    """
+    Returns the lengths of the lists in `diff` (the counts for summary diffs).
+    """
+    sizes = {}
+    for key in DIFF_LISTS:
+        value = diff.get(key)
+        if isinstance(value, list):
+            sizes[key] = len(value)
+        elif isinstance(value, dict):
+            sizes[key] = value['count']
+    return sizes
+
+
+def count_diff_nodes(diff):
+    """
+    Returns the number of diff nodes in the lists of `diff`, including the
+    children of restructured diff nodes.
+    """
+    count = 0
+    stack = [diff.get(key) for key in DIFF_LISTS if isinstance(diff.get(key), list)]
+    while stack:
+        nodes = stack.pop()
+        count += len(nodes)
+        stack.extend(node['children'] for node in nodes if 'children' in node)
+    return count
@@ -0,0 +1,204 @@
+from collections import deque, namedtuple, OrderedDict
+import json
+import logging
+
+from .loaders import get_root
+from .plans import get_plan
+from .treediffs import DiffContext, flatten_subtree, get_hashes
+
+logger = logging.getLogger('treediffs')
+
+
+# STREAMING DIFFS
+################################################################################
+# The `iter_treediff` generator yields the changes of the simplified diff as
+# `DiffEvent`s while the trees are being traversed, instead of returning the four
+# lists at the end. Modified nodes are yielded as soon as they are found. Added
+# and deleted nodes can be part of a move, so before the traversal we collect the
+# `content_id`s of both trees: a deleted node whose `content_id` does not appear
+# in the new tree (or an added node whose `content_id` does not appear in the old
+# tree) cannot be moved and is yielded right away, while the other added/deleted
+# nodes are kept in a bounded buffer until they are paired into moves (using the
+# same logic as `detect_moves`: the first deleted node with a given `content_id`
+# claims all the added nodes with the same `content_id`).
+
+DELETED, ADDED, MOVED, MODIFIED = 'deleted', 'added', 'moved', 'modified'
+
+class DiffEvent(namedtuple('DiffEvent', ['change', 'node'])):
+    """
+    A change in a tree diff, where `change` is one of deleted, added, moved, and
+    modified, and `node` is the diff node (the same as in the simplified diff).
+    """
+    __slots__ = ()
+
+DEFAULT_MAX_BUFFER = 10000      # max number of added/deleted nodes waiting for a move
+
+
+def iter_treediff(treeA, treeB, preset=None, sort_order_changes=False,
+                  attrs=None, exclude_attrs=[], mapA={}, mapB={},
+                  assessment_items_key='assessment_items', setlike_attrs=['tags'],
+                  max_buffer=DEFAULT_MAX_BUFFER, skip_unchanged=False, hashesA=None, hashesB=None):
+    """
+    Compute the diff between `treeA` (old tree) and `treeB` (new tree) and yield
+    the changes as `DiffEvent`s as they are found. The events contain the same
+    nodes as the lists of the simplified diff, but in a different order.
+    At most `max_buffer` added and deleted nodes wait to be paired into moves
+    (use `max_buffer=None` for no limit). When the buffer is full, the oldest
+    nodes are yielded as added/deleted so some moves might not be detected.
+    """
+    treeA, treeB = get_root(treeA), get_root(treeB)
+    plan = get_plan(preset=preset,
+                    attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
+                    assessment_items_key=assessment_items_key,
+                    setlike_attrs=setlike_attrs)
+    hashesA, hashesB = get_hashes(treeA, treeB, plan, skip_unchanged=skip_unchanged,
+                                  hashesA=hashesA, hashesB=hashesB)
+
+    ctx = StreamingContext(plan, treeA, treeB, sort_order_changes=sort_order_changes,
+                           max_buffer=max_buffer, hashesA=hashesA, hashesB=hashesB)
+    ctx.check_fingerprints(treeA, treeB)
+    ctx.push(None, treeA, None, treeB, root=True)
+    events = ctx.events
+    while ctx.stack:
+        ctx.visit(*ctx.stack.pop())
+        while events:
+            yield events.popleft()
+    ctx.flush()
+    while events:
+        yield events.popleft()
+
+
+def content_ids(tree, content_id_key):
+    """
+    Returns the set of all `content_id`s in `tree`.
+    """
+    found = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if content_id_key in node:
+            found.add(node[content_id_key])
+        if 'children' in node:
+            stack.extend(node['children'])
+    return found
+
+
+class StreamingContext(DiffContext):
+    """
+    Diff traversal that reports the changes as `DiffEvent`s in the `events` queue.
+    """
+
+    def __init__(self, plan, treeA, treeB, sort_order_changes=False,
+                 max_buffer=DEFAULT_MAX_BUFFER, hashesA=None, hashesB=None):
+        DiffContext.__init__(self, plan, hashesA=hashesA, hashesB=hashesB)
+        self.sort_order_changes = sort_order_changes
+        self.max_buffer = max_buffer
+        self.events = deque()
+        self.content_idsA = content_ids(treeA, plan.content_id_keyA)
+        self.content_idsB = content_ids(treeB, plan.content_id_keyB)
+        self.buffer = OrderedDict()     # id(node) --> (change, node) waiting for a move
+        self.waiting_deleted = {}       # content_id --> first deleted node (and duplicates)
+        self.waiting_added = {}         # content_id --> list of added nodes
+        self.claims = {}                # content_id --> deleted node paired with added nodes
+        self.moved_node_ids = set()
+        self.buffer_overflow = False
+
+    def node_modified(self, node, nodeA, nodeB):
+        self.events.append(DiffEvent(MODIFIED, node))
+
+    def subtree_deleted(self, parent_idA, sort_order, nodeA):
+        flatlist = flatten_subtree(parent_idA, sort_order, nodeA, kind="deleted", map=self.plan.mapA)
+        for nd in flatlist:
+            content_id = nd['content_id']
+            if content_id in self.claims:
+                if self.claims[content_id]['old_node_id'] != nd['old_node_id']:
+                    self.events.append(DiffEvent(DELETED, nd))
+                # else the same node was reported twice and it was moved
+            elif content_id in self.waiting_deleted:
+                if self.waiting_deleted[content_id][0]['old_node_id'] == nd['old_node_id']:
+                    self.waiting_deleted[content_id].append(nd)
+                    self._buffer(DELETED, nd)
+                else:
+                    # the first deleted node in the bucket claims the added nodes
+                    self.events.append(DiffEvent(DELETED, nd))
+            elif content_id not in self.content_idsB:
+                self.events.append(DiffEvent(DELETED, nd))
+            elif content_id in self.waiting_added:
+                self.claims[content_id] = nd
+                for na in self.waiting_added.pop(content_id):
+                    del self.buffer[id(na)]
+                    self._moved(nd, na)
+            else:
+                self.waiting_deleted[content_id] = [nd]
+                self._buffer(DELETED, nd)
+
+    def subtree_added(self, parent_idB, sort_order, nodeB):
+        flatlist = flatten_subtree(parent_idB, sort_order, nodeB, kind="added", map=self.plan.mapB)
+        for na in flatlist:
+            content_id = na['content_id']
+            if content_id in self.claims:
+                self._moved(self.claims[content_id], na)
+            elif content_id in self.waiting_deleted:
+                waiting = self.waiting_deleted.pop(content_id)
+                for nd in waiting:
+                    del self.buffer[id(nd)]
+                self.claims[content_id] = waiting[0]
+                self._moved(waiting[0], na)
+            elif content_id not in self.content_idsA:
+                self.events.append(DiffEvent(ADDED, na))
+            else:
+                self.waiting_added.setdefault(content_id, []).append(na)
+                self._buffer(ADDED, na)
+
+    def _moved(self, nd, na):
+        if na['node_id'] in self.moved_node_ids:
+            return  # the same node was reported twice
+        self.moved_node_ids.add(na['node_id'])
+        nm = dict(na)  # shallow copy (attributes are shared with na)
+        nm['old_node_id'] = nd['old_node_id']
+        nm['old_parent_id'] = nd['old_parent_id']
+        nm['old_sort_order'] = nd['old_sort_order']
+        if nm['old_parent_id'] == nm['parent_id'] and nm['old_node_id'] == nm['node_id']:
+            nm['sort_order_change'] = True
+        else:
+            nm['sort_order_change'] = False
+        if self.sort_order_changes or not nm['sort_order_change']:
+            self.events.append(DiffEvent(MOVED, nm))
+
+    def _buffer(self, change, node):
+        self.buffer[id(node)] = (change, node)
+        if self.max_buffer is not None and len(self.buffer) > self.max_buffer:
+            if not self.buffer_overflow:
+                logger.warning('Move buffer full, some node moves might not be detected.')
+                self.buffer_overflow = True
+            self._release_oldest()
+
+    def _release_oldest(self):
+        _, (change, node) = self.buffer.popitem(last=False)
+        content_id = node['content_id']
+        waiting_nodes = self.waiting_deleted if change == DELETED else self.waiting_added
+        waiting = waiting_nodes[content_id]
+        waiting.remove(node)
+        if not waiting:
+            del waiting_nodes[content_id]
+        self.events.append(DiffEvent(change, node))
+
+    def flush(self):
+        """
+        Report all the nodes still in the buffer (not moved) at the end of the diff.
+        """
+        while self.buffer:
+            self._release_oldest()
+
+
+def write_jsonl(events, outfile):
+    """
+    Write the diff `events` to `outfile` as JSON Lines with one event per line
+    of the form {"change": "added", "node": {...}}. Returns the number of events.
+    """
+    count = 0
+    for event in events:
+        outfile.write(json.dumps({'change': event.change, 'node': event.node}, ensure_ascii=False))
+        outfile.write('\n')
+        count += 1
+    return count
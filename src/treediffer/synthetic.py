@@ -0,0 +1,542 @@
+import hashlib
+import json
+import random
+
+from .patching import iter_diff_nodes
+from .plans import get_plan
+
+
+# SYNTHETIC TREES
+################################################################################
+# To benchmark and stress-test the diff, `TreeGenerator` generates channel-like
+# trees of any size in the format of the trees of each preset (the id keys and
+# the keys of mapped attributes come from the preset maps). The nodes of the tree
+# are numbered in breadth-first order like in a complete tree with `width`
+# children per topic, so the children of node k are the nodes k*width+1 to
+# k*width+width, and all the attributes of a node are derived from its number
+# and the `seed`. This way trees are generated node by node (as JSON text or as
+# dicts) and the same tree can be generated again instead of being copied.
+# The mutations of a tree (`TreeGenerator.mutate`) are chosen up front as a set of
+# operations on node numbers (renames, moves, reorders, subtree deletions, clones
+# and question edits) that are applied while the new tree is generated, which
+# also gives the expected diff between the two trees.
+
+LEAF_KINDS = ['video', 'audio', 'document', 'html5']
+LICENSES = ['CC BY', 'CC BY-SA', 'CC BY-NC', 'All Rights Reserved']
+TAGS = ['math', 'science', 'reading', 'writing', 'history', 'art', 'music', 'health']
+
+
+class TreeGenerator(object):
+    """
+    Generates a synthetic tree with `num_nodes` nodes in the format of the trees
+    of the diff `preset` (None, ricecooker, studio, or kolibri): topics with up to
+    `width` children, and leaf nodes of which a fraction of `exercises` are
+    exercises with assessment items. The same arguments give the same tree.
+    Use `build()` to get the tree or `write_json(outfile)` to write it out without
+    building it, and `mutate(...)` to get the generator of a changed tree.
+    """
+
+    def __init__(self, num_nodes, preset=None, seed=0, width=10, exercises=0.2, mutation=None):
+        if num_nodes < 1 or width < 1:
+            raise ValueError('Trees need at least one node and one child per topic')
+        self.num_nodes = num_nodes
+        self.preset = preset
+        self.seed = seed
+        self.width = width
+        self.exercises = exercises
+        self.mutation = mutation
+        plan = get_plan(preset=preset)
+        self.plan = plan
+        self.node_id_key = plan.node_id_keyB
+        self.content_id_key = plan.content_id_keyB
+        self.root_node_id_key = plan.root_node_id_keyB
+        self.root_content_id_key = plan.root_content_id_keyB
+        self.copyright_holder_key = plan.mapB.get('copyright_holder', 'copyright_holder')
+        self.license_key = plan.mapB.get('license_name', 'license_name')
+        self.assessment_items_key = plan.assessment_items_key
+        # studio and kolibri trees store the sort order and the parent of each node
+        self.sort_orders = preset in ['studio', 'kolibri']
+
+    @property
+    def expected(self):
+        """
+        The expected simplified diff (see `TreeMutation.expected`) between the
+        original tree and the tree of this generator.
+        """
+        if self.mutation is None:
+            return {'nodes_deleted': set(), 'nodes_added': set(), 'nodes_moved': set(), 'nodes_modified': {}}
+        return self.mutation.expected
+
+    def mutate(self, seed=0, **changes):
+        """
+        Returns the generator of the tree with the `changes` (see `TreeMutation`)
+        chosen using `seed`.
+        """
+        if self.mutation is not None:
+            raise ValueError('Cannot mutate a mutated tree')
+        mutation = TreeMutation(self, seed=seed, **changes)
+        return TreeGenerator(self.num_nodes, preset=self.preset, seed=self.seed, width=self.width,
+                             exercises=self.exercises, mutation=mutation)
+
+    # SHAPE
+    ############################################################################
+
+    def parent(self, k):
+        return (k - 1) // self.width
+
+    def depth(self, k):
+        depth = 0
+        while k > 0:
+            k = (k - 1) // self.width
+            depth += 1
+        return depth
+
+    def is_ancestor(self, k, descendant):
+        """
+        Returns True if node `k` is `descendant` or one of its ancestors.
+        """
+        while descendant > k:
+            descendant = (descendant - 1) // self.width
+        return descendant == k
+
+    def child_numbers(self, k):
+        """
+        Returns the range of the numbers of the children of node `k` (topics are
+        the nodes with at least one child).
+        """
+        start = k * self.width + 1
+        return range(min(start, self.num_nodes), min(start + self.width, self.num_nodes))
+
+    def iter_subtree(self, k):
+        """
+        Yields the numbers of the nodes in the subtree of node `k` in pre-order.
+        """
+        stack = [k]
+        while stack:
+            k = stack.pop()
+            yield k
+            stack.extend(reversed(self.child_numbers(k)))
+
+    def kind(self, k, rng=None):
+        """
+        Returns the kind of node `k`, drawn from `rng` (the random generator of
+        the attributes of the node) for leaf nodes.
+        """
+        if k == 0 or self.child_numbers(k):
+            return 'topic'
+        if rng is None:
+            rng = self._rng(k)
+        if rng.random() < self.exercises:
+            return 'exercise'
+        return rng.choice(LEAF_KINDS)
+
+    def node_id(self, k, clone=None):
+        return _hexdigest(self.seed, 'node', k, clone)
+
+    def content_id(self, k):
+        return _hexdigest(self.seed, 'content', k)
+
+    def _rng(self, k):
+        return random.Random(_hexdigest(self.seed, 'attrs', k))
+
+    # NODES
+    ############################################################################
+
+    def children(self, entry):
+        """
+        Returns the list of entries (k, clone, sort_order) of the children of the
+        node `entry`, or None for leaf nodes.
+        """
+        k, clone = entry[0], entry[1]
+        numbers = self.child_numbers(k)
+        if not numbers:
+            return None
+        if clone is not None or self.mutation is None:
+            return [(c, clone, float(i + 1)) for i, c in enumerate(numbers)]
+        return self.mutation.children(k, numbers)
+
+    def node(self, entry, parent_entry=None):
+        """
+        Returns the attributes of the node `entry` (without the children).
+        """
+        k, clone, sort_order = entry
+        rng = self._rng(k)
+        kind = self.kind(k, rng)
+        if k == 0:
+            node = {
+                self.root_node_id_key: self.node_id(0),
+                self.root_content_id_key: self.content_id(0),
+                'title': 'Synthetic channel ' + str(self.seed),
+                'description': 'A synthetic channel with ' + str(self.num_nodes) + ' nodes',
+                'language': 'en',
+            }
+            if self.preset == 'studio':
+                node['node_id'] = self.node_id(0)
+            if self.sort_orders:
+                # the root of studio and kolibri trees is a topic content node
+                node[self.license_key] = None
+                node[self.copyright_holder_key] = None
+            return node
+
+        node_id = self.node_id(k, clone)
+        node = {
+            self.node_id_key: node_id,
+            self.content_id_key: self.content_id(k),
+            'title': kind.capitalize() + ' ' + str(k),
+            'description': 'Description of ' + kind + ' ' + str(k),
+            'language': rng.choice(['en', 'es', 'fr']),
+            'kind': kind,
+            'tags': sorted(set(rng.choice(TAGS) for _ in range(rng.randint(0, 3)))),
+        }
+        if self.preset == 'studio':
+            node['id'] = _hexdigest(self.seed, 'id', k, clone)
+        if self.sort_orders:
+            parent_k, parent_clone = parent_entry[0], parent_entry[1]
+            if self.preset == 'studio':
+                node['parent_id'] = _hexdigest(self.seed, 'id', parent_k, parent_clone)
+            else:
+                node['parent_id'] = self.node_id(parent_k, parent_clone)
+            node['sort_order'] = sort_order
+            node['tree_id'] = 1
+        if self.preset == 'kolibri':
+            node['level'] = self.depth(k)
+        if self.root_content_id_key != self.content_id_key:
+            node[self.root_content_id_key] = 'source-' + str(k)
+        if kind == 'topic':
+            node[self.license_key] = None
+            node[self.copyright_holder_key] = None
+        else:
+            node[self.license_key] = rng.choice(LICENSES)
+            node[self.copyright_holder_key] = 'Author ' + str(rng.randint(1, 50))
+            node['files'] = self._files(kind, node.get('id'), rng)
+        if kind == 'exercise':
+            if self.assessment_items_key:
+                node[self.assessment_items_key] = self._assessment_items(k, node.get('id'), rng)
+            else:
+                num_items = rng.randint(3, 10)
+                node['assessment_item_ids'] = [_random_id(rng) for _ in range(num_items)]
+        if self.mutation is not None and clone is None:
+            self.mutation.change_node(k, node)
+        return node
+
+    def _files(self, kind, contentnode_id, rng):
+        presets = {'video': ['high_res_video', 'video_thumbnail'], 'audio': ['audio'],
+                   'document': ['document'], 'html5': ['html5_zip'], 'exercise': ['exercise']}[kind]
+        files = []
+        for preset in presets:
+            checksum = _random_id(rng)
+            extension = 'png' if preset.endswith('thumbnail') else {
+                'video': 'mp4', 'audio': 'mp3', 'document': 'pdf', 'html5': 'zip', 'exercise': 'perseus'}[kind]
+            file = {'checksum': checksum, 'extension': extension, 'file_size': rng.randint(10 ** 3, 10 ** 8),
+                    'preset': preset, 'language': None}
+            if self.preset == 'studio':
+                file['id'] = _random_id(rng)
+                file['contentnode_id'] = contentnode_id
+            files.append(file)
+        return files
+
+    def _assessment_items(self, k, contentnode_id, rng):
+        items = []
+        for i in range(rng.randint(3, 10)):
+            answers = [{'answer': str(j * (i + 1)), 'correct': j == 0, 'order': j + 1} for j in range(4)]
+            item = {
+                'assessment_id': _random_id(rng),
+                'type': 'single_selection',
+                'question': 'Question ' + str(i + 1) + ' of exercise ' + str(k),
+                'answers': json.dumps(answers) if self.preset == 'studio' else answers,
+                'hints': [],
+                'files': [],
+                'order': i + 1,
+            }
+            if self.preset == 'studio':
+                item['contentnode_id'] = contentnode_id
+            items.append(item)
+        return items
+
+    # OUTPUT
+    ############################################################################
+
+    def build(self):
+        """
+        Returns the tree as nested dicts.
+        """
+        root_entry = (0, None, None)
+        root = self.node(root_entry)
+        stack = [(root_entry, root)]
+        while stack:
+            entry, node = stack.pop()
+            children = self.children(entry)
+            if children is None:
+                continue
+            node['children'] = []
+            for child_entry in children:
+                child = self.node(child_entry, entry)
+                node['children'].append(child)
+                stack.append((child_entry, child))
+        return root
+
+    def iter_json(self):
+        """
+        Yields the JSON text of the tree in pieces, generating the nodes one by
+        one in pre-order (the tree is never held in memory).
+        """
+        stack = [((0, None, None), None, False)]
+        while stack:
+            entry, parent_entry, separator = stack.pop()
+            if entry is None:
+                yield ']}'
+                continue
+            text = json.dumps(self.node(entry, parent_entry))
+            if separator:
+                yield ', '
+            children = self.children(entry)
+            if children is None:
+                yield text
+                continue
+            yield text[:-1] + ', "children": ['
+            stack.append((None, None, False))
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], entry, i > 0))
+
+    def write_json(self, outfile):
+        """
+        Write the JSON of the tree to the text file `outfile` (or path).
+        """
+        if isinstance(outfile, str):
+            with open(outfile, 'w') as f:
+                return self.write_json(f)
+        for text in self.iter_json():
+            outfile.write(text)
+
+
+class TreeMutation(object):
+    """
+    The changes made to the tree of `generator`: the titles of `renames` nodes
+    are changed, `moves` subtrees are moved to another topic, the children of
+    `reorders` topics are reversed, `deletions` subtrees are deleted (picked at
+    `deletion_depth` if given), `clones` subtrees are copied to another topic
+    with new node_ids, and one question of `question_edits` exercises is changed.
+    The changed nodes and subtrees do not overlap, so the diff between the two
+    trees is known: `expected` has the sets of `nodes_deleted`, `nodes_added`,
+    and `nodes_moved` as (old_node_id, node_id) pairs, and the dict of changed
+    attributes of `nodes_modified` by node_id, as found by `treediff` in the
+    `simplified` format (see `diff_node_ids`).
+    """
+
+    def __init__(self, generator, seed=0, renames=0, moves=0, reorders=0, deletions=0, clones=0,
+                 question_edits=0, deletion_depth=None):
+        self.generator = generator
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.subtree_roots = set()  # roots of the deleted, moved, and cloned subtrees
+        self.taken = set()          # ancestors of the nodes changed so far
+        self.deleted = set()
+        self.moved = {}             # k --> new parent k
+        self.moved_in = {}          # parent k --> [k, ...]
+        self.clones_in = {}         # parent k --> [k, ...]
+        self.reordered = set()
+        self.renamed = set()
+        self.edited = set()
+
+        for _ in range(deletions):
+            k = self._pick_subtree(depth=deletion_depth)
+            if k is not None:
+                self._take(k, subtree=True)
+                self.deleted.add(k)
+        for _ in range(reorders):
+            k = self._pick_topic(min_children=2)
+            if k is not None and k not in self.reordered:
+                self._take(k)
+                self.reordered.add(k)
+        for kind, count in [('move', moves), ('clone', clones)]:
+            for _ in range(count):
+                k = self._pick_subtree(stable=kind == 'clone')
+                if k is None:
+                    continue
+                target = self._pick_topic(exclude=k, move=kind == 'move')
+                if target is None:
+                    continue
+                self._take(k, subtree=True)
+                self._take(target)
+                if kind == 'move':
+                    self.moved[k] = target
+                    self.moved_in.setdefault(target, []).append(k)
+                else:
+                    self.clones_in.setdefault(target, []).append(k)
+        for _ in range(renames):
+            k = self._pick_node()
+            if k is not None and k not in self.renamed:
+                self._take(k)
+                self.renamed.add(k)
+        for _ in range(question_edits):
+            k = self._pick_node(kind='exercise')
+            if k is not None and k not in self.edited:
+                self._take(k)
+                self.edited.add(k)
+        self.expected = self._expected()
+
+    # CHOICE OF CHANGES
+    ############################################################################
+
+    def _free(self, k):
+        """
+        Returns True if node `k` is not inside a changed subtree.
+        """
+        generator = self.generator
+        while k > 0:
+            if k in self.subtree_roots:
+                return False
+            k = generator.parent(k)
+        return True
+
+    def _take(self, k, subtree=False):
+        if subtree:
+            self.subtree_roots.add(k)
+        while k > 0 and k not in self.taken:
+            self.taken.add(k)
+            k = self.generator.parent(k)
+
+    def _pick_node(self, kind=None, depth=None, attempts=100):
+        generator = self.generator
+        if generator.num_nodes < 2:
+            return None
+        for _ in range(attempts):
+            if depth is None:
+                k = self.rng.randrange(1, generator.num_nodes)
+            else:
+                first = 0
+                for _ in range(depth):
+                    first = first * generator.width + 1
+                if first >= generator.num_nodes:
+                    return None
+                last = min(first * generator.width + 1, generator.num_nodes)
+                k = self.rng.randrange(first, last)
+            if (kind is None or generator.kind(k) == kind) and self._free(k):
+                return k
+        return None
+
+    def _pick_subtree(self, depth=None, stable=False, attempts=100):
+        for _ in range(attempts):
+            k = self._pick_node(depth=depth, attempts=1)
+            if k is not None and k not in self.taken and (not stable or self._stable(k)):
+                return k
+        return None
+
+    def _stable(self, k):
+        """
+        Returns True if the position of node `k` and of its ancestors is the same
+        in the new tree. The subtrees of the other nodes are deleted and added by
+        the diff, so their content_ids could be paired with the clones of `k`.
+        """
+        generator = self.generator
+        while k > 0:
+            parent = generator.parent(k)
+            if parent in self.reordered:
+                return False
+            if not generator.sort_orders:
+                for sibling in range(parent * generator.width + 1, k):
+                    if sibling in self.deleted or sibling in self.moved:
+                        return False
+            k = parent
+        return True
+
+    def _pick_topic(self, exclude=None, move=False, min_children=1, attempts=100):
+        generator = self.generator
+        for _ in range(attempts):
+            k = self.rng.randrange(0, generator.num_nodes)
+            if len(generator.child_numbers(k)) < min_children or not self._free(k):
+                continue
+            if exclude is not None and generator.is_ancestor(exclude, k):
+                continue
+            if move and k == generator.parent(exclude):
+                continue
+            return k
+        return None
+
+    # CHANGES
+    ############################################################################
+
+    def children(self, k, numbers):
+        """
+        Returns the entries (k, clone, sort_order) of the children of node `k` in
+        the new tree, where `numbers` are the children in the original tree.
+        Sort orders are kept, except for the children of reordered topics, and
+        the children moved or cloned to the topic are added at the end.
+        """
+        kept = [(c, float(i + 1)) for i, c in enumerate(numbers) if c not in self.deleted and c not in self.moved]
+        if k in self.reordered:
+            kept = [(c, float(i + 1)) for i, (c, _) in enumerate(reversed(kept))]
+        entries = [(c, None, sort_order) for c, sort_order in kept]
+        extra = [(c, None) for c in self.moved_in.get(k, [])]
+        extra.extend((c, self.seed) for c in self.clones_in.get(k, []))
+        for i, (c, clone) in enumerate(extra):
+            entries.append((c, clone, float(len(numbers) + i + 1)))
+        return entries
+
+    def change_node(self, k, node):
+        """
+        Apply the changes of node `k` to its attributes `node`.
+        """
+        if k in self.renamed:
+            node['title'] += ' (renamed)'
+        if k in self.edited:
+            key = self.generator.assessment_items_key
+            if key:
+                items = list(node[key])
+                items[0] = dict(items[0], question=items[0]['question'] + ' (edited)')
+                node[key] = items
+            else:
+                node['assessment_item_ids'] = node['assessment_item_ids'][1:] + [_hexdigest(self.seed, 'item', k)]
+
+    def _expected(self):
+        generator = self.generator
+        node_id = generator.node_id
+        deleted = set()
+        for k in self.deleted:
+            deleted.update(node_id(d) for d in generator.iter_subtree(k))
+        added = set()
+        for ks in self.clones_in.values():
+            for k in ks:
+                added.update(node_id(d, self.seed) for d in generator.iter_subtree(k))
+        moved = set((node_id(k), node_id(k)) for k in self.moved)
+        modified = {}
+        for k in self.renamed:
+            modified.setdefault(node_id(k), set()).add('title')
+        for k in self.edited:
+            modified.setdefault(node_id(k), set()).add(generator.assessment_items_key or 'assessment_item_ids')
+        if generator.sort_orders:
+            for k in self.reordered:
+                numbers = generator.child_numbers(k)
+                for c, _, sort_order in self.children(k, numbers):
+                    if c in numbers and sort_order != float(c - numbers[0] + 1):
+                        modified.setdefault(node_id(c), set()).add('sort_order')
+        return {
+            'nodes_deleted': deleted,
+            'nodes_added': added,
+            'nodes_moved': moved,
+            'nodes_modified': dict((key, sorted(attrs)) for key, attrs in modified.items()),
+        }
+
+
+def diff_node_ids(diff):
+    """
+    Returns the node_ids in `diff` in the form of `TreeMutation.expected`.
+    """
+    modified = {}
+    for nm in diff['nodes_modified']:
+        if nm['parent_id'] is not None:
+            modified[nm['node_id']] = sorted(nm.get('added', []) + nm.get('deleted', []) + nm.get('modified', []))
+    return {
+        'nodes_deleted': set(nd['old_node_id'] for nd in iter_diff_nodes(diff['nodes_deleted'])),
+        'nodes_added': set(na['node_id'] for na in iter_diff_nodes(diff['nodes_added'])),
+        'nodes_moved': set((nm['old_node_id'], nm['node_id']) for nm in iter_diff_nodes(diff['nodes_moved'])),
+        'nodes_modified': modified,
+    }
+
+
+def _random_id(rng):
+    return '%032x' % rng.getrandbits(128)
+
+
+def _hexdigest(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
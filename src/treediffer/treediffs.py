@@ -1,9 +1,15 @@
 import copy
+import json
 import logging
 import pprint
 
-from .diffutils import contains, findby, treefindby, get_descendants
-from .presets import diff_presets
+from .compact import CompactNode
+from .diffutils import freeze, TreeIndex
+from .hashcache import DEFAULT_MAX_BYTES, HashCache, file_content_hash
+from .hashing import SubtreeHashes
+from .loaders import get_root
+from .plans import LL_DEFAULTS, compile_plan, get_plan
+from .stats import count_diff_nodes, diff_sizes, new_counts
 
 logger = logging.getLogger('treediffs')
 logger.setLevel(logging.DEBUG)
@@ -14,62 +20,176 @@ logger.setLevel(logging.DEBUG)
 
 def treediff(treeA, treeB, preset=None, format="simplified", sort_order_changes=False,
              attrs=None, exclude_attrs=[], mapA={}, mapB={},
-             assessment_items_key='assessment_items', setlike_attrs=['tags']):
+             assessment_items_key='assessment_items', setlike_attrs=['tags'],
+             detached=False, skip_unchanged=False, hashesA=None, hashesB=None, stats=None):
     """
-    Compute the diff between `treeA` (old tree) and `treeB` (new tree).
+    Compute the diff between `treeA` (old tree) and `treeB` (new tree), which
+    can be tree dicts or tree stores loaded using `treediffer.loaders.load_tree`.
+    By default the diff nodes reference the attribute values of the original
+    trees without copying them, so the diff must be treated as read-only.
+    Set `detached=True` to get a deep copy that can be modified independently.
+    Use `format="summary"` to get only the counts of the changes (see `SummaryContext`).
+    Set `skip_unchanged=True` to compute the Merkle hashes of all subtrees and
+    skip the subtrees that have not changed, or pass in precomputed `hashesA`
+    and `hashesB` (see `treediffer.hashing.SubtreeHashes`).
+    Pass in a `treediffer.stats.DiffStats` as `stats` to collect the time and
+    the work done in each phase of the diff.
     """
-    # 0. load diff preset
-    if preset is not None:
-        if preset in diff_presets:
-            kwargs = diff_presets[preset]
-            attrs = kwargs['attrs'] if 'attrs' in kwargs else attrs
-            exclude_attrs = kwargs['exclude_attrs'] if 'exclude_attrs' in kwargs else exclude_attrs
-            mapA = kwargs['mapA'] if 'mapA' in kwargs else mapA
-            mapB = kwargs['mapB'] if 'mapB' in kwargs else mapB
-            assessment_items_key = kwargs['assessment_items_key'] if 'assessment_items_key' in kwargs else assessment_items_key
-            setlike_attrs = kwargs['setlike_attrs'] if 'setlike_attrs' in kwargs else setlike_attrs
-
-            # print(preset, format, sort_order_changes, attrs, exclude_attrs, mapA, mapB, assessment_items_key, setlike_attrs)
-
+    treeA, treeB = get_root(treeA), get_root(treeB)
+
+    # 0. load diff preset and compile the low level API kwargs into a plan
+    plan = get_plan(preset=preset,
+                    attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
+                    assessment_items_key=assessment_items_key,
+                    setlike_attrs=setlike_attrs)
+
+    # only time the hashing phase when get_hashes will compute some hashes
+    hashing = stats is not None and (hashesA is None or hashesB is None) \
+        and (skip_unchanged or hashesA is not None or hashesB is not None)
+    if hashing:
+        stats.start('subtree_hashes')
+    hashesA, hashesB = get_hashes(treeA, treeB, plan, skip_unchanged=skip_unchanged,
+                                  hashesA=hashesA, hashesB=hashesB)
+    if hashing:
+        stats.finish('subtree_hashes')
+    diff = _treediff(treeA, treeB, plan, format=format, sort_order_changes=sort_order_changes,
+                     hashesA=hashesA, hashesB=hashesB, stats=stats)
+    if detached:
+        if stats is not None:
+            stats.start('detach')
+        diff = copy.deepcopy(diff)
+        if stats is not None:
+            stats.finish('detach', diff_sizes(diff), nodes_copied=count_diff_nodes(diff))
+    return diff
+
+
+def get_hashes(treeA, treeB, plan, skip_unchanged=False, hashesA=None, hashesB=None):
+    """
+    Returns the subtree hashes (hashesA, hashesB) to use for the diff: None when
+    not skipping unchanged subtrees, otherwise the given or newly computed hashes.
+    """
+    if not skip_unchanged and hashesA is None and hashesB is None:
+        return None, None
+    if hashesA is None:
+        hashesA = SubtreeHashes(treeA, plan, side="A")
+    if hashesB is None:
+        hashesB = SubtreeHashes(treeB, plan, side="B")
+    if hashesA.plan_key != plan.key or hashesB.plan_key != plan.key:
+        raise ValueError('Subtree hashes were computed using a different diff plan')
+    return hashesA, hashesB
+
+
+def treediff_files(pathA, pathB, preset=None, cache_dir=None, cache_max_bytes=DEFAULT_MAX_BYTES,
+                   **kwargs):
+    """
+    Load the JSON trees from the files `pathA` (old tree) and `pathB` (new tree)
+    and compute their diff. When `cache_dir` is given, the subtree hashes of the
+    trees are stored in the cache directory (keyed by the file contents and the
+    diff plan), so unchanged subtrees are skipped and only the trees that have not
+    been seen before are hashed. All other kwargs are passed on to `treediff`.
+    """
+    with open(pathA) as fileA:
+        treeA = json.load(fileA)
+    with open(pathB) as fileB:
+        treeB = json.load(fileB)
+    if cache_dir is None:
+        return treediff(treeA, treeB, preset=preset, **kwargs)
+
+    ll_kwargs = dict((key, val) for key, val in kwargs.items() if key in LL_DEFAULTS)
+    plan = get_plan(preset=preset, **ll_kwargs)
+    cache = HashCache(cache_dir, max_bytes=cache_max_bytes)
+    hashesA = cache.subtree_hashes(treeA, file_content_hash(pathA), plan, side="A")
+    hashesB = cache.subtree_hashes(treeB, file_content_hash(pathB), plan, side="B")
+    return treediff(treeA, treeB, preset=preset, hashesA=hashesA, hashesB=hashesB, **kwargs)
+
+
+def _treediff(treeA, treeB, plan, format="simplified", sort_order_changes=False,
+              hashesA=None, hashesB=None, stats=None):
     # 1. compute the tree diff
     # special handling of tree root nodes??? (might not have the same IDs)
-    raw_diff = diff_subtree(None, treeA, None, treeB, root=True,
-                            attrs=attrs, exclude_attrs=exclude_attrs,
-                            mapA=mapA, mapB=mapB,
-                            assessment_items_key=assessment_items_key,
-                            setlike_attrs=setlike_attrs)
+    if stats is not None:
+        # count the work done in the traversal
+        context_class = StatsSummaryContext if format == "summary" else StatsContext
+        ctx = context_class(plan, stats, hashesA=hashesA, hashesB=hashesB)
+        stats.start('diff_subtree')
+    elif format == "summary":
+        # count the changes without building the diff lists
+        ctx = SummaryContext(plan, hashesA=hashesA, hashesB=hashesB)
+    else:
+        ctx = DiffContext(plan, hashesA=hashesA, hashesB=hashesB)
+    ctx.check_fingerprints(treeA, treeB)
+    ctx.push(None, treeA, None, treeB, root=True)
+    ctx.run()
+    if stats is not None:
+        stats.finish('diff_subtree', ctx.sizes(), **ctx.counts)
+    return finish_diff(ctx, treeA, treeB, format=format, sort_order_changes=sort_order_changes)
+
+
+def finish_diff(ctx, treeA, treeB, format="simplified", sort_order_changes=False, indexA=None):
+    """
+    Run the phases 2-4 of the diff (move detection, simplification, and
+    restructuring) on the changes collected by the diff context `ctx`.
+    Pass in the `TreeIndex` of `treeA` as `indexA` to reuse it for restructuring.
+    The phases are timed and counted if the context collects stats (`ctx.stats`).
+    """
+    stats = ctx.stats
+    if format == "summary":
+        if stats is not None:
+            stats.start('detect_moves')
+        summary = ctx.result(sort_order_changes=sort_order_changes)
+        if stats is not None:
+            stats.finish('detect_moves', diff_sizes(summary),
+                         nodes_visited=len(ctx.nodes_deleted) + len(ctx.nodes_added))
+        return summary
+    plan = ctx.plan
+    raw_diff = ctx.result()
 
     # 2. detect node moves
+    if stats is not None:
+        stats.start('detect_moves')
     nodes_moved = detect_moves(raw_diff['nodes_deleted'], raw_diff['nodes_added'])
     raw_diff['nodes_moved'] = nodes_moved
-
-    if format == "raw" and sort_order_changes:
-        # keep sort_order changes and count them as moves
-        return raw_diff
-    elif format == "raw" and not sort_order_changes:
+    if format == "raw" and not sort_order_changes:
         # filter out nodes for which only sort_order has changed (local moves)
         new_nodes_moved = [nm for nm in nodes_moved if not nm['sort_order_change']]
         raw_diff['nodes_moved'] = new_nodes_moved
+    if stats is not None:
+        stats.finish('detect_moves', diff_sizes(raw_diff), nodes_emitted=len(nodes_moved),
+                     nodes_visited=len(raw_diff['nodes_deleted']) + len(raw_diff['nodes_added']))
+    if format == "raw":
+        # keep sort_order changes and count them as moves unless filtered above
         return raw_diff
 
     # 3. simplify (remove nodes moved from nodes added/deleted lists)
+    if stats is not None:
+        stats.start('simplify_diff')
     simplified_diff = simplify_diff(raw_diff)
-    if format == "simplified" and sort_order_changes:
-        return simplified_diff
-    elif format == "simplified" and not sort_order_changes:
+    if format == "simplified" and not sort_order_changes:
         # filter out nodes for which only sort_order has changed (local moves)
         nodes_moved = simplified_diff['nodes_moved']
         new_nodes_moved = [nm for nm in nodes_moved if not nm['sort_order_change']]
         simplified_diff['nodes_moved'] = new_nodes_moved
+    if stats is not None:
+        stats.finish('simplify_diff', diff_sizes(simplified_diff),
+                     nodes_visited=sum(len(raw_diff[key]) for key in
+                                       ['nodes_deleted', 'nodes_added', 'nodes_moved']))
+    if format == "simplified":
         return simplified_diff
 
     # 4. restructure (un-flatten)
-    restructured_diff = restructure_diff(simplified_diff, treeA, treeB, mapA=mapA, mapB=mapB)
+    if stats is not None:
+        stats.start('restructure_diff')
+    restructured_diff = restructure_diff(simplified_diff, treeA, treeB, mapA=plan.mapA, mapB=plan.mapB,
+                                         indexA=indexA)
     if not sort_order_changes:
         # filter out nodes for which only sort_order has changed (local moves)
         nodes_moved = restructured_diff['nodes_moved']
         new_nodes_moved = [nm for nm in nodes_moved if not nm['sort_order_change']]
         restructured_diff['nodes_moved'] = new_nodes_moved
+    if stats is not None:
+        stats.finish('restructure_diff', diff_sizes(restructured_diff),
+                     nodes_visited=sum(len(simplified_diff[key]) for key in
+                                       ['nodes_deleted', 'nodes_added', 'nodes_moved']))
     if format == "restructured":
         return restructured_diff
 
@@ -80,65 +200,202 @@ def treediff(treeA, treeB, preset=None, format="simplified", sort_order_changes=
 
 def diff_subtree(parent_idA, nodeA, parent_idB, nodeB, root=False,
     attrs=None, exclude_attrs=[], mapA={}, mapB={},
-    assessment_items_key='assessment_items', setlike_attrs=['tags']):
+    assessment_items_key='assessment_items', setlike_attrs=['tags'], plan=None):
     """
     Compute the changes between the node `nodeA` in the old tree and the
     corresponding `nodeB` in the new tree. This is the main workhorse call and
     includes diff of attributes, and recusive diff of node's children.
+    If a compiled `plan` is given, the low level API kwargs are ignored.
     """
-    if root:
-        # special handling for root node of the tree
-        node_id_keyA = mapA.get('root.node_id', 'node_id')   # a.k.a. channel_id
-        node_id_keyB = mapB.get('root.node_id', 'node_id')   # a.k.a. channel_id
-        content_id_keyB = mapB.get('root.content_id', 'content_id')
-    else:
-        # regular nodes
-        node_id_keyA = mapA.get('node_id', 'node_id')
-        node_id_keyB = mapB.get('node_id', 'node_id')
-        content_id_keyB = mapB.get('content_id', 'content_id')
-
-    # Get IDs for nodeA and nodeB
-    node_idA = nodeA[node_id_keyA]
-    node_idB, content_idB = nodeB[node_id_keyB], nodeB[content_id_keyB]
-
-    attrs_diff = diff_attributes(nodeA, nodeB, root=root,
-                                 attrs=attrs, exclude_attrs=exclude_attrs,
-                                 mapA=mapA, mapB=mapB,
-                                 assessment_items_key=assessment_items_key,
-                                 setlike_attrs=setlike_attrs)
-    nodes_modified = []
-    if attrs_diff['added'] or attrs_diff['deleted'] or attrs_diff['modified']:
-        node = dict(
-            node_id=node_idB,
-            parent_id=parent_idB,
-            content_id=content_idB,
-            attributes=attrs_diff['attributes'],
+    if plan is None:
+        plan = compile_plan(attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
+                            assessment_items_key=assessment_items_key,
+                            setlike_attrs=setlike_attrs)
+    ctx = DiffContext(plan)
+    ctx.check_fingerprints(nodeA, nodeB)
+    ctx.push(parent_idA, nodeA, parent_idB, nodeB, root=root)
+    ctx.run()
+    return ctx.result()
+
+
+# TRAVERSAL ENGINE
+################################################################################
+
+class DiffContext(object):
+    """
+    Shared state of the tree diff traversal: the compiled `plan`, the stack of
+    node pairs (nodeA, nodeB) that remain to be diffed, and the diff lists.
+    Node pairs are visited iteratively in depth-first order using an explicit
+    stack, so there is no limit on the depth of the trees being diffed.
+    The methods `node_modified`, `subtree_deleted`, and `subtree_added` receive
+    all the changes found, and can be overridden to process the changes as they
+    are found instead of collecting them in the diff lists (`node_modified` also
+    receives the nodes `nodeA` and `nodeB` that were diffed).
+    When the subtree hashes `hashesA` and `hashesB` are given, the common
+    children whose subtrees have the same hash are not visited.
+    """
+    stats = None    # phase stats collector (see `StatsContext`)
+
+    def __init__(self, plan, hashesA=None, hashesB=None):
+        self.plan = plan
+        self.hashesA = hashesA
+        self.hashesB = hashesB
+        self.fingerprints = False   # compare node fingerprints of compact trees
+        self.files_fingerprintsA = None   # id(files list) --> file fingerprints
+        self.stack = []
+        self.nodes_deleted = []
+        self.nodes_added = []
+        self.nodes_modified = []
+
+    def push(self, parent_idA, nodeA, parent_idB, nodeB, root=False):
+        self.stack.append((parent_idA, nodeA, parent_idB, nodeB, root))
+
+    def check_fingerprints(self, nodeA, nodeB):
+        """
+        Use the node fingerprints when diffing two compact trees (see
+        `treediffer.compact`) that were built using the same plan.
+        """
+        self.fingerprints = (
+            isinstance(nodeA, CompactNode) and isinstance(nodeB, CompactNode)
+            and nodeA.tree.compatible(self.plan, side="A")
+            and nodeB.tree.compatible(self.plan, side="B")
         )
-        if attrs_diff['added']:
-            node['added'] = attrs_diff['added']
-        if attrs_diff['deleted']:
-            node['deleted'] = attrs_diff['deleted']
-        if attrs_diff['modified']:
-            node['modified'] = attrs_diff['modified']
-        nodes_modified.append(node)
-
-    nodes_deleted, nodes_added = [], []
-    if 'children' in nodeA and 'children' in nodeB:
-        children_diff = diff_children(node_idA, nodeA['children'],
-                                      node_idB, nodeB['children'],
-                                      attrs=attrs, exclude_attrs=exclude_attrs,
-                                      mapA=mapA, mapB=mapB,
-                                      assessment_items_key=assessment_items_key,
-                                      setlike_attrs=setlike_attrs)
-        nodes_added.extend(children_diff['nodes_added'])
-        nodes_deleted.extend(children_diff['nodes_deleted'])
-        nodes_modified.extend(children_diff['nodes_modified'])
 
-    return {
-        'nodes_deleted': nodes_deleted,
-        'nodes_added': nodes_added,
-        'nodes_modified': nodes_modified,
-    }
+    def run(self):
+        """
+        Visit node pairs until the stack is empty.
+        """
+        stack, visit = self.stack, self.visit
+        while stack:
+            visit(*stack.pop())
+
+    def visit(self, parent_idA, nodeA, parent_idB, nodeB, root=False):
+        """
+        Compute the diff of attributes of `nodeA` and `nodeB` and compare their
+        children: deleted and added children are reported immediately, while
+        the common children are pushed on the stack to be visited later.
+        """
+        plan = self.plan
+        if root:
+            # special handling for root node of the tree
+            node_id_keyA = plan.root_node_id_keyA   # a.k.a. channel_id
+            node_id_keyB = plan.root_node_id_keyB   # a.k.a. channel_id
+            content_id_keyB = plan.root_content_id_keyB
+        else:
+            # regular nodes
+            node_id_keyA = plan.node_id_keyA
+            node_id_keyB = plan.node_id_keyB
+            content_id_keyB = plan.content_id_keyB
+
+        # Get IDs for nodeA and nodeB
+        node_idA = nodeA[node_id_keyA]
+        node_idB, content_idB = nodeB[node_id_keyB], nodeB[content_id_keyB]
+
+        if self.fingerprints and nodeA.fingerprint == nodeB.fingerprint:
+            attrs_diff = None   # same attributes, no need to load them
+        else:
+            attrs_diff = diff_attributes(nodeA, nodeB, root=root, plan=plan,
+                                         files_fingerprintsA=self.files_fingerprintsA)
+        if attrs_diff:
+            node = modified_node(node_idB, parent_idB, content_idB, attrs_diff)
+            if node is not None:
+                self.node_modified(node, nodeA, nodeB)
+
+        if 'children' in nodeA and 'children' in nodeB:
+            self.visit_children(node_idA, nodeA['children'], node_idB, nodeB['children'])
+
+    def visit_children(self, parent_idA, childrenA, parent_idB, childrenB):
+        """
+        Match the nodes in `childrenA` and `childrenB` using hash indexes, report
+        the deleted and added children, and push the common children pairs.
+        """
+        # 1. prepropocess children nodes into (node_id, sort_order, node) items
+        #    and the sets of (node_id, sort_order) positions
+        itemsA, positionsA = self.children_itemsA(childrenA)
+        itemsB, positionsB = self.children_itemsB(childrenB)
+
+        # 2. build hash index of the childrenB (first occurence wins like findby)
+        nodesB_by_node_id = {}
+        for node_idB, _, nodeB in itemsB:
+            nodesB_by_node_id.setdefault(node_idB, nodeB)
+
+        # 3. nodes deleted
+        for node_idA, sort_orderA, nodeA in itemsA:
+            if (node_idA, sort_orderA) not in positionsB:
+                self.subtree_deleted(parent_idA, sort_orderA, nodeA)
+
+        # 4. nodes added
+        for node_idB, sort_orderB, nodeB in itemsB:
+            if (node_idB, sort_orderB) not in positionsA:
+                self.subtree_added(parent_idB, sort_orderB, nodeB)
+
+        # 5. push common nodes in reverse order so they are visited in tree order
+        hashesA, hashesB = self.hashesA, self.hashesB
+        for node_idA, _, nodeA in reversed(itemsA):
+            nodeB = nodesB_by_node_id.get(node_idA)
+            if nodeB is None:
+                continue
+            if hashesA is not None and hashesB is not None:
+                hashA = hashesA.get(nodeA)
+                if hashA is not None and hashA == hashesB.get(nodeB):
+                    continue  # unchanged subtree
+            self.push(parent_idA, nodeA, parent_idB, nodeB)
+
+    def children_itemsA(self, childrenA):
+        return children_items(childrenA, self.plan.node_id_keyA, self.plan.sort_order_keyA)
+
+    def children_itemsB(self, childrenB):
+        return children_items(childrenB, self.plan.node_id_keyB, self.plan.sort_order_keyB)
+
+    def node_modified(self, node, nodeA, nodeB):
+        self.nodes_modified.append(node)
+
+    def subtree_deleted(self, parent_idA, sort_order, nodeA):
+        flatlist = flatten_subtree(parent_idA, sort_order, nodeA, kind="deleted", map=self.plan.mapA)
+        self.nodes_deleted.extend(flatlist)
+
+    def subtree_added(self, parent_idB, sort_order, nodeB):
+        flatlist = flatten_subtree(parent_idB, sort_order, nodeB, kind="added", map=self.plan.mapB)
+        self.nodes_added.extend(flatlist)
+
+    def get_state(self):
+        """
+        Returns the changes collected so far (used to merge partial diffs).
+        """
+        return (self.nodes_deleted, self.nodes_added, self.nodes_modified)
+
+    def merge_state(self, state):
+        """
+        Append the changes in `state` (from `get_state` of another context that
+        diffed a part of the trees) to the changes collected by this context.
+        """
+        nodes_deleted, nodes_added, nodes_modified = state[:3]
+        self.nodes_deleted.extend(nodes_deleted)
+        self.nodes_added.extend(nodes_added)
+        self.nodes_modified.extend(nodes_modified)
+
+    def result(self):
+        # return combined info (note: node moves will be detected at a later stage)
+        return {
+            'nodes_deleted': self.nodes_deleted,
+            'nodes_added': self.nodes_added,
+            'nodes_modified': self.nodes_modified,
+        }
+
+
+def children_items(children, node_id_key, sort_order_key):
+    """
+    Returns the list of (node_id, sort_order, node) items for the `children`
+    and the set of their (node_id, sort_order) positions.
+    """
+    items = []
+    for i, node in enumerate(children):
+        sort_order = node.get(sort_order_key, None)
+        if sort_order is None:
+            sort_order = float(i + 1)  # 1-based indexitng
+        items.append((node[node_id_key], sort_order, node))
+    positions = set((node_id, sort_order) for node_id, sort_order, _ in items)
+    return items, positions
 
 
 # NODE ATTRIBUTES
@@ -146,38 +403,25 @@ def diff_subtree(parent_idA, nodeA, parent_idB, nodeB, root=False,
 
 def diff_attributes(nodeA, nodeB, root=False,
     attrs=None, exclude_attrs=[], mapA={}, mapB={},
-    assessment_items_key='assessment_items', setlike_attrs=['tags']):
+    assessment_items_key='assessment_items', setlike_attrs=['tags'], plan=None,
+    files_fingerprintsA=None):
     """
     Compute the diff between the attributes of `nodeA` and `nodeB`.
     Returns a dict { added=[], deleted=[], modifeid=[], attributes={} }
+    If a compiled `plan` is given, the low level API kwargs are ignored.
+    The dict `files_fingerprintsA` can provide precomputed file fingerprints
+    for the lists of files in `nodeA` (see `diff_files`).
     """
+    if plan is None:
+        plan = compile_plan(attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
+                            assessment_items_key=assessment_items_key,
+                            setlike_attrs=setlike_attrs)
+    assessment_items_key = plan.assessment_items_key
     attributes = {}
     added, deleted, modified = [], [], []
 
-    if attrs is None:
-        # Calculate "all attrs" based on the node attrs and the given attr-maps
-        attrs = set()
-        attrs.update( set(mapA.keys()).union(set(mapB.keys())) )
-        #
-        mapA_vals = set(mapA.values())
-        mapB_vals = set(mapB.values())
-        for keyA in nodeA.keys():
-            if keyA not in mapA_vals:
-                attrs.add(keyA)
-        for keyB in nodeB.keys():
-            if keyB not in mapB_vals:
-                attrs.add(keyB)
-        attrs = sorted(attrs) 
-
-    # 1. Regular attributes
-    for attr in attrs:
-        if attr in exclude_attrs or attr in setlike_attrs \
-            or attr == assessment_items_key or attr == 'files' or attr == 'children':
-            continue
-
-        attrA = mapA.get(attr, attr)
-        attrB = mapB.get(attr, attr)
-
+    # 1. Regular attributes (when attrs is None, all the node attrs and attr-maps)
+    for attr, attrA, attrB in plan.regular_attrs(nodeA, nodeB):
         if attrA not in nodeA and attrB not in nodeB:
             logger.warning("requested diff for missing attr " + attr)
             continue
@@ -196,10 +440,7 @@ def diff_attributes(nodeA, nodeB, root=False,
             modified.append(attr)
 
     # 2. Set-like attributes
-    for attr in setlike_attrs:
-        attrA = mapA.get(attr, attr)
-        attrB = mapB.get(attr, attr)
-
+    for attr, attrA, attrB in plan.setlike_pairs:
         if attrA not in nodeA and attrB not in nodeB:
             continue
         elif attrA not in nodeA:
@@ -224,8 +465,9 @@ def diff_attributes(nodeA, nodeB, root=False,
                 modified.append(attr)
 
     # 3. Files
-    if 'files' not in exclude_attrs and 'files' in nodeA and 'files' in nodeB:
-        files_diff = diff_files(nodeA['files'], nodeB['files'], exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapA)
+    if plan.diff_files and 'files' in nodeA and 'files' in nodeB:
+        files_diff = diff_files(nodeA['files'], nodeB['files'], plan=plan,
+                                files_fingerprintsA=files_fingerprintsA)
         if files_diff['added'] or files_diff['deleted']:
             modified.append('files')
             attributes['files'] = {
@@ -243,7 +485,8 @@ def diff_attributes(nodeA, nodeB, root=False,
     if assessment_items_key and assessment_items_key in nodeA and assessment_items_key in nodeB:
         listA = nodeA[assessment_items_key]
         listB = nodeB[assessment_items_key]
-        ais_diff = diff_assessment_items(listA, listB, mapA=mapA, mapB=mapB, exclude_attrs=exclude_attrs)
+        ais_diff = diff_assessment_items(listA, listB, plan=plan,
+                                         files_fingerprintsA=files_fingerprintsA)
         if ais_diff['added'] or ais_diff['deleted'] or ais_diff['moved'] or ais_diff['modified']:
             modified.append(assessment_items_key)
             attributes[assessment_items_key] = {
@@ -268,134 +511,142 @@ def diff_attributes(nodeA, nodeB, root=False,
     }
 
 
-def diff_files(listA, listB, exclude_attrs=[], mapA={}, mapB={}):
+def modified_node(node_id, parent_id, content_id, attrs_diff):
+    """
+    Returns the diff node of a modified node with the attributes diff `attrs_diff`
+    (see `diff_attributes`), or None if no attributes were changed.
+    """
+    if not (attrs_diff['added'] or attrs_diff['deleted'] or attrs_diff['modified']):
+        return None
+    node = dict(
+        node_id=node_id,
+        parent_id=parent_id,
+        content_id=content_id,
+        attributes=attrs_diff['attributes'],
+    )
+    if attrs_diff['added']:
+        node['added'] = attrs_diff['added']
+    if attrs_diff['deleted']:
+        node['deleted'] = attrs_diff['deleted']
+    if attrs_diff['modified']:
+        node['modified'] = attrs_diff['modified']
+    return node
+
+
+def diff_files(listA, listB, exclude_attrs=[], mapA={}, mapB={}, plan=None,
+               files_fingerprintsA=None):
     """
     Compute the diff of two lists for files, treating them as set-like.
+    Files are compared using their fingerprints (see `file_fingerprint`), so the
+    diff takes linear time and only the added and deleted files are copied.
+    The fingerprints of `listA` are looked up by `id(listA)` in the dict
+    `files_fingerprintsA` (if given) instead of being computed again.
     """
-    added = []
-    deleted = []
+    if plan is not None:
+        exclude_keys = plan.files_exclude_keys
+    else:
+        exclude_keys = frozenset(attr[len('files.'):] for attr in exclude_attrs if attr.startswith('files.'))
+
+    fingerprintsA = None
+    if files_fingerprintsA is not None:
+        fingerprintsA = files_fingerprintsA.get(id(listA))
+    if fingerprintsA is None:
+        fingerprintsA = [file_fingerprint(fileA, exclude_keys) for fileA in listA]
+    fingerprintsB = [file_fingerprint(fileB, exclude_keys) for fileB in listB]
+    fingerprintsA_set = set(fingerprintsA)
+    fingerprintsB_set = set(fingerprintsB)
 
-    cleanlistA = []
-    for fileA in listA:
-        cleanfileA = fileA.copy()
-        for exclude_attr in exclude_attrs:
-            if exclude_attr.startswith('files.'):
-                file_attr = exclude_attr.replace('files.', '')
-                cleanfileA.pop(file_attr)
-        cleanlistA.append(cleanfileA)
-
-    cleanlistB = []
-    for fileB in listB:
-        cleanfileB = fileB.copy()
-        for exclude_attr in exclude_attrs:
-            if exclude_attr.startswith('files.'):
-                file_attr = exclude_attr.replace('files.', '')
-                cleanfileB.pop(file_attr)
-        cleanlistB.append(cleanfileB)
-
-    for cleanfileA in cleanlistA:
-        if cleanfileA not in cleanlistB:
-            deleted.append(cleanfileA)
-    for cleanfileB in cleanlistB:
-        if cleanfileB not in cleanlistA:
-            added.append(cleanfileB)
+    deleted = []
+    for fileA, fingerprintA in zip(listA, fingerprintsA):
+        if fingerprintA not in fingerprintsB_set:
+            deleted.append(_clean_file(fileA, exclude_keys))
+    added = []
+    for fileB, fingerprintB in zip(listB, fingerprintsB):
+        if fingerprintB not in fingerprintsA_set:
+            added.append(_clean_file(fileB, exclude_keys))
     return {
         'added': added,
         'deleted': deleted,
     }
 
 
-def diff_assessment_items(listA, listB, exclude_attrs=[], mapA={}, mapB={}):
+def file_fingerprint(file, exclude_keys=frozenset()):
+    """
+    Returns a hashable fingerprint of the `file` dict that ignores the keys in
+    `exclude_keys`. Two files have the same fingerprint iff they are equal after
+    removing the excluded keys.
+    """
+    return frozenset((key, freeze(val)) for key, val in file.items() if key not in exclude_keys)
+
+
+def _clean_file(file, exclude_keys):
+    return dict((key, val) for key, val in file.items() if key not in exclude_keys)
+
+
+def diff_assessment_items(listA, listB, exclude_attrs=[], mapA={}, mapB={}, plan=None,
+                          files_fingerprintsA=None):
     """
     Compute the diff between the lists of assessment items `listA` and `listB`,
     using the key `assessment_id` to detect modifications and reorderings.
     Note: the code assumes there are no duplicate `assessment_id`s in a list.
     """
+    if plan is None:
+        plan = compile_plan(exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB)
+
     # 1A. prepropocess listA to extract order and assessment_id
     itemsA = []
-    assessment_idsA = set()
     for i, aiA in enumerate(listA):
-        assessment_id_keyA = mapA.get('assessment_id', 'assessment_id')
-        assessment_idA = aiA[assessment_id_keyA]
-        order_keyA = mapA.get('order', 'order')
-        orderA = aiA.get(order_keyA, None)
+        orderA = aiA.get(plan.order_keyA, None)
         if orderA is None:
             orderA = float(i + 1)  # 1-based indexitng
-        itemA = dict(
-            order=orderA,
-            assessment_id=assessment_idA,
-            assessment_item=aiA,
-        )
-        itemsA.append(itemA)
-        assessment_idsA.add(assessment_idA)
+        itemsA.append((aiA[plan.assessment_id_keyA], orderA, aiA))
 
     # 1B. prepropocess listB to extract order and assessment_id
     itemsB = []
-    assessment_idsB = set()
     for j, aiB in enumerate(listB):
-        assessment_id_keyB = mapB.get('assessment_id', 'assessment_id')
-        assessment_idB = aiB[assessment_id_keyB]
-        order_keyB = mapB.get('order', 'order')
-        orderB = aiB.get(order_keyB, None)
+        orderB = aiB.get(plan.order_keyB, None)
         if orderB is None:
             orderB = float(j + 1)  # 1-based indexitng
-        itemB = dict(
-            order=orderB,
-            assessment_id=assessment_idB,
-            assessment_item=aiB,
-        )
-        itemsB.append(itemB)
-        assessment_idsB.add(assessment_idB)
+        itemsB.append((aiB[plan.assessment_id_keyB], orderB, aiB))
 
-    # 2. compare lists
-    added_items = [itB for itB in itemsB if not contains(itemsA, itB, by=('assessment_id'))]
-    deleted_items = [itA for itA in itemsA if not contains(itemsB, itA, by=('assessment_id'))]
+    # 2. compare lists using assessment_id indexes (first occurence wins)
+    itemsA_by_id, itemsB_by_id = {}, {}
+    for itA in itemsA:
+        itemsA_by_id.setdefault(itA[0], itA)
+    for itB in itemsB:
+        itemsB_by_id.setdefault(itB[0], itB)
+    added = [itB[2] for itB in itemsB if itB[0] not in itemsA_by_id]
+    deleted = [itA[2] for itA in itemsA if itA[0] not in itemsB_by_id]
 
     # 3. check for moves and modifications in common items
-    common_item_tuples = []
-    for itA in itemsA:
-        itB = findby(itemsB, itA, by=('assessment_id'))
-        if itB:
-            common_item_tuples.append((itA, itB))
+    skip_keys = plan.assessment_items_exclude_keys
+    skip_keysA = skip_keys.union([plan.order_keyA])
+    skip_keysB = skip_keys.union([plan.order_keyB])
     moved, modified = [], []
-    for itA, itB in common_item_tuples:
-
-        # remove order attribute of the assessment_item
-        aiA, aiB = itA['assessment_item'], itB['assessment_item']
-        aiAattrs, aiBattrs = copy.deepcopy(aiA), copy.deepcopy(aiB)
-        order_keyA = mapA.get('order', 'order')
-        if order_keyA in aiAattrs:
-            aiAattrs.pop(order_keyA)
-        order_keyB = mapB.get('order', 'order')
-        if order_keyB in aiBattrs:
-            aiBattrs.pop(order_keyB)
-
-        # remove attribute from the exclude_attrs dict
-        for exclude_attr in exclude_attrs:
-            if exclude_attr.startswith('assessment_items.'):
-                ai_attr = exclude_attr.replace('assessment_items.', '')
-                aiAattrs.pop(ai_attr)
-                aiBattrs.pop(ai_attr)
+    for assessment_id, orderA, aiA in itemsA:
+        itB = itemsB_by_id.get(assessment_id)
+        if itB is None:
+            continue
+        _, orderB, aiB = itB
 
+        # compare files separately (as set-like lists) if both items have files
         files_changed = False
         if 'files' in aiA and 'files' in aiB:
-            aiAattrs.pop('files')
-            aiBattrs.pop('files')
-            files_diff = diff_files(aiA['files'], aiB['files'], exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapA)
+            files_diff = diff_files(aiA['files'], aiB['files'], plan=plan,
+                                    files_fingerprintsA=files_fingerprintsA)
             if files_diff['added'] or files_diff['deleted']:
                 files_changed = True
+            same_attrs = _filtered_equal(aiA, aiB, skip_keysA.union(['files']), skip_keysB.union(['files']))
+        else:
+            same_attrs = _filtered_equal(aiA, aiB, skip_keysA, skip_keysB)
 
-        if aiAattrs == aiBattrs and itA['order'] == itB['order'] and not files_changed:
+        if same_attrs and orderA == orderB and not files_changed:
             continue  # same attrs and same sort order, so not modified or moved
-        elif aiAattrs == aiBattrs and not files_changed and itA['order'] != itB['order']:
+        elif same_attrs and not files_changed and orderA != orderB:
             moved.append(aiB)
         else:
             modified.append(aiB)
 
-    # format for diff output
-    added = [item['assessment_item'] for item in added_items]
-    deleted = [item['assessment_item'] for item in deleted_items]
-
     return {
         'added': added,
         'deleted': deleted,
@@ -404,161 +655,107 @@ def diff_assessment_items(listA, listB, exclude_attrs=[], mapA={}, mapB={}):
     }
 
 
+def _filtered_equal(dictA, dictB, skip_keysA, skip_keysB):
+    """
+    Check if `dictA` and `dictB` are equal when ignoring the keys in `skip_keysA`
+    and `skip_keysB` respectively, without making copies of the dicts.
+    """
+    countA = 0
+    for key, valA in dictA.items():
+        if key in skip_keysA:
+            continue
+        if key in skip_keysB or key not in dictB or dictB[key] != valA:
+            return False
+        countA += 1
+    countB = sum(1 for key in dictB if key not in skip_keysB)
+    return countA == countB
+
+
 
 # TREE STUCTURE
 ################################################################################
 
 def flatten_subtree(parent_id, sort_order, subtree, kind, map={}):
     """
-    Recusively flatten the `subtree` of nodes and return the info a a flat list.
+    Flatten the `subtree` of nodes and return the info a a flat list (pre-order).
     The diff format depends on what `kind` of diff it is: `added` or `deleted`.
+    The original tree is not modified and attribute values are not copied.
     """
-    subtree =  copy.deepcopy(subtree)  # to avoid modifying original tree
-    flatlist = []
+    if kind == "deleted":
+        node_id_attr, parent_id_attr, sort_order_attr = 'old_node_id', 'old_parent_id', 'old_sort_order'
+    elif kind == "added":
+        node_id_attr, parent_id_attr, sort_order_attr = 'node_id', 'parent_id', 'sort_order'
+    else:
+        raise ValueError('Unexpected flatlist kind ' + str(kind) + ' found.')
     node_id_key = map.get('node_id', 'node_id')
     content_id_key = map.get('content_id', 'content_id')
     sort_order_key = map.get('sort_order', 'sort_order')
 
-    if 'children' in subtree:
-        children = subtree.pop('children')
-    else:
-        children = []
-
-    # first add yourself...
-    if kind == "deleted":
-        node = dict(
-            old_node_id=subtree[node_id_key],
-            old_parent_id=parent_id,
-            old_sort_order=sort_order,
-            content_id=subtree[content_id_key],
-            attributes=dict(
-                (attr, {'value': val}) for attr, val in subtree.items()
-            )
-        )
-        flatlist.append(node)
-    elif kind == "added":
-        node = dict(
-            node_id=subtree[node_id_key],
-            parent_id=parent_id,
-            sort_order=sort_order,
-            content_id=subtree[content_id_key],
-            attributes=dict(
-                (attr, {'value': val}) for attr, val in subtree.items()
-            )
+    flatlist = []
+    stack = [(parent_id, sort_order, subtree)]
+    while stack:
+        parent_id, sort_order, subtree = stack.pop()
+        attributes = dict(
+            (attr, {'value': val}) for attr, val in subtree.items() if attr != 'children'
         )
+        # first add yourself...
+        node = {
+            node_id_attr: subtree[node_id_key],
+            parent_id_attr: parent_id,
+            sort_order_attr: sort_order,
+            'content_id': subtree[content_id_key],
+            'attributes': attributes,
+        }
         flatlist.append(node)
-    else:
-        raise ValueError('Unexpected flatlist kind ' + str(kind) + ' found.')
 
-    # ... then add your children
-    for i, child in enumerate(children):
-        sort_order = child.get(sort_order_key, None)
-        if sort_order is None:
-            sort_order = float(i + 1)  # 1-based indexitng
-        childflatlist = flatten_subtree(subtree[node_id_key], sort_order, child, kind=kind, map=map)
-        flatlist.extend(childflatlist)
+        # ... then add your children (pushed in reverse to keep tree order)
+        children = subtree.get('children', [])
+        for i in range(len(children) - 1, -1, -1):
+            child = children[i]
+            child_sort_order = child.get(sort_order_key, None)
+            if child_sort_order is None:
+                child_sort_order = float(i + 1)  # 1-based indexitng
+            stack.append((subtree[node_id_key], child_sort_order, child))
 
     return flatlist
 
 
 def diff_children(parent_idA, childrenA, parent_idB, childrenB,
     attrs=None, exclude_attrs=[], mapA={}, mapB={},
-    assessment_items_key='assessment_items', setlike_attrs=['tags']):
+    assessment_items_key='assessment_items', setlike_attrs=['tags'], plan=None):
     """
     Compute the diff between the nodes in `childrenA` and the nodes in `childrenB`.
     Args:
       - attrs (list(str)): what attributes to check in comparison
       - mapA: map of diff attribues to childrenA node attributes
       - mapB: map of diff attribues to childrenB node attributes
+      - plan (DiffPlan): compiled plan to use instead of the above kwargs
     """
-    # 1A. prepropocess childrenA nodes
-    itemsA = []
-    node_idsA = set()
-    for i, nodeA in enumerate(childrenA):
-        node_id_keyA = mapA.get('node_id', 'node_id')
-        content_id_keyA = mapA.get('content_id', 'content_id')
-        node_idA, content_idA = nodeA[node_id_keyA], nodeA[content_id_keyA]
-        sort_order_keyA = mapA.get('sort_order', 'sort_order')
-        sort_orderA = nodeA.get(sort_order_keyA, None)
-        if sort_orderA is None:
-            sort_orderA = float(i + 1)  # 1-based indexitng
-        itemA = dict(
-            parent_id=parent_idA,
-            node_id=node_idA,
-            sort_order=sort_orderA,
-            content_id=content_idA,
-            node=nodeA,
-        )
-        itemsA.append(itemA)
-        node_idsA.add(node_idA)
-
-    # 1B. prepropocess childrenB nodes
-    itemsB = []
-    node_idsB = set()
-    for j, nodeB in enumerate(childrenB):
-        node_id_keyB = mapB.get('node_id', 'node_id')
-        content_id_keyB = mapB.get('content_id', 'content_id')
-        node_idB, content_idB = nodeB[node_id_keyB], nodeB[content_id_keyB]
-        sort_order_keyB = mapB.get('sort_order', 'sort_order')
-        sort_orderB = nodeB.get(sort_order_keyB, None)
-        if sort_orderB is None:
-            sort_orderB = float(j + 1)  # 1-based indexitng
-        itemB = dict(
-            parent_id=parent_idB,
-            node_id=node_idB,
-            sort_order=sort_orderB,
-            content_id=content_idB,
-            node=nodeB,
-        )
-        itemsB.append(itemB)
-        node_idsB.add(node_idB)
-
-    # 2. nodes deleted
-    nodes_deleted = []
-    deleted_items = [itA for itA in itemsA if not contains(itemsB, itA, by=('node_id', 'sort_order'))]
-    for item in deleted_items:
-        flatlist = flatten_subtree(parent_idA, item['sort_order'], item['node'], kind="deleted", map=mapA)
-        nodes_deleted.extend(flatlist)
-
-    # 3. nodes added
-    nodes_added = []
-    added_items = [itB for itB in itemsB if not contains(itemsA, itB, by=('node_id', 'sort_order'))]
-    for item in added_items:
-        flatlist = flatten_subtree(parent_idB, item['sort_order'], item['node'], kind="added", map=mapB)
-        nodes_added.extend(flatlist)
-
-    # 4. recursely diff common nodes
-    nodes_modified = []
-    common_item_tuples = []
-    for itA in itemsA:
-        itB = findby(itemsB, itA, by=('node_id'))
-        if itB:
-            common_item_tuples.append((itA, itB))
-    for itA, itB in common_item_tuples:
-        diff = diff_subtree(parent_idA, itA['node'], parent_idB, itB['node'],
-                            attrs=attrs, exclude_attrs=exclude_attrs,
-                            mapA=mapA, mapB=mapB,
+    if plan is None:
+        plan = compile_plan(attrs=attrs, exclude_attrs=exclude_attrs, mapA=mapA, mapB=mapB,
                             assessment_items_key=assessment_items_key,
                             setlike_attrs=setlike_attrs)
-        nodes_deleted.extend(diff['nodes_deleted'])
-        nodes_added.extend(diff['nodes_added'])
-        nodes_modified.extend(diff['nodes_modified'])
-
+    ctx = DiffContext(plan)
+    if childrenA and childrenB:
+        ctx.check_fingerprints(childrenA[0], childrenB[0])
+    ctx.visit_children(parent_idA, childrenA, parent_idB, childrenB)
+    ctx.run()
     # return combined info (note: node moves will be detected at a later stage)
-    return {
-        'nodes_deleted': nodes_deleted,
-        'nodes_added': nodes_added,
-        'nodes_modified': nodes_modified,
-    }
+    return ctx.result()
 
 
 # PHASE 2
 ################################################################################
 
-def detect_moves(nodes_deleted, nodes_added):
+def detect_moves(nodes_deleted, nodes_added, ambiguous_moves=None):
     """
     Look for nodes with the same `content_id` that appear in both lists, and
     interpret those nodes as having moved. Returns `nodes_moved` (list).
+    The matching is done as a hash join on `content_id` buckets: each added node
+    is paired with the first deleted node that has the same `content_id`.
+    Pass in a list as `ambiguous_moves` to get a report of the buckets where the
+    pairing is ambiguous (more than one node on either side) as dicts of the form
+    {content_id=, old_node_ids=[], node_ids=[]}.
     """
     nodes_deleted_old_node_id = {}
     for node in nodes_deleted:
@@ -568,18 +765,44 @@ def detect_moves(nodes_deleted, nodes_added):
     for node in nodes_added:
         nodes_added_by_new_node_id[node['node_id']] = node
 
+    # build content_id buckets for both sides
+    deleted_buckets = {}
+    for old_node_id, nd in nodes_deleted_old_node_id.items():
+        deleted_buckets.setdefault(nd['content_id'], []).append(old_node_id)
+    added_buckets = {}
+    for new_node_id, na in nodes_added_by_new_node_id.items():
+        added_buckets.setdefault(na['content_id'], []).append(new_node_id)
+
+    # join: the first deleted node in each bucket claims all the added nodes
     nodes_moved_by_new_node_id = {}
     for old_node_id, nd in nodes_deleted_old_node_id.items():
-        for new_node_id, na in nodes_added_by_new_node_id.items():
-            if nd['content_id'] == na['content_id']:
-                if new_node_id not in nodes_moved_by_new_node_id.keys():
-                    nm = copy.deepcopy(na)
-                    nm['old_node_id'] = old_node_id
-                    nm['old_parent_id'] = nd['old_parent_id']
-                    nm['old_sort_order'] = nd['old_sort_order']
-                    nodes_moved_by_new_node_id[new_node_id] = nm
-                else:
-                    logger.info('A node move with content_id=' + nd['content_id'] + ' already exists.')
+        content_id = nd['content_id']
+        if content_id not in added_buckets:
+            continue
+        if deleted_buckets[content_id][0] != old_node_id:
+            continue  # added nodes in this bucket already claimed
+        for new_node_id in added_buckets[content_id]:
+            na = nodes_added_by_new_node_id[new_node_id]
+            nm = dict(na)  # shallow copy (attributes are shared with na)
+            nm['old_node_id'] = old_node_id
+            nm['old_parent_id'] = nd['old_parent_id']
+            nm['old_sort_order'] = nd['old_sort_order']
+            nodes_moved_by_new_node_id[new_node_id] = nm
+
+    # report buckets with multiple nodes on either side
+    ambiguous = []
+    for content_id, old_node_ids in deleted_buckets.items():
+        node_ids = added_buckets.get(content_id)
+        if node_ids and (len(old_node_ids) > 1 or len(node_ids) > 1):
+            ambiguous.append(dict(
+                content_id=content_id,
+                old_node_ids=old_node_ids,
+                node_ids=node_ids,
+            ))
+    if ambiguous:
+        logger.info('Found ' + str(len(ambiguous)) + ' content_ids with ambiguous node moves.')
+    if ambiguous_moves is not None:
+        ambiguous_moves.extend(ambiguous)
 
     nodes_moved = []
     for nm in nodes_moved_by_new_node_id.values():
@@ -624,21 +847,27 @@ def simplify_diff(raw_diff):
 # PHASE 4: restructure for displaying diffs in tree form
 ################################################################################
 
-def restructure_diff(simplified_diff, treeA, treeB, mapA={}, mapB={}):
+def restructure_diff(simplified_diff, treeA, treeB, mapA={}, mapB={}, indexA=None, indexB=None):
     """
     Go thorugh flatlists of nodes deleted, added, and moved and organize them
     into subtrees to make get a more compact representation for display purposes.
+    Pass in `TreeIndex`s of the two trees as `indexA` and `indexB` to reuse them.
     """
     node_id_keyA = mapA.get('node_id', 'node_id')
     node_id_keyB = mapB.get('node_id', 'node_id')
+    if indexA is None or indexA.by != node_id_keyA:
+        indexA = TreeIndex(treeA, by=node_id_keyA)
+    if indexB is None or indexB.by != node_id_keyB:
+        indexB = TreeIndex(treeB, by=node_id_keyB)
 
     def restructure_list(difflist, parent_id_key="parent_id", diff_node_id_key="node_id",
-                         tree=None, by="node_id"):
+                         index=None):
         """
         Restucture list of diff nodes `difflist` by identifing complere subtrees
-        of changes. The logic used is to loop over all diff nodes in `difflist`,
-        get all their descendants the tree `tree` and do the restructuing if all
-        the descendants are also in `difflist`.
+        of changes. The logic used is to count the diff nodes in the subtree of
+        each tree node in a single bottom-up pass over the tree `index`, and
+        compare with the subtree sizes: if all the descendants of a diff node are
+        also in `difflist` the subtree is attached to its parent diff node.
         Returns a list of individual nodes and restructured node subtrees.
         """
         # 1. store for the restructured nodes:
@@ -646,55 +875,63 @@ def restructure_diff(simplified_diff, treeA, treeB, mapA={}, mapB={}):
         # 2. a shallow copy of 1. to use as pointers to all nodes for lookups
         pointers_to_nodes = nodes_by_id.copy()
         all_node_ids = set(nodes_by_id.keys())
+        if not all_node_ids:
+            return []
+        for diff_node_id in all_node_ids:
+            if diff_node_id not in index:
+                logger.warning('did not find node id ' + str(diff_node_id) + ' in tree')
+        #
+        # 3. count diff nodes in each subtree (post-order: children come after parents)
+        by, tree_nodes, parents, sizes = index.by, index.nodes, index.parents, index.sizes
+        counts = [1 if tree_node.get(by) in all_node_ids else 0 for tree_node in tree_nodes]
+        for pos in range(len(tree_nodes) - 1, 0, -1):
+            counts[parents[pos]] += counts[pos]
         #
-        node_ids_restructured = set()
+        # 4. complete subtrees are rooted at diff nodes whose descendants are all diff nodes
+        complete = set()
         for diff_node_id in all_node_ids:
-            if diff_node_id in node_ids_restructured:
-                continue  # skip nodes thave have already been restrucutred
-            assert diff_node_id in nodes_by_id, 'must be still in list'
-            #
-            # now let's lookup node_id in the tree and get its descendants
-            tree_node = treefindby(tree, diff_node_id, by=by)
-            descendants = get_descendants(tree_node, include_self=False)
-            descendants_ids = set(dnode[by] for dnode in descendants)
-            if descendants_ids and descendants_ids.issubset(all_node_ids):
-                # full subtree rooted at tree_node in list, so let's restrucutre
-                for dtree_node in descendants:
-                    dnode_id = dtree_node[by]
-                    if dnode_id in nodes_by_id:
-                        # this descendant hasn't been restructured yet, do it!
-                        ddiff_node = nodes_by_id.pop(dnode_id)
-                        parent_id = ddiff_node[parent_id_key]
-                        parent_diff_node = pointers_to_nodes.get(parent_id)
-                        if parent_diff_node:
-                            if 'children' in parent_diff_node:
-                                parent_diff_node['children'].append(ddiff_node)
-                            else:
-                                parent_diff_node['children'] = [ddiff_node]
-                        else:
-                            logger.warning('did not find parent ' + parent_id \
-                                + 'in pointers_to_nodes for node id ' + dnode_id)
-                        node_ids_restructured.add(dnode_id)
+            pos = index.positions.get(diff_node_id)
+            if pos is not None and sizes[pos] > 1 and counts[pos] == sizes[pos]:
+                complete.add(pos)
+        #
+        # 5. attach all the nodes under complete subtrees to their parents (in tree order)
+        covered = [False] * len(tree_nodes)
+        for pos in range(1, len(tree_nodes)):
+            parent_pos = parents[pos]
+            covered[pos] = covered[parent_pos] or parent_pos in complete
+            if not covered[pos]:
+                continue
+            dnode_id = tree_nodes[pos][by]
+            if dnode_id in nodes_by_id:
+                ddiff_node = nodes_by_id.pop(dnode_id)
+                parent_id = ddiff_node[parent_id_key]
+                parent_diff_node = pointers_to_nodes.get(parent_id)
+                if parent_diff_node:
+                    if 'children' in parent_diff_node:
+                        parent_diff_node['children'].append(ddiff_node)
                     else:
-                        logger.debug('node ' + dnode_id + ' has already been restructured')
+                        parent_diff_node['children'] = [ddiff_node]
+                else:
+                    logger.warning('did not find parent ' + parent_id \
+                        + 'in pointers_to_nodes for node id ' + dnode_id)
             else:
-                pass  # no restructuring: leave diff_node in nodes_by_id for now
+                logger.debug('node ' + dnode_id + ' has already been restructured')
         return list(nodes_by_id.values())
 
     nodes_deleted = simplified_diff['nodes_deleted']
     new_nodes_deleted = restructure_list(nodes_deleted,
         parent_id_key="old_parent_id", diff_node_id_key="old_node_id",
-        tree=treeA, by=node_id_keyA)
+        index=indexA)
 
     nodes_added = simplified_diff['nodes_added']
     new_nodes_added = restructure_list(nodes_added,
         parent_id_key="parent_id", diff_node_id_key="node_id",
-        tree=treeB, by=node_id_keyB)
+        index=indexB)
 
     nodes_moved = simplified_diff['nodes_moved']
     new_nodes_moved = restructure_list(nodes_moved,
         parent_id_key="parent_id", diff_node_id_key="node_id",
-        tree=treeB, by=node_id_keyB)
+        index=indexB)
 
     restructured_diff = {
         'nodes_deleted': new_nodes_deleted,
@@ -703,3 +940,208 @@ def restructure_diff(simplified_diff, treeA, treeB, mapA={}, mapB={}):
         'nodes_modified': simplified_diff['nodes_modified'],
     }
     return restructured_diff
+
+
+
+# SUMMARY DIFFS
+################################################################################
+
+KIND_ATTRS = ['kind', 'kind_id']    # standard attributes used for kind breakdowns
+
+
+class SummaryContext(DiffContext):
+    """
+    Diff traversal that counts the changes instead of collecting them. The counts
+    are exact and the same as the lengths of the lists in the simplified diff,
+    broken down by node kind and (for modified nodes) by the changed attribute.
+    Modified nodes are counted as they are found, while added and deleted nodes
+    are recorded as compact (node_id, parent_id, content_id, kind) tuples so they
+    can be paired into moves at the end (using the same logic as `detect_moves`).
+    """
+
+    def __init__(self, plan, hashesA=None, hashesB=None):
+        DiffContext.__init__(self, plan, hashesA=hashesA, hashesB=hashesB)
+        self.modified_counts = {'count': 0, 'by_kind': {}, 'by_attribute': {}}
+        self.kind_keysA = [plan.mapA.get(attr, attr) for attr in KIND_ATTRS]
+        self.kind_keysB = [plan.mapB.get(attr, attr) for attr in KIND_ATTRS]
+
+    def node_modified(self, node, nodeA, nodeB):
+        counts = self.modified_counts
+        counts['count'] += 1
+        # the kind is read from the nodes since it may not be a diffed attribute
+        kind = _node_kind(nodeB, self.kind_keysB)
+        if kind is None:
+            kind = _node_kind(nodeA, self.kind_keysA)
+        counts['by_kind'][kind] = counts['by_kind'].get(kind, 0) + 1
+        by_attribute = counts['by_attribute']
+        for key in ['added', 'deleted', 'modified']:
+            for attr in node.get(key, []):
+                by_attribute[attr] = by_attribute.get(attr, 0) + 1
+
+    def get_state(self):
+        return DiffContext.get_state(self) + (self.modified_counts,)
+
+    def merge_state(self, state):
+        DiffContext.merge_state(self, state)
+        counts, other_counts = self.modified_counts, state[3]
+        counts['count'] += other_counts['count']
+        for key in ['by_kind', 'by_attribute']:
+            for name, count in other_counts[key].items():
+                counts[key][name] = counts[key].get(name, 0) + count
+
+    def subtree_deleted(self, parent_idA, sort_order, nodeA):
+        self._record_subtree(parent_idA, nodeA, self.nodes_deleted,
+                             self.plan.node_id_keyA, self.plan.content_id_keyA, self.kind_keysA)
+
+    def subtree_added(self, parent_idB, sort_order, nodeB):
+        self._record_subtree(parent_idB, nodeB, self.nodes_added,
+                             self.plan.node_id_keyB, self.plan.content_id_keyB, self.kind_keysB)
+
+    def _record_subtree(self, parent_id, subtree, records, node_id_key, content_id_key, kind_keys):
+        stack = [(parent_id, subtree)]
+        while stack:
+            parent_id, node = stack.pop()
+            kind = _node_kind(node, kind_keys)
+            records.append((node[node_id_key], parent_id, node[content_id_key], kind))
+            for child in reversed(node.get('children', [])):
+                stack.append((node[node_id_key], child))
+
+    def result(self, sort_order_changes=False):
+        """
+        Pair the added and deleted nodes into moves and return the counts.
+        """
+        # same logic as detect_moves (last record wins, buckets in first-seen order)
+        deleted_by_id = {}
+        for record in self.nodes_deleted:
+            deleted_by_id[record[0]] = record
+        added_by_id = {}
+        for record in self.nodes_added:
+            added_by_id[record[0]] = record
+        claimed_old_ids = {}    # content_id --> old_node_id of the first deleted node
+        for old_node_id, record in deleted_by_id.items():
+            claimed_old_ids.setdefault(record[2], old_node_id)
+
+        moved = _new_counts()
+        old_node_ids_moved, new_node_ids_moved = set(), set()
+        for new_node_id, (_, parent_id, content_id, kind) in added_by_id.items():
+            old_node_id = claimed_old_ids.get(content_id)
+            if old_node_id is None:
+                continue
+            old_node_ids_moved.add(old_node_id)
+            new_node_ids_moved.add(new_node_id)
+            old_parent_id = deleted_by_id[old_node_id][1]
+            sort_order_change = old_parent_id == parent_id and old_node_id == new_node_id
+            if sort_order_change and not sort_order_changes:
+                continue
+            _count(moved, kind)
+
+        deleted = _new_counts()
+        for old_node_id, _, _, kind in self.nodes_deleted:
+            if old_node_id not in old_node_ids_moved:
+                _count(deleted, kind)
+        added = _new_counts()
+        for new_node_id, _, _, kind in self.nodes_added:
+            if new_node_id not in new_node_ids_moved:
+                _count(added, kind)
+
+        return {
+            'nodes_deleted': deleted,
+            'nodes_added': added,
+            'nodes_moved': moved,
+            'nodes_modified': self.modified_counts,
+        }
+
+
+def _node_kind(node, kind_keys):
+    for kind_key in kind_keys:
+        if kind_key in node:
+            return node[kind_key]
+    return None
+
+
+def _new_counts():
+    return {'count': 0, 'by_kind': {}}
+
+
+def _count(counts, kind):
+    counts['count'] += 1
+    counts['by_kind'][kind] = counts['by_kind'].get(kind, 0) + 1
+
+
+
+# DIFF STATS
+################################################################################
+
+class StatsContext(DiffContext):
+    """
+    Diff traversal that counts the work done in `counts` (see `treediffer.stats`)
+    for the `stats` collector: the node pairs visited, the attributes, files,
+    and assessment items compared, and the diff nodes emitted. The comparisons
+    are counted from the keys of the nodes before they are diffed, so the
+    traversal itself is the same as in `DiffContext`.
+    """
+
+    def __init__(self, plan, stats, hashesA=None, hashesB=None):
+        DiffContext.__init__(self, plan, hashesA=hashesA, hashesB=hashesB)
+        self.stats = stats
+        self.counts = new_counts()
+
+    def visit(self, parent_idA, nodeA, parent_idB, nodeB, root=False):
+        counts = self.counts
+        counts['nodes_visited'] += 1
+        if not (self.fingerprints and nodeA.fingerprint == nodeB.fingerprint):
+            plan = self.plan
+            counts['attribute_comparisons'] += len(plan.regular_attrs(nodeA, nodeB))
+            for attr, attrA, attrB in plan.setlike_pairs:
+                if attrA in nodeA or attrB in nodeB:
+                    counts['attribute_comparisons'] += 1
+            if plan.diff_files and 'files' in nodeA and 'files' in nodeB:
+                counts['file_comparisons'] += len(nodeA['files']) + len(nodeB['files'])
+            key = plan.assessment_items_key
+            if key and key in nodeA and key in nodeB:
+                counts['assessment_item_comparisons'] += len(nodeA[key]) + len(nodeB[key])
+        super(StatsContext, self).visit(parent_idA, nodeA, parent_idB, nodeB, root=root)
+
+    def node_modified(self, node, nodeA, nodeB):
+        self.counts['nodes_emitted'] += 1
+        super(StatsContext, self).node_modified(node, nodeA, nodeB)
+
+    def subtree_deleted(self, parent_idA, sort_order, nodeA):
+        count = len(self.nodes_deleted)
+        super(StatsContext, self).subtree_deleted(parent_idA, sort_order, nodeA)
+        self._count_subtree(len(self.nodes_deleted) - count)
+
+    def subtree_added(self, parent_idB, sort_order, nodeB):
+        count = len(self.nodes_added)
+        super(StatsContext, self).subtree_added(parent_idB, sort_order, nodeB)
+        self._count_subtree(len(self.nodes_added) - count)
+
+    def _count_subtree(self, count):
+        self.counts['nodes_visited'] += count
+        self.counts['nodes_emitted'] += count
+
+    def sizes(self):
+        """
+        Returns the lengths of the diff lists collected so far.
+        """
+        return {
+            'nodes_deleted': len(self.nodes_deleted),
+            'nodes_added': len(self.nodes_added),
+            'nodes_modified': len(self.nodes_modified),
+        }
+
+
+class StatsSummaryContext(StatsContext, SummaryContext):
+    """
+    Summary diff traversal (see `SummaryContext`) that counts the work done.
+    """
+
+    def __init__(self, plan, stats, hashesA=None, hashesB=None):
+        SummaryContext.__init__(self, plan, hashesA=hashesA, hashesB=hashesB)
+        self.stats = stats
+        self.counts = new_counts()
+
+    def sizes(self):
+        sizes = StatsContext.sizes(self)
+        sizes['nodes_modified'] = self.modified_counts['count']
+        return sizes
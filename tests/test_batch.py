@@ -0,0 +1,52 @@
+import copy
+import json
+
+# SUT
+from treediffer.batch import JobResult, treediff_many
+from treediffer.treediffs import treediff
+
+
+
+# BATCH DIFFS
+################################################################################
+
+def test_treediff_many(sample_tree, tmp_path):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['title'] = 'Modified title'
+    modified_tree['children'].pop()
+    pathA, pathB = str(tmp_path / 'treeA.json'), str(tmp_path / 'treeB.json')
+    for path, tree in [(pathA, sample_tree), (pathB, modified_tree)]:
+        with open(path, 'w') as outfile:
+            json.dump(tree, outfile)
+    pairs = [
+        (sample_tree, modified_tree),
+        (sample_tree, modified_tree, {'format': 'summary'}),
+        (pathA, pathB),
+    ]
+    for workers in [1, 2]:
+        results = sorted(treediff_many(pairs, workers=workers, max_pending=1, format="raw"))
+        assert [result.index for result in results] == [0, 1, 2]
+        for result in results:
+            assert isinstance(result, JobResult)
+            assert result.error is None and result.seconds >= 0
+        assert results[0].diff == treediff(sample_tree, modified_tree, format="raw")
+        assert results[1].diff == treediff(sample_tree, modified_tree, format="summary")
+        assert results[2].diff == results[0].diff
+
+
+def test_treediff_many_failures(sample_tree, tmp_path):
+    broken_tree = copy.deepcopy(sample_tree)
+    del broken_tree['children'][0]['node_id']
+    pairs = [
+        (sample_tree, broken_tree),
+        (str(tmp_path / 'missing.json'), sample_tree),
+        (sample_tree, copy.deepcopy(sample_tree)),
+        (sample_tree,),
+    ]
+    for workers in [1, 2]:
+        results = sorted(treediff_many(pairs, workers=workers))
+        assert 'KeyError' in results[0].error and results[0].diff is None
+        assert 'FileNotFoundError' in results[1].error
+        assert results[2].error is None
+        assert results[2].diff['nodes_modified'] == []
+        assert 'ValueError' in results[3].error and results[3].diff is None
@@ -0,0 +1,123 @@
+import copy
+
+# SUT
+from treediffer import compact
+from treediffer.compact import CompactNode, compact_tree
+from treediffer.diffutils import TreeIndex
+from treediffer.plans import get_plan
+from treediffer.treediffs import diff_children, diff_subtree, treediff
+
+
+
+# COMPACT TREES
+################################################################################
+
+def test_compact_tree_structure(sample_tree):
+    ctree = compact_tree(sample_tree)
+    assert len(ctree) == 24
+    root = ctree.root
+    assert isinstance(root, CompactNode)
+    assert root['node_id'] == '0000000'
+    assert root['title'] == 'Sample tree'
+    assert [child['node_id'] for child in root['children']] == ['T1', 'T2', 'T3']
+    t311 = root['children'][2]['children'][0]['children'][0]
+    assert t311['node_id'] == 'T311'
+    assert ctree.parents[t311.pos] == root['children'][2]['children'][0].pos
+    assert 'sort_order' not in t311 and t311.get('sort_order') is None
+    assert 'children' in t311 and 'children' not in t311['children'][0]
+    assert ctree.to_tree() == sample_tree
+    assert root == sample_tree
+
+
+def test_compact_node_contains_children_uses_flag(sample_tree, monkeypatch):
+    ctree = compact_tree(sample_tree)
+    t3 = ctree.root['children'][2]
+    monkeypatch.setattr(ctree, 'children', None)     # the child views are not built
+    assert 'children' in t3 and 'children' in ctree.root
+    assert 'children' not in compact_tree({'node_id': 'R', 'content_id': 'R'}).root
+
+
+def test_compact_tree_sort_orders_and_payloads(sample_tree, monkeypatch):
+    monkeypatch.setattr(compact, 'BLOCK_SIZE', 4)
+    tree = copy.deepcopy(sample_tree)
+    tree['children'][0]['sort_order'] = 1
+    tree['children'][1]['sort_order'] = 2.5
+    tree['children'][2]['sort_order'] = None
+    ctree = compact_tree(tree)
+    assert len(ctree.blocks) == 6
+    t1, t2, t3 = ctree.root['children']
+    assert t1['sort_order'] == 1 and isinstance(t1['sort_order'], int)
+    assert t2['sort_order'] == 2.5
+    assert 'sort_order' in t3 and t3['sort_order'] is None
+    assert ctree.to_tree() == tree
+
+
+def test_compact_tree_fingerprints(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['title'] = 'Modified title'
+    modified_tree['children'][1]['lft'] = 42
+    ctreeA = compact_tree(sample_tree, preset="studio")
+    ctreeB = compact_tree(modified_tree, preset="studio", side="B")
+    t1A, t2A, _ = ctreeA.root['children']
+    t1B, t2B, _ = ctreeB.root['children']
+    assert t1A.fingerprint != t1B.fingerprint
+    assert t2A.fingerprint == t2B.fingerprint   # lft is excluded in studio preset
+    assert len(t1A.fingerprint) == 20
+
+
+
+def test_compact_tree_compatible(sample_tree):
+    ctree = compact_tree(sample_tree, mapA={'label': 'title'})
+    assert ctree.compatible(get_plan(mapA={'label': 'title'}), side="A")
+    # the attributes mapped for treeB are also part of the fingerprints of treeA
+    assert not ctree.compatible(get_plan(mapA={'label': 'title'}, mapB={'title': 'title'}), side="A")
+    assert not ctree.compatible(get_plan(mapA={'label': 'title'}), side="B")
+
+
+
+# DIFF COMPACT TREES
+################################################################################
+
+def test_treediff_compact_trees(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['title'] = 'Modified title'
+    modified_tree['children'][1]['children'].pop()
+    t311 = modified_tree['children'][2]['children'][0]['children'][0]
+    t311['node_id'] += '__new'
+    ctreeA = compact_tree(sample_tree)
+    ctreeB = compact_tree(modified_tree, side="B")
+    for format in ['simplified', 'restructured', 'summary']:
+        expected = treediff(sample_tree, modified_tree, format=format)
+        assert treediff(ctreeA, ctreeB, format=format) == expected
+        assert treediff(ctreeA, ctreeB, format=format, skip_unchanged=True) == expected
+    # mixed compact and dict trees
+    assert treediff(ctreeA, modified_tree) == treediff(sample_tree, modified_tree)
+
+
+def test_diff_subtree_compact_loads_only_changed_payloads(sample_tree, monkeypatch):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][2]['description'] = 'Modified description'
+    ctreeA = compact_tree(sample_tree)
+    ctreeB = compact_tree(modified_tree, side="B")
+    loaded = []
+    payload = compact.CompactTree.payload
+    def logged_payload(self, pos):
+        loaded.append(self.node_ids[pos])
+        return payload(self, pos)
+    monkeypatch.setattr(compact.CompactTree, 'payload', logged_payload)
+
+    raw_diff = diff_subtree(None, ctreeA.root['children'][2], None, ctreeB.root['children'][2])
+    assert [node['node_id'] for node in raw_diff['nodes_modified']] == ['T3']
+    assert set(loaded) == set(['T3'])
+
+    children_diff = diff_children('T2', ctreeA.root['children'][1]['children'],
+                                  'T2', ctreeB.root['children'][1]['children'])
+    assert children_diff == {'nodes_deleted': [], 'nodes_added': [], 'nodes_modified': []}
+    assert set(loaded) == set(['T3'])
+
+
+def test_tree_index_compact_tree(sample_tree):
+    index = TreeIndex(compact_tree(sample_tree).root)
+    assert len(index) == 24
+    assert index.get('T31')['title'] == 'Topic T31'
+    assert index.is_descendant('T311', 'T3')
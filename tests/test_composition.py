@@ -0,0 +1,136 @@
+import copy
+import json
+
+import pytest
+
+# SUT
+from treediffer.composition import compose_diffs
+from treediffer.patching import apply_diff
+from treediffer.synthetic import TreeGenerator
+from treediffer.treediffs import treediff
+
+
+def diff_positions(diff):
+    """
+    Returns the sets of the deleted, added, and moved positions in `diff` and
+    the modified attributes of each node.
+    """
+    deleted = set((nd['old_parent_id'], nd['old_node_id']) for nd in diff['nodes_deleted'])
+    added = set((na['parent_id'], na['node_id']) for na in diff['nodes_added'])
+    moved = set((nm['old_node_id'], nm['parent_id'], nm['node_id']) for nm in diff['nodes_moved'])
+    modified = dict((nm['node_id'], (nm.get('added'), nm.get('deleted'), nm.get('modified')))
+                    for nm in diff['nodes_modified'])
+    return deleted, added, moved, modified
+
+
+def diff_lists(diff):
+    """
+    Returns the sorted JSON dumps of the diff nodes in each list of `diff`.
+    """
+    return dict((key, sorted(json.dumps(node, sort_keys=True) for node in diff[key]))
+                for key in ['nodes_deleted', 'nodes_added', 'nodes_moved', 'nodes_modified'])
+
+
+
+# DIFF COMPOSITION
+################################################################################
+
+def test_compose_diffs(sample_tree):
+    tree1 = sample_tree
+    tree2 = copy.deepcopy(tree1)
+    t1, t2, t3 = tree2['children']
+    t1['title'] = 'Modified title'
+    t1['children'][0]['title'] = 'Modified title'
+    t2['children'].append({'node_id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New node'})
+    t21 = t2['children'].pop(0)
+    t21['node_id'] += '__moved'
+    t3['children'].append(t21)
+    tree3 = copy.deepcopy(tree2)
+    t1, t2, t3 = tree3['children']
+    t1['title'] = 'Topic T1'                    # modified back
+    t1['children'][0]['title'] = 'Modified again'
+    t2['children'].pop()                        # added and then deleted
+    t21 = t3['children'].pop()
+    t21['node_id'] += '__again'                 # moved twice
+    t1['children'].append(t21)
+    del t3['children'][0]['description']
+
+    for format in ['raw', 'simplified', 'restructured']:
+        diff12 = treediff(tree1, tree2, format=format, sort_order_changes=True)
+        diff23 = treediff(tree2, tree3, format=format, sort_order_changes=True)
+        diff13 = compose_diffs(diff12, diff23)
+        assert diff_positions(diff13) == diff_positions(treediff(tree1, tree3))
+        assert diff13['nodes_moved'][0]['old_node_id'] == 'T21'
+        assert apply_diff(copy.deepcopy(tree1), diff13) == tree3
+
+
+def test_compose_diffs_readded(sample_tree):
+    tree2 = copy.deepcopy(sample_tree)
+    t2 = tree2['children'][1]
+    t21 = t2['children'].pop(0)
+    t2['children'].insert(0, {'node_id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New node'})
+    tree3 = copy.deepcopy(tree2)
+    t21['title'] = 'Added back'
+    tree3['children'][1]['children'][0] = t21
+    diff12 = treediff(sample_tree, tree2, format="raw")
+    diff23 = treediff(tree2, tree3, format="raw")
+    diff13 = compose_diffs(diff12, diff23, format="raw")
+    assert diff13['nodes_deleted'] == []
+    assert diff13['nodes_added'] == []
+    assert diff13['nodes_modified'] == treediff(sample_tree, tree3)['nodes_modified']
+    with pytest.raises(ValueError):
+        compose_diffs(diff12, diff23, format="restructured")
+
+
+def test_compose_diffs_modified_with_sort_order_changes():
+    def tree(*children):
+        return {'node_id': 'r', 'content_id': 'r_cid', 'title': 'Root',
+                'children': [dict(child) for child in children]}
+    x = {'node_id': 'x', 'content_id': 'x_cid', 'title': 'X'}
+    y = {'node_id': 'y', 'content_id': 'y_cid', 'title': 'Y'}
+    renamed = lambda node: dict(node, title='Renamed')
+    cases = [
+        (tree(x, y), tree(y), tree(renamed(y))),               # shifted, then renamed
+        (tree(x, y), tree(x, renamed(y)), tree(renamed(y))),   # renamed, then shifted
+        (tree(x, y), tree(renamed(x), y), tree(y, renamed(x))),
+        (tree(x, y), tree(y), tree(y, renamed(x))),             # added back elsewhere
+    ]
+    for tree1, tree2, tree3 in cases:
+        diff12 = treediff(tree1, tree2, sort_order_changes=True)
+        diff23 = treediff(tree2, tree3, sort_order_changes=True)
+        diff13 = compose_diffs(diff12, diff23)
+        assert len(diff13['nodes_modified']) == 1
+        assert diff13['nodes_modified'] == treediff(tree1, tree3)['nodes_modified']
+        assert diff_positions(diff13) == diff_positions(treediff(tree1, tree3))
+
+
+@pytest.mark.parametrize('preset,format', [(None, 'raw'), ('studio', 'raw'), ('ricecooker', 'raw'),
+                                           (None, 'simplified'), ('ricecooker', 'restructured')])
+def test_compose_diffs_random(preset, format):
+    changes = dict(renames=3, moves=2, reorders=2, deletions=1, clones=1, question_edits=2)
+    for seed in range(5):
+        generator = TreeGenerator(150, preset=preset, seed=seed, width=4)
+        tree1 = generator.build()
+        tree2 = generator.mutate(seed=seed, **changes).build()
+        tree3 = generator.mutate(seed=seed + 100, **changes).build()
+        diff12 = treediff(tree1, tree2, preset=preset, format=format, sort_order_changes=True)
+        diff23 = treediff(tree2, tree3, preset=preset, format=format, sort_order_changes=True)
+        for sort_order_changes in [False, True]:
+            diff13 = compose_diffs(diff12, diff23, preset=preset, sort_order_changes=sort_order_changes)
+            expected = treediff(tree1, tree3, preset=preset, sort_order_changes=sort_order_changes)
+            assert diff_lists(diff13) == diff_lists(expected)
+
+
+def test_compose_diffs_sort_orders():
+    def tree(*sort_orders):
+        return {'node_id': 'r', 'content_id': 'r_cid', 'title': 'Root', 'children': [
+            {'node_id': 'n' + str(i), 'content_id': 'c' + str(i), 'title': 'N' + str(i),
+             'sort_order': sort_order, 'children': []}
+            for i, sort_order in enumerate(sort_orders)]}
+    tree1, tree2, tree3 = tree(1.0, 2.0, 4.0), tree(1.0, 2.0, 3.0), tree(2.0, 1.0, 4.0)
+    for format in ['raw', 'simplified']:
+        diff12 = treediff(tree1, tree2, format=format, sort_order_changes=True)
+        diff23 = treediff(tree2, tree3, format=format, sort_order_changes=True)
+        diff13 = compose_diffs(diff12, diff23, sort_order_changes=True)
+        assert diff_lists(diff13) == diff_lists(treediff(tree1, tree3, sort_order_changes=True))
+        assert [nm['node_id'] for nm in diff13['nodes_modified']] == ['n0', 'n1']
@@ -3,7 +3,7 @@ import json
 import pprint
 
 # SUT
-from treediffer.treediffs import diff_attributes
+from treediffer.treediffs import diff_attributes, diff_files, diff_assessment_items
 from treediffer.presets import diff_presets
 
 
@@ -137,6 +137,24 @@ def test_files_reordered(sample_node_with_files, sample_files_reordered):
     assert val_dict['value'] == modified_node['files']
 
 
+def test_files_excluded_keys(sample_files):
+    filesA = copy.deepcopy(sample_files)
+    for i, fileA in enumerate(filesA):
+        fileA['id'] = 'old_uuid' + str(i)
+    filesB = copy.deepcopy(sample_files)
+    for i, fileB in enumerate(filesB):
+        fileB['id'] = 'new_uuid' + str(i)
+    filesB[1]['size'] = 2002
+
+    files_diff = diff_files(filesA, filesB, exclude_attrs=['files.id', 'files.missing'])
+
+    expected_deleted = dict(sample_files[1])
+    expected_added = dict(sample_files[1], size=2002)
+    assert files_diff['deleted'] == [expected_deleted]
+    assert files_diff['added'] == [expected_added]
+    assert 'id' in filesA[1] and 'id' in filesB[1], 'input files must not be modified'
+
+
 
 # ASSESSMENT ITEMS
 ################################################################################
@@ -240,6 +258,27 @@ def test_assessment_items_with_file_modifications(sample_node_with_assessment_it
     assert len(ais_diff['moved']) == 0
 
 
+def test_assessment_items_excluded_keys(sample_assessment_items):
+    listA = copy.deepcopy(sample_assessment_items)
+    listB = copy.deepcopy(sample_assessment_items)
+    for i, (aiA, aiB) in enumerate(zip(listA, listB)):
+        aiA['contentnode_id'] = 'old_uuid'
+        aiB['contentnode_id'] = 'new_uuid'
+        aiA['order'] = i + 1
+        aiB['order'] = 3 - i
+    listB[2]['question'] = "Modified question 3"
+    listB[0]['files'][0]['id'] = 'new_file_uuid'
+
+    ais_diff = diff_assessment_items(listA, listB,
+        exclude_attrs=['assessment_items.contentnode_id', 'files.id'])
+
+    assert ais_diff['added'] == [] and ais_diff['deleted'] == []
+    assert ais_diff['moved'] == [listB[0]]    # same attrs, order 1 --> 3
+    assert ais_diff['modified'] == [listB[2]]
+    assert ais_diff['modified'][0] is listB[2]
+    assert listA[0]['contentnode_id'] == 'old_uuid', 'input items must not be modified'
+
+
 
 # STUDIO API ASSESSMENT ITEMS
 ################################################################################
@@ -1,3 +1,4 @@
+import copy
 import pprint
 from treediffer.diffutils import contains, findby
 
@@ -90,3 +91,33 @@ def test_children_with_modifications(sample_children, sample_children_with_modif
     # if DEBUG_MODE:
     #     print('\n')
     #     pprint.pprint(diff)
+
+
+def test_children_duplicate_node_ids(sample_children):
+    childrenA = sample_children + [dict(sample_children[0], title="Duplicate node")]
+    childrenB = copy.deepcopy(sample_children)
+
+    diff = diff_children('p1', childrenA, 'p2', childrenB)
+
+    # every node in childrenA is compared to first node_id match in childrenB
+    nodes_modified = diff['nodes_modified']
+    assert len(nodes_modified) == 1
+    assert nodes_modified[0]['attributes']['title']['old_value'] == "Duplicate node"
+    nodes_deleted = diff['nodes_deleted']
+    assert len(nodes_deleted) == 1
+    assert nodes_deleted[0]['old_node_id'] == 'nid1'
+    assert nodes_deleted[0]['old_sort_order'] == 4.0
+    assert len(diff['nodes_added']) == 0
+
+
+def test_children_wide_reorder(sample_children):
+    childrenA = []
+    for i in range(2000):
+        childrenA.append({"node_id": "nid" + str(i), "content_id": "cid" + str(i), "title": "Node " + str(i)})
+    childrenB = list(reversed(childrenA))
+
+    diff = diff_children('p1', childrenA, 'p2', childrenB)
+
+    assert len(diff['nodes_deleted']) == 2000
+    assert len(diff['nodes_added']) == 2000
+    assert len(diff['nodes_modified']) == 0
@@ -0,0 +1,70 @@
+import copy
+
+# SUT
+from treediffer.diffutils import TreeIndex, freeze, get_descendants, treefindby, treefindallby
+
+
+
+# TREE INDEX
+################################################################################
+
+def test_tree_index_lookups(sample_tree):
+    index = TreeIndex(sample_tree)
+
+    # root + 3 topics + T1 children + T21,T22,T23 with 3 children each + T31 + T311 with 3 children
+    assert len(index) == 1 + 3 + 3 + 12 + 1 + 4
+    assert index.get('T22') is sample_tree['children'][1]['children'][1]
+    assert index.get('missing') is None
+    assert index.parent('T22')['node_id'] == 'T2'
+    assert index.parent('0000000') is None
+    assert index.depth('0000000') == 0
+    assert index.depth('T311_nid2') == 4
+    assert index.size('T2') == 13
+    assert index.size('T311_nid2') == 1
+
+
+def test_tree_index_is_descendant(sample_tree):
+    index = TreeIndex(sample_tree)
+
+    assert index.is_descendant('T311_nid2', 'T3')
+    assert index.is_descendant('T311_nid2', '0000000')
+    assert not index.is_descendant('T311_nid2', 'T2')
+    assert not index.is_descendant('T3', 'T3')
+    assert not index.is_descendant('T3', 'T311_nid2')
+    assert not index.is_descendant('missing', 'T3')
+
+
+def test_tree_index_descendants(sample_tree):
+    index = TreeIndex(sample_tree)
+
+    descendants_ids = [node['node_id'] for node in index.descendants('T3')]
+    assert descendants_ids == ['T31', 'T311', 'T311_nid1', 'T311_nid2', 'T311_nid3']
+    with_self = index.descendants('T3', include_self=True)
+    assert with_self[0] is sample_tree['children'][2]
+
+    expected = get_descendants(sample_tree['children'][2])
+    assert get_descendants(sample_tree['children'][2], index=index) == expected
+
+
+def test_tree_index_duplicates(sample_tree):
+    tree = copy.deepcopy(sample_tree)
+    tree['children'].append(copy.deepcopy(tree['children'][0]))
+    index = TreeIndex(tree)
+
+    assert index.get('T1') is tree['children'][0]
+    assert len(index.getall('T1')) == 2
+    assert treefindallby(tree, 'T1_nid2', index=index) == treefindallby(tree, 'T1_nid2')
+    assert treefindby(tree, 'T311', index=index) is treefindby(tree, 'T311')
+
+
+
+# FINGERPRINTS
+################################################################################
+
+def test_freeze():
+    valueA = {"a": [1, 2, {"b": "c"}], "d": None}
+    valueB = {"d": None, "a": [1, 2, {"b": "c"}]}
+    assert freeze(valueA) == freeze(valueB)
+    assert hash(freeze(valueA)) == hash(freeze(valueB))
+    assert freeze({"a": [2, 1]}) != freeze(valueA)
+    assert freeze({"a": [1, 2]}) != freeze({"a": [2, 1]})
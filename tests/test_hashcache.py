@@ -0,0 +1,107 @@
+import copy
+import json
+import os
+import time
+
+# SUT
+from treediffer import hashcache
+from treediffer.hashcache import HashCache, file_content_hash
+from treediffer.hashing import SubtreeHashes
+from treediffer.plans import get_plan
+from treediffer.treediffs import treediff, treediff_files
+
+
+
+# SUBTREE HASH CACHE
+################################################################################
+
+def test_hash_cache_get_put(sample_tree, tmp_path):
+    cache = HashCache(str(tmp_path / 'chefdata'))
+    plan = get_plan(preset='studio')
+    assert cache.get('abc123', plan) is None
+    hashes = cache.subtree_hashes(sample_tree, 'abc123', plan, side="A")
+    assert cache.get('abc123', plan) == hashes.digests
+    assert len(cache.entries()) == 1
+    # the entry is shared by both sides when the attr-maps are the same
+    assert cache.get('abc123', plan, side="B") == hashes.digests
+    assert cache.get('abc123', get_plan(preset='ricecooker')) is None
+
+
+def test_hash_cache_other_side_attr_map(sample_tree, tmp_path):
+    # the attributes mapped for treeB are also hashed for treeA
+    cache = HashCache(str(tmp_path))
+    plan = get_plan(mapA={'label': 'title'})
+    other_plan = get_plan(mapA={'label': 'title'}, mapB={'title': 'title'})
+    hashes = cache.subtree_hashes(sample_tree, 'abc123', plan)
+    assert cache.get('abc123', other_plan) is None
+    other_hashes = cache.subtree_hashes(sample_tree, 'abc123', other_plan)
+    assert other_hashes.digests == SubtreeHashes(sample_tree, other_plan).digests
+    assert other_hashes.digests != hashes.digests
+
+
+def test_hash_cache_hit_does_not_rehash(sample_tree, tmp_path, monkeypatch):
+    cache = HashCache(str(tmp_path))
+    plan = get_plan()
+    hashes = cache.subtree_hashes(sample_tree, 'abc123', plan)
+    def fail(*args, **kwargs):
+        raise AssertionError('subtree hashes recomputed')
+    monkeypatch.setattr('treediffer.hashing._compute_digests', fail)
+    cached_hashes = cache.subtree_hashes(sample_tree, 'abc123', plan)
+    assert cached_hashes.digests == hashes.digests
+    assert cached_hashes.get(sample_tree['children'][0]) == hashes.get(sample_tree['children'][0])
+
+
+def test_hash_cache_corrupt_entry(sample_tree, tmp_path):
+    cache = HashCache(str(tmp_path))
+    plan = get_plan()
+    with open(cache.entry_path('abc123', plan, "A"), 'wb') as outfile:
+        outfile.write(b'not a list of digests')
+    assert cache.get('abc123', plan) is None
+    assert cache.entries() == []
+
+
+def test_hash_cache_eviction(sample_tree, tmp_path):
+    plan = get_plan()
+    entry_size = 24 * hashcache.DIGEST_SIZE
+    cache = HashCache(str(tmp_path), max_bytes=3 * entry_size)
+    for i in range(4):
+        cache.subtree_hashes(sample_tree, 'tree' + str(i), plan)
+        path = cache.entry_path('tree' + str(i), plan, "A")
+        os.utime(path, (time.time() - 100 + i, time.time() - 100 + i))
+        if i == 1:
+            cache.get('tree0', plan)  # tree0 recently used
+    paths = [path for _, _, path in cache.entries()]
+    assert len(paths) == 3
+    assert cache.entry_path('tree1', plan, "A") not in paths
+    cache.max_entries = 1
+    cache.evict()
+    assert len(cache.entries()) == 1
+    cache.clear()
+    assert cache.entries() == []
+
+
+
+# DIFF FILES
+################################################################################
+
+def test_treediff_files(sample_tree, tmp_path):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['title'] = 'Modified title'
+    pathA, pathB = str(tmp_path / 'treeA.json'), str(tmp_path / 'treeB.json')
+    with open(pathA, 'w') as fileA:
+        json.dump(sample_tree, fileA)
+    with open(pathB, 'w') as fileB:
+        json.dump(modified_tree, fileB)
+    cache_dir = str(tmp_path / 'chefdata')
+
+    expected = treediff(sample_tree, modified_tree, format="restructured", exclude_attrs=['language'])
+    diff = treediff_files(pathA, pathB, format="restructured", exclude_attrs=['language'],
+                          cache_dir=cache_dir)
+    assert diff == expected
+    assert treediff_files(pathA, pathB, format="restructured", exclude_attrs=['language']) == expected
+
+    cache = HashCache(cache_dir)
+    plan = get_plan(exclude_attrs=['language'])
+    assert len(cache.entries()) == 2
+    assert cache.get(file_content_hash(pathA), plan) == SubtreeHashes(sample_tree, plan).digests
+    assert cache.get(file_content_hash(pathB), plan) is not None
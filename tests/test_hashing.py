@@ -0,0 +1,105 @@
+import copy
+
+# SUT
+from treediffer.hashing import SubtreeHashes
+from treediffer.plans import get_plan
+from treediffer import treediffs
+from treediffer.treediffs import treediff
+
+
+
+# SUBTREE HASHES
+################################################################################
+
+def test_subtree_hashes_noop(sample_tree):
+    plan = get_plan()
+    hashesA = SubtreeHashes(sample_tree, plan, side="A")
+    hashesB = SubtreeHashes(copy.deepcopy(sample_tree), plan, side="B")
+    assert len(hashesA) == 24
+    assert hashesA.digests == hashesB.digests
+    assert hashesA.get(sample_tree) == hashesA.root_digest
+    assert hashesA.get({}) is None
+
+
+def test_subtree_hashes_change_propagates_up(sample_tree):
+    plan = get_plan()
+    modified_tree = copy.deepcopy(sample_tree)
+    t311 = modified_tree['children'][2]['children'][0]['children'][0]
+    t311['title'] = 'Modified title'
+    hashesA = SubtreeHashes(sample_tree, plan)
+    hashesB = SubtreeHashes(modified_tree, plan, side="B")
+    # only the hashes of T311 and its ancestors T31, T3, and the root change
+    changed = [pos for pos, (hA, hB) in enumerate(zip(hashesA.digests, hashesB.digests)) if hA != hB]
+    assert changed == [0, 18, 19, 20]
+
+
+def test_subtree_hashes_ignore_excluded_attrs(sample_tree):
+    plan = get_plan(exclude_attrs=['description', 'files.id'])
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['description'] = 'Modified description'
+    hashesA = SubtreeHashes(sample_tree, plan)
+    hashesB = SubtreeHashes(modified_tree, plan, side="B")
+    assert hashesA.root_digest == hashesB.root_digest
+    # order of children matters
+    modified_tree['children'].reverse()
+    hashesB = SubtreeHashes(modified_tree, plan, side="B")
+    assert hashesA.root_digest != hashesB.root_digest
+
+
+def test_subtree_hashes_use_attr_maps(sample_tree):
+    planA = get_plan()
+    planB = get_plan(mapB={'title': 'name'})
+    renamed_tree = copy.deepcopy(sample_tree)
+    stack = [renamed_tree]
+    while stack:
+        node = stack.pop()
+        node['name'] = node.pop('title')
+        stack.extend(node.get('children', []))
+    hashesA = SubtreeHashes(sample_tree, planB, side="A")
+    hashesB = SubtreeHashes(renamed_tree, planB, side="B")
+    assert hashesA.digests == hashesB.digests
+    assert SubtreeHashes(renamed_tree, planA, side="B").root_digest != hashesA.root_digest
+
+
+
+# SKIP UNCHANGED SUBTREES
+################################################################################
+
+def test_treediff_skip_unchanged(sample_tree, monkeypatch):
+    modified_tree = copy.deepcopy(sample_tree)
+    t311 = modified_tree['children'][2]['children'][0]['children'][0]
+    t311['title'] = 'Modified title'
+    modified_tree['children'][1]['children'].pop()
+    expected = treediff(sample_tree, modified_tree, format="restructured")
+
+    visited = []
+    diff_attributes = treediffs.diff_attributes
+    def counting_diff_attributes(nodeA, nodeB, **kwargs):
+        visited.append(nodeB['node_id'])
+        return diff_attributes(nodeA, nodeB, **kwargs)
+    monkeypatch.setattr(treediffs, 'diff_attributes', counting_diff_attributes)
+
+    diff = treediff(sample_tree, modified_tree, format="restructured", skip_unchanged=True)
+    assert diff == expected
+    # the unchanged subtrees T1, T21, and T22 are not visited
+    assert visited == ['0000000', 'T2', 'T3', 'T31', 'T311']
+
+
+def test_treediff_precomputed_hashes(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['tags'] = ['tag1']
+    plan = get_plan(preset=None)
+    hashesA = SubtreeHashes(sample_tree, plan, side="A")
+    hashesB = SubtreeHashes(modified_tree, plan, side="B")
+    diff = treediff(sample_tree, modified_tree, hashesA=hashesA, hashesB=hashesB)
+    assert diff == treediff(sample_tree, modified_tree)
+    assert len(diff['nodes_modified']) == 1
+
+
+def test_treediff_hashes_wrong_plan(sample_tree):
+    hashesA = SubtreeHashes(sample_tree, get_plan(exclude_attrs=['title']))
+    try:
+        treediff(sample_tree, sample_tree, hashesA=hashesA)
+        assert False, 'expected ValueError'
+    except ValueError:
+        pass
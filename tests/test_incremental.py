@@ -0,0 +1,70 @@
+import copy
+
+# SUT
+from treediffer.incremental import IncrementalDiffer
+from treediffer.treediffs import treediff
+
+
+
+# INCREMENTAL DIFFS
+################################################################################
+
+def test_incremental_differ_edits(sample_tree):
+    treeB = copy.deepcopy(sample_tree)
+    differ = IncrementalDiffer(sample_tree, treeB)
+    assert differ.diff == treediff(sample_tree, treeB)
+    t1, t2, t3 = treeB['children']
+
+    # modify attributes
+    t1['children'][0]['title'] = 'Modified title'
+    diff = differ.update([t1['children'][0]['node_id']])
+    assert diff == treediff(sample_tree, treeB)
+    assert len(diff['nodes_modified']) == 1
+
+    # remove a subtree
+    t2['children'].pop(0)
+    assert differ.update(['T2']) == treediff(sample_tree, treeB)
+
+    # move T1_nid3 to Topic 3 (with a new node_id)
+    n3 = t1['children'].pop()
+    n3['node_id'] += '__new'
+    t3['children'].append(n3)
+    diff = differ.update(['T1', 'T3'])
+    assert diff == treediff(sample_tree, treeB)
+    assert [nm['node_id'] for nm in diff['nodes_moved']] == ['T1_nid3__new']
+
+    # add a new node inside the moved node and edit it
+    new_node = {'node_id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New node'}
+    n3['children'] = [new_node]
+    assert differ.update([n3['node_id']]) == treediff(sample_tree, treeB)
+    new_node['title'] = 'Modified new node'
+    diff = differ.update(['NEW'])
+    assert diff == treediff(sample_tree, treeB)
+    assert [na['node_id'] for na in diff['nodes_added']] == ['NEW']
+    assert diff['nodes_added'][0]['attributes']['title'] == {'value': 'Modified new node'}
+
+
+def test_incremental_differ_restructured(sample_tree):
+    treeB = copy.deepcopy(sample_tree)
+    differ = IncrementalDiffer(sample_tree, treeB, format="restructured", sort_order_changes=True)
+    treeB['children'].reverse()
+    for _ in range(2):
+        diff = differ.update([treeB['node_id']])
+        assert diff == treediff(sample_tree, treeB, format="restructured", sort_order_changes=True)
+    assert len(diff['nodes_moved']) == 2
+
+
+def test_incremental_differ_reorder():
+    treeA = {'node_id': 'R', 'content_id': 'R_cid', 'children': [
+        {'node_id': 'N%d' % i, 'content_id': 'C%d' % i, 'sort_order': i, 'children': []}
+        for i in range(1, 5)
+    ]}
+    treeB = copy.deepcopy(treeA)
+    differ = IncrementalDiffer(treeA, treeB, sort_order_changes=True)
+    # reorder the children and renumber their sort orders, touching only the parent
+    treeB['children'].reverse()
+    for i, child in enumerate(treeB['children']):
+        child['sort_order'] = i + 1
+    diff = differ.update(['R'])
+    assert diff == treediff(treeA, treeB, sort_order_changes=True)
+    assert len(diff['nodes_modified']) == 4
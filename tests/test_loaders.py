@@ -0,0 +1,102 @@
+import copy
+import hashlib
+import io
+import json
+
+# SUT
+from treediffer.loaders import JSONStreamReader, TreeStore, load_tree
+from treediffer.treediffs import treediff
+
+
+class ChunkedFile(object):
+    """
+    File-like object that returns at most `chunk_size` bytes per read.
+    """
+    def __init__(self, data, chunk_size):
+        self.infile = io.BytesIO(data)
+        self.chunk_size = chunk_size
+
+    def read(self, size=-1):
+        return self.infile.read(self.chunk_size)
+
+
+
+# STREAMING JSON READER
+################################################################################
+
+def test_stream_reader_values_across_chunks():
+    data = json.dumps({"title": "Título ✓", "num": -12.5e3, "items": [1, {"a": None}]})
+    reader = JSONStreamReader(ChunkedFile(data.encode('utf-8'), 1))
+    reader.expect('{')
+    assert reader.read_member_key(first=True) == 'title'
+    assert reader.read_value() == "Título ✓"
+    assert reader.read_member_key() == 'num'
+    assert reader.read_value() == -12.5e3
+    assert reader.read_member_key() == 'items'
+    assert reader.read_value() == [1, {"a": None}]
+    reader.expect('}')
+    assert reader.content_hash() == hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+
+# LOAD TREE
+################################################################################
+
+def test_load_tree_no_preset(sample_tree, tmp_path):
+    path = str(tmp_path / 'tree.json')
+    with open(path, 'w') as outfile:
+        json.dump(sample_tree, outfile, indent=2)
+    store = load_tree(path)
+    assert isinstance(store, TreeStore)
+    assert store.root == sample_tree
+    assert len(store) == 24
+    with open(path, 'rb') as infile:
+        assert store.content_hash == hashlib.sha1(infile.read()).hexdigest()
+    for chunk_size in [1, 5, 17]:
+        data = json.dumps(sample_tree).encode('utf-8')
+        assert load_tree(ChunkedFile(data, chunk_size)).root == sample_tree
+
+
+def test_load_tree_prunes_excluded_attrs(sample_tree):
+    tree = copy.deepcopy(sample_tree)
+    tree['id'] = 'channel_id'
+    tree['source_id'] = 'channel_source_id'
+    t1 = tree['children'][0]
+    t1.update(lft=1, rght=10, tree_id=3, kind='topic')
+    t1['files'] = [{'id': 'f1', 'contentnode_id': 'T1', 'checksum': 'abc', 'preset': 'thumbnail'}]
+    t1['children'][0]['assessment_items'] = [{'assessment_id': 'a1', 'contentnode_id': 'x', 'question': 'Q?'}]
+
+    store = load_tree(io.BytesIO(json.dumps(tree).encode('utf-8')), preset="studio")
+    assert store.root['id'] == 'channel_id'
+    assert store.root['source_id'] == 'channel_source_id'
+    t1 = store.root['children'][0]
+    assert 'lft' not in t1 and 'rght' not in t1 and 'tree_id' not in t1
+    assert t1['kind'] == 'topic'
+    assert t1['node_id'] == 'T1' and t1['title'] == 'Topic T1'
+    assert t1['files'] == [{'checksum': 'abc', 'preset': 'thumbnail'}]
+    assert t1['children'][0]['assessment_items'] == [{'assessment_id': 'a1', 'question': 'Q?'}]
+
+
+def test_load_tree_fingerprint_attrs(sample_tree):
+    data = json.dumps(sample_tree).encode('utf-8')
+    store = load_tree(io.BytesIO(data), fingerprint_attrs=['description'])
+    description = store.root['children'][0]['description']
+    assert len(description) == 40 and description != sample_tree['children'][0]['description']
+    assert store.content_hash != load_tree(io.BytesIO(data)).content_hash
+
+
+
+# DIFF TREE STORES
+################################################################################
+
+def test_treediff_tree_stores(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['description'] = 'Modified description'
+    modified_tree['children'][1]['children'].pop()
+    storeA = load_tree(io.BytesIO(json.dumps(sample_tree).encode('utf-8')), fingerprint_attrs=['description'])
+    storeB = load_tree(io.BytesIO(json.dumps(modified_tree).encode('utf-8')), fingerprint_attrs=['description'])
+
+    expected = treediff(sample_tree, modified_tree, format="summary")
+    assert treediff(storeA, storeB, format="summary") == expected
+    diff = treediff(storeA, storeB, format="simplified")
+    assert diff['nodes_modified'][0]['modified'] == ['description']
@@ -0,0 +1,41 @@
+import copy
+
+# SUT
+from treediffer.parallel import treediff_parallel
+from treediffer.treediffs import treediff
+
+
+
+# PARALLEL DIFFS
+################################################################################
+
+def test_treediff_parallel_same_as_serial(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    t1, t2, t3 = modified_tree['children']
+    t1['title'] = 'Modified title'
+    # move T1_nid3 to Topic 3 and Subtopic 23 to Topic 31 (across workers)
+    n3 = t1['children'].pop()
+    n3['node_id'] += '__new'
+    t3['children'].append(n3)
+    t23 = t2['children'].pop()
+    t23['node_id'] += '__new'
+    t3['children'][0]['children'].append(t23)
+    t3['children'][0]['children'][0]['description'] = 'Modified description'
+    for format in ['raw', 'simplified', 'restructured', 'summary']:
+        expected = treediff(sample_tree, modified_tree, format=format)
+        assert treediff_parallel(sample_tree, modified_tree, format=format, workers=2) == expected
+    for tree in [sample_tree, modified_tree]:
+        tree['id'] = 'channel_id'
+        tree['source_id'] = 'channel_source_id'
+    expected = treediff(sample_tree, modified_tree, preset="studio")
+    diff = treediff_parallel(sample_tree, modified_tree, preset="studio", skip_unchanged=True, workers=3)
+    assert diff == expected
+    assert len(diff['nodes_moved']) == 5
+
+
+def test_treediff_parallel_single_worker(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'].pop(0)
+    modified_tree['children'][0]['title'] = 'Modified title'
+    expected = treediff(sample_tree, modified_tree)
+    assert treediff_parallel(sample_tree, modified_tree, workers=1) == expected
@@ -0,0 +1,47 @@
+import copy
+
+import pytest
+
+# SUT
+from treediffer.hashing import SubtreeHashes
+from treediffer.patching import apply_diff
+from treediffer.plans import get_plan
+from treediffer.treediffs import treediff
+
+
+
+# PATCHES
+################################################################################
+
+def test_apply_diff_formats(sample_tree):
+    treeB = copy.deepcopy(sample_tree)
+    t1, t2, t3 = treeB['children']
+    t1['children'][0]['title'] = 'Modified title'
+    del t1['children'][1]['description']
+    t2['children'].pop(0)
+    t23 = t2['children'].pop()
+    t23['node_id'] += '__new'
+    t3['children'].append(t23)
+    t3['children'][0]['children'].reverse()
+    t3['children'].insert(0, {'node_id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New node'})
+    hashesB = SubtreeHashes(treeB, get_plan(), side="B")
+
+    for format in ['raw', 'simplified', 'restructured']:
+        diff = treediff(sample_tree, treeB, format=format, sort_order_changes=True)
+        treeA = copy.deepcopy(sample_tree)
+        patched = apply_diff(treeA, diff, hashesB=hashesB, detached=True)
+        assert patched is treeA
+        assert patched == treeB
+
+
+def test_apply_diff_verify(sample_tree):
+    treeB = copy.deepcopy(sample_tree)
+    treeB['children'][0]['title'] = 'Modified title'
+    treeB['children'][1]['children'].pop(0)
+    diff = treediff(sample_tree, treeB, format="raw")
+    hashesB = SubtreeHashes(treeB, get_plan(), side="B")
+    diff['nodes_modified'] = []
+    with pytest.raises(ValueError):
+        apply_diff(copy.deepcopy(sample_tree), diff, hashesB=hashesB)
+    with pytest.raises(ValueError):
+        apply_diff(copy.deepcopy(sample_tree), treediff(sample_tree, treeB, format="summary"))
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import copy
+
+# SUT
+from treediffer import plans
+from treediffer.plans import compile_plan, get_plan
+from treediffer.presets import diff_presets
+from treediffer.treediffs import diff_attributes
+
+
+
+# DIFF PLANS
+################################################################################
+
+def test_compile_plan_is_cached():
+    plan1 = compile_plan(exclude_attrs=['description'], setlike_attrs=['tags'])
+    plan2 = compile_plan(exclude_attrs=['description'], setlike_attrs=['tags'])
+    assert plan1 is plan2
+    assert plan1.exclude_attrs == frozenset(['description'])
+
+
+def test_compile_plan_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(plans, 'MAX_CACHED_PLANS', 2)
+    monkeypatch.setattr(plans, '_plans_cache', OrderedDict())
+    plan1 = compile_plan(exclude_attrs=['cache_test_1'])
+    plan2 = compile_plan(exclude_attrs=['cache_test_2'])
+    assert compile_plan(exclude_attrs=['cache_test_1']) is plan1    # now most recently used
+    compile_plan(exclude_attrs=['cache_test_3'])
+    assert len(plans._plans_cache) == 2
+    assert compile_plan(exclude_attrs=['cache_test_1']) is plan1
+    assert compile_plan(exclude_attrs=['cache_test_2']) is not plan2
+
+
+def test_preset_plans():
+    for preset, kwargs in diff_presets.items():
+        plan = get_plan(preset=preset)
+        assert plan is get_plan(preset=preset)
+        assert plan.exclude_attrs == frozenset(kwargs['exclude_attrs'])
+        assert plan.mapA == kwargs['mapA']
+    kolibri_plan = get_plan(preset='kolibri')
+    assert kolibri_plan.node_id_keyA == 'id'
+    assert kolibri_plan.assessment_items_key is None
+    assert kolibri_plan.setlike_pairs == (
+        ('tags', 'tags', 'tags'),
+        ('assessment_item_ids', 'assessment_item_ids', 'assessment_item_ids'),
+    )
+    studio_plan = get_plan(preset='studio')
+    assert studio_plan.files_exclude_keys == frozenset(['id', 'contentnode_id'])
+    assert studio_plan.assessment_items_exclude_keys == frozenset(['contentnode_id'])
+
+
+def test_plan_regular_attrs(sample_node):
+    plan = compile_plan(exclude_attrs=['language'], mapA={'title': 'name'})
+    nodeA = dict(sample_node, name=sample_node['title'])
+    nodeA.pop('title')
+
+    pairs = plan.regular_attrs(nodeA, sample_node)
+    attrs = [attr for attr, _, _ in pairs]
+    assert attrs == sorted(attrs)
+    assert 'language' not in attrs
+    assert 'children' not in attrs and 'files' not in attrs and 'tags' not in attrs
+    assert ('title', 'name', 'title') in pairs
+    assert plan.regular_attrs(nodeA, sample_node) is pairs   # cached per key signature
+
+    explicit_plan = compile_plan(attrs=['title', 'tags', 'description'])
+    assert explicit_plan.regular_attrs(nodeA, sample_node) == (
+        ('title', 'title', 'title'),
+        ('description', 'description', 'description'),
+    )
+
+
+def test_diff_attributes_with_plan(sample_node):
+    modified_node = copy.deepcopy(sample_node)
+    modified_node['title'] = 'New title'
+    modified_node['tags'] = ['tag1']
+    plan = compile_plan()
+
+    attrs_diff = diff_attributes(sample_node, modified_node, plan=plan)
+
+    assert attrs_diff == diff_attributes(sample_node, modified_node)
+    assert attrs_diff['modified'] == ['title', 'tags']
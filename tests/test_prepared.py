@@ -0,0 +1,45 @@
+import copy
+
+# SUT
+from treediffer.prepared import PreparedTree, prepare_tree
+from treediffer.treediffs import treediff
+
+
+
+# PREPARED TREES
+################################################################################
+
+def test_prepared_tree_many_diffs(sample_tree, sample_files, sample_files_add_and_rm):
+    treeA = copy.deepcopy(sample_tree)
+    treeA['children'][0]['files'] = sample_files
+    prepared = prepare_tree(treeA)
+    assert isinstance(prepared, PreparedTree)
+    assert len(prepared.files_fingerprints) == 1
+
+    moved_tree = copy.deepcopy(treeA)
+    t23 = moved_tree['children'][1]['children'].pop()
+    t23['node_id'] += '__new'
+    moved_tree['children'][2]['children'].append(t23)
+    modified_tree = copy.deepcopy(treeA)
+    modified_tree['children'][0]['files'] = sample_files_add_and_rm
+    modified_tree['children'][2]['title'] = 'Modified title'
+    modified_tree['children'][1]['children'].pop(0)
+
+    for treeB in [moved_tree, modified_tree, copy.deepcopy(treeA)]:
+        for format in ['raw', 'simplified', 'restructured', 'summary']:
+            expected = treediff(treeA, treeB, format=format)
+            assert prepared.diff(treeB, format=format) == expected
+            assert prepared.diff(treeB, format=format, skip_unchanged=True) == expected
+
+
+def test_prepared_tree_preset(sample_tree):
+    treeA = copy.deepcopy(sample_tree)
+    treeA['id'] = 'channel_id'
+    treeA['source_id'] = 'channel_source_id'
+    treeB = copy.deepcopy(treeA)
+    treeB['children'][0]['lft'] = 42
+    treeB['children'][0]['description'] = 'Modified description'
+    prepared = prepare_tree(treeA, preset="studio")
+    diff = prepared.diff(treeB)
+    assert diff == treediff(treeA, treeB, preset="studio")
+    assert diff['nodes_modified'][0]['modified'] == ['description']
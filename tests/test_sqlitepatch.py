@@ -0,0 +1,130 @@
+import copy
+import sqlite3
+
+import pytest
+
+# SUT
+from treediffer.sqlitepatch import apply_diff_sqlite
+from treediffer.treediffs import treediff
+
+
+COLUMNS = ['id', 'parent_id', 'content_id', 'title', 'sort_order', 'lft', 'rght', 'level', 'tree_id']
+
+
+def kolibri_tree(tree):
+    """
+    Convert `tree` to a Kolibri-style tree (with `id`s and `sort_order`s).
+    """
+    tree = copy.deepcopy(tree)
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        node['id'] = node.pop('node_id')
+        node['license_owner'] = None
+        for i, child in enumerate(node.get('children', [])):
+            child['sort_order'] = float(i + 1)
+            stack.append(child)
+    return tree
+
+
+def mptt_rows(tree, tree_id=1):
+    """
+    Returns the ContentNode rows of `tree` with the MPTT annotations.
+    """
+    rows = []
+    counter = 1
+    stack = [(False, tree, None, 0, None)]
+    while stack:
+        leaving, node, parent_id, level, lft = stack.pop()
+        if leaving:
+            rows.append((node['id'], parent_id, node['content_id'], node['title'],
+                         node.get('sort_order'), lft, counter, level, tree_id))
+            counter += 1
+            continue
+        stack.append((True, node, parent_id, level, counter))
+        counter += 1
+        for child in reversed(node.get('children', [])):
+            stack.append((False, child, node['id'], level + 1, None))
+    return sorted(rows)
+
+
+def create_db(path, tree):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE content_contentnode (id TEXT PRIMARY KEY, parent_id TEXT, '
+                 'content_id TEXT, title TEXT, description TEXT, sort_order REAL, '
+                 'lft INTEGER NOT NULL CHECK (lft >= 0), rght INTEGER NOT NULL CHECK (rght >= 0), '
+                 'level INTEGER NOT NULL, tree_id INTEGER NOT NULL)')
+    conn.execute('CREATE INDEX content_contentnode_tree_id_lft ON content_contentnode (tree_id, lft)')
+    conn.executemany('INSERT INTO content_contentnode (' + ', '.join(COLUMNS) + ') VALUES ('
+                     + ', '.join('?' * len(COLUMNS)) + ')', mptt_rows(tree))
+    conn.commit()
+    conn.close()
+
+
+def read_rows(path):
+    conn = sqlite3.connect(path)
+    rows = sorted(conn.execute('SELECT ' + ', '.join(COLUMNS) + ' FROM content_contentnode'))
+    conn.close()
+    return rows
+
+
+
+# SQLITE PATCHES
+################################################################################
+
+def test_apply_diff_sqlite(tmp_path, sample_tree):
+    treeA = kolibri_tree(sample_tree)
+    treeB = copy.deepcopy(treeA)
+    t1, t2, t3 = treeB['children']
+    t1['children'][0]['title'] = 'Modified title'
+    t2['children'].pop(0)
+    t23 = t2['children'].pop()
+    t23['id'] += '__new'
+    t3['children'].append(t23)
+    t23['sort_order'] = 2.0
+    t3['children'][0]['children'].append(
+        {'id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New node', 'sort_order': 2.0,
+         'license_owner': None})
+    path = str(tmp_path / 'content.sqlite3')
+    for format in ['raw', 'simplified', 'restructured']:
+        create_db(path + format, treeA)
+        diff = treediff(treeA, treeB, preset="kolibri", format=format, sort_order_changes=True)
+        counts = apply_diff_sqlite(path + format, diff)
+        assert counts['updated'] == 1
+        assert read_rows(path + format) == mptt_rows(treeB)
+
+
+def test_apply_diff_sqlite_sort_order_changes(tmp_path, sample_tree):
+    treeA = kolibri_tree(sample_tree)
+    treeB = copy.deepcopy(treeA)
+    t1 = treeB['children'].pop(0)
+    t1['sort_order'] = 4.0
+    treeB['children'].append(t1)
+    treeB['children'][0]['title'] = 'Modified title'
+    path = str(tmp_path / 'content.sqlite3')
+    # the sort order change is not in simplified diffs, so only the title is updated
+    create_db(path, treeA)
+    apply_diff_sqlite(path, treediff(treeA, treeB, preset="kolibri", format="simplified"))
+    treeC = copy.deepcopy(treeA)
+    treeC['children'][1]['title'] = 'Modified title'
+    assert read_rows(path) == mptt_rows(treeC)
+    # the sort order change is applied from raw diffs
+    create_db(path + 'raw', treeA)
+    apply_diff_sqlite(path + 'raw', treediff(treeA, treeB, preset="kolibri", format="raw"))
+    assert read_rows(path + 'raw') == mptt_rows(treeB)
+
+
+def test_apply_diff_sqlite_rollback(tmp_path, sample_tree):
+    treeA = kolibri_tree(sample_tree)
+    treeB = copy.deepcopy(treeA)
+    treeB['children'][0]['title'] = 'Modified title'
+    treeB['children'][1]['children'].append(
+        {'id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New node', 'sort_order': 4.0,
+         'license_owner': None})
+    path = str(tmp_path / 'content.sqlite3')
+    create_db(path, treeA)
+    diff = treediff(treeA, treeB, preset="kolibri")
+    diff['nodes_added'][0]['parent_id'] = 'MISSING'
+    with pytest.raises(ValueError):
+        apply_diff_sqlite(path, diff)
+    assert read_rows(path) == mptt_rows(treeA)
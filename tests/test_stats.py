@@ -0,0 +1,89 @@
+import copy
+
+import pytest
+
+# SUT
+from treediffer.stats import DiffStats
+from treediffer.treediffs import treediff
+
+
+
+def changed_tree(tree):
+    """
+    Returns a copy of `tree` with a modified, a deleted, and an added topic.
+    """
+    tree = copy.deepcopy(tree)
+    tree['children'][0]['title'] = 'Modified title'
+    tree['children'].pop()
+    tree['children'].append({'node_id': 'NEW', 'content_id': 'NEW_cid', 'title': 'New topic'})
+    return tree
+
+
+
+# DIFF STATS
+################################################################################
+
+def test_treediff_stats(sample_tree):
+    treeB = changed_tree(sample_tree)
+    hooked = []
+    stats = DiffStats(hook=lambda phase, record: hooked.append((phase, record)))
+
+    diff = treediff(sample_tree, treeB, format="restructured", stats=stats)
+
+    assert diff == treediff(sample_tree, treeB, format="restructured")
+    phases = ['diff_subtree', 'detect_moves', 'simplify_diff', 'restructure_diff']
+    assert list(stats.phases) == phases
+    assert hooked == list(stats.phases.items())
+    traversal = stats.phases['diff_subtree']
+    assert traversal['nodes_visited'] > 0
+    assert traversal['attribute_comparisons'] > 0
+    assert traversal['nodes_emitted'] == sum(traversal['sizes'].values())
+    assert traversal['sizes']['nodes_modified'] == 1
+    final = stats.phases['restructure_diff']['sizes']
+    for key in ['nodes_deleted', 'nodes_added', 'nodes_moved', 'nodes_modified']:
+        assert final[key] == len(diff[key])
+    assert stats.seconds == sum(record['seconds'] for record in stats.phases.values())
+    assert stats.totals()['nodes_visited'] == sum(record['nodes_visited'] for record in stats.phases.values())
+
+
+@pytest.mark.parametrize('format', ['raw', 'simplified', 'summary'])
+def test_treediff_stats_formats(sample_tree, format):
+    treeB = changed_tree(sample_tree)
+    stats = DiffStats()
+    diff = treediff(sample_tree, treeB, format=format, stats=stats)
+    assert diff == treediff(sample_tree, treeB, format=format)
+    if format == 'summary':
+        assert list(stats.phases) == ['diff_subtree', 'detect_moves']
+        sizes = stats.phases['detect_moves']['sizes']
+        assert sizes == dict((key, counts['count']) for key, counts in diff.items())
+    else:
+        assert 'detect_moves' in stats.phases
+        assert ('simplify_diff' in stats.phases) == (format == 'simplified')
+
+
+def test_treediff_stats_files_and_assessment_items(sample_tree):
+    treeA = copy.deepcopy(sample_tree)
+    exercise = treeA['children'][0]['children'][0]
+    exercise['files'] = [{'checksum': 'a', 'extension': 'perseus'}]
+    exercise['assessment_items'] = [{'assessment_id': 'q1', 'question': 'Q1'},
+                                    {'assessment_id': 'q2', 'question': 'Q2'}]
+    treeB = copy.deepcopy(treeA)
+
+    stats = DiffStats()
+    treediff(treeA, treeB, stats=stats, detached=True)
+
+    traversal = stats.phases['diff_subtree']
+    assert traversal['file_comparisons'] == 2
+    assert traversal['assessment_item_comparisons'] == 4
+    assert traversal['nodes_emitted'] == 0
+    assert stats.phases['detach']['nodes_copied'] == 0
+
+
+def test_treediff_stats_subtree_hashes(sample_tree):
+    treeB = changed_tree(sample_tree)
+    stats = DiffStats()
+    treediff(sample_tree, treeB, stats=stats)
+    assert 'subtree_hashes' not in stats.phases
+    stats = DiffStats()
+    treediff(sample_tree, treeB, stats=stats, skip_unchanged=True)
+    assert list(stats.phases)[0] == 'subtree_hashes'
@@ -0,0 +1,91 @@
+import copy
+import io
+import json
+import logging
+import pytest
+
+# SUT
+from treediffer.streaming import DiffEvent, iter_treediff, write_jsonl
+from treediffer.treediffs import treediff
+
+
+def collect(events):
+    diff = {'nodes_deleted': [], 'nodes_added': [], 'nodes_moved': [], 'nodes_modified': []}
+    for event in events:
+        assert isinstance(event, DiffEvent)
+        diff['nodes_' + event.change].append(event.node)
+    return diff
+
+
+def node_ids(nodes):
+    return sorted((node.get('old_node_id'), node.get('node_id')) for node in nodes)
+
+
+
+@pytest.fixture
+def tree_with_moves(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    t1, t2, t3 = modified_tree['children']
+    # move T1_nid3 to be child of Topic 3
+    n3 = t1['children'].pop()
+    n3['node_id'] += '__new'
+    t3['children'].append(n3)
+    # move Subtopic 23 to be child of Topic 31
+    t23 = t2['children'].pop()
+    t23['node_id'] += '__new'
+    t3['children'][0]['children'].append(t23)
+    return modified_tree
+
+
+
+# STREAMING DIFFS
+################################################################################
+
+def test_iter_treediff_same_as_simplified(sample_tree):
+    treeB = copy.deepcopy(sample_tree)
+    treeB['children'][0]['title'] = 'Modified title'
+    treeB['children'][1]['children'].pop(0)
+    new_node = copy.deepcopy(treeB['children'][2]['children'][0])
+    new_node['node_id'] = 'T32'
+    new_node['content_id'] = 'T32_cid'
+    treeB['children'][2]['children'].append(new_node)
+    simplified_diff = treediff(sample_tree, treeB, format="simplified")
+    streamed_diff = collect(iter_treediff(sample_tree, treeB))
+    for key in ['nodes_deleted', 'nodes_added', 'nodes_moved', 'nodes_modified']:
+        assert node_ids(streamed_diff[key]) == node_ids(simplified_diff[key])
+    assert streamed_diff['nodes_modified'] == simplified_diff['nodes_modified']
+
+
+def test_iter_treediff_moves(sample_tree, tree_with_moves):
+    for sort_order_changes in [False, True]:
+        simplified_diff = treediff(sample_tree, tree_with_moves,
+                                   sort_order_changes=sort_order_changes)
+        streamed_diff = collect(iter_treediff(sample_tree, tree_with_moves,
+                                              sort_order_changes=sort_order_changes))
+        assert len(streamed_diff['nodes_moved']) == 5
+        for key in ['nodes_deleted', 'nodes_added', 'nodes_moved']:
+            assert node_ids(streamed_diff[key]) == node_ids(simplified_diff[key])
+
+
+def test_iter_treediff_full_buffer(sample_tree, tree_with_moves, caplog):
+    with caplog.at_level(logging.WARNING, logger='treediffs'):
+        streamed_diff = collect(iter_treediff(sample_tree, tree_with_moves, max_buffer=0))
+    assert 'Move buffer full' in caplog.text
+    assert streamed_diff['nodes_moved'] == []
+    assert len(streamed_diff['nodes_deleted']) == 5
+    assert len(streamed_diff['nodes_added']) == 5
+
+
+def test_write_jsonl(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['title'] = 'Modified title'
+    modified_tree['children'].pop()
+    outfile = io.StringIO()
+    count = write_jsonl(iter_treediff(sample_tree, modified_tree), outfile)
+    lines = outfile.getvalue().splitlines()
+    assert count == len(lines)
+    events = [json.loads(line) for line in lines]
+    modified = [event['node']['node_id'] for event in events if event['change'] == 'modified']
+    assert modified == ['T1']
+    deleted = [event['node']['old_node_id'] for event in events if event['change'] == 'deleted']
+    assert 'T3' in deleted and len(deleted) == count - 1
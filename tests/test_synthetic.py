@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+# SUT
+from treediffer.synthetic import TreeGenerator, diff_node_ids
+from treediffer.treediffs import treediff
+
+
+
+# SYNTHETIC TREES
+################################################################################
+
+@pytest.mark.parametrize('preset', [None, 'ricecooker', 'studio', 'kolibri'])
+def test_generated_tree(preset, caplog):
+    generator = TreeGenerator(200, preset=preset, seed=3, width=5)
+    tree = generator.build()
+    assert tree == TreeGenerator(200, preset=preset, seed=3, width=5).build()
+    outfile = io.StringIO()
+    generator.write_json(outfile)
+    assert json.loads(outfile.getvalue()) == tree
+    nodes, stack = [], [tree]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get('children', []))
+    assert len(nodes) == 200
+    assert len(tree['children']) == 5
+    exercises = [node for node in nodes if node.get('kind') == 'exercise']
+    assert exercises
+    if preset == 'kolibri':
+        assert all('assessment_item_ids' in node for node in exercises)
+    else:
+        assessment_items_key = 'questions' if preset == 'ricecooker' else 'assessment_items'
+        assert all(node[assessment_items_key] for node in exercises)
+    # no warnings about missing attributes
+    assert treediff(tree, tree, preset=preset, format='summary')['nodes_modified']['count'] == 0
+    assert not caplog.records
+
+
+@pytest.mark.parametrize('preset', [None, 'ricecooker', 'studio', 'kolibri'])
+def test_mutated_tree(preset):
+    for seed in range(5):
+        generator = TreeGenerator(300, preset=preset, seed=seed, width=4 + seed)
+        mutated = generator.mutate(seed=seed, renames=5, moves=3, reorders=3, deletions=2,
+                                   clones=2, question_edits=3)
+        expected = mutated.expected
+        assert expected['nodes_deleted'] and expected['nodes_added'] and expected['nodes_moved']
+        diff = treediff(generator.build(), mutated.build(), preset=preset)
+        assert diff_node_ids(diff) == expected
+
+
+def test_mutated_tree_deletion_depth():
+    generator = TreeGenerator(300, preset='studio', width=3)
+    mutated = generator.mutate(seed=1, deletions=2, deletion_depth=2)
+    assert len(mutated.mutation.deleted) == 2
+    assert all(generator.depth(k) == 2 for k in mutated.mutation.deleted)
+    diff = treediff(generator.build(), mutated.build(), preset='studio')
+    assert diff_node_ids(diff) == mutated.expected
+    with pytest.raises(ValueError):
+        mutated.mutate(seed=2, renames=1)
@@ -6,6 +6,8 @@ from treediffer.diffutils import findby, print_diff
 
 # SUT
 from treediffer.treediffs import treediff
+from treediffer.treediffs import detect_moves, restructure_diff
+from treediffer.diffutils import TreeIndex
 
 
 
@@ -106,6 +108,30 @@ def test_difftree_removal_restructured(sample_tree, sample_tree_with_removals):
     assert len(t311['children']) == 3
 
 
+def test_restructure_diff_partial_subtree(sample_tree):
+    # T2 and T21 subtree are in the diff, but T22 and T23 subtrees are not
+    t2 = sample_tree['children'][1]
+    t21 = t2['children'][0]
+    nodes_deleted = [dict(old_node_id=n['node_id'], old_parent_id=p) for n, p in [
+        (t2, '0000000'),
+        (t21, 'T2'),
+        (t21['children'][0], 'T21'),
+        (t21['children'][1], 'T21'),
+        (t21['children'][2], 'T21'),
+    ]]
+    simplified_diff = dict(nodes_deleted=nodes_deleted, nodes_added=[], nodes_moved=[], nodes_modified=[])
+    indexA = TreeIndex(sample_tree)
+
+    restructured_diff = restructure_diff(simplified_diff, sample_tree, sample_tree, indexA=indexA)
+
+    nodes_deleted = restructured_diff['nodes_deleted']
+    assert [nd['old_node_id'] for nd in nodes_deleted] == ['T2', 'T21']
+    assert 'children' not in nodes_deleted[0]
+    t21_children_ids = [nd['old_node_id'] for nd in nodes_deleted[1]['children']]
+    assert t21_children_ids == ['T21_nid1', 'T21_nid2', 'T21_nid3']
+
+
+
 # ADD AND RM AFTER RESTRUCTURING
 ################################################################################
 
@@ -193,6 +219,34 @@ def test_treediff_with_moves_restructured(sample_tree, sample_tree_with_moves):
 
 
 
+def test_detect_moves_ambiguous(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    t1 = modified_tree['children'][0]
+    t3 = modified_tree['children'][2]
+
+    # move T1_nid1 to Topic 3 and also add a second copy of it there
+    n1 = t1['children'].pop(0)
+    n1['node_id'] += '__new'
+    n1_copy = copy.deepcopy(n1)
+    n1_copy['node_id'] += '__copy'
+    t3['children'].extend([n1, n1_copy])
+
+    raw_diff = treediff(sample_tree, modified_tree, format="raw")
+    ambiguous_moves = []
+    nodes_moved = detect_moves(raw_diff['nodes_deleted'], raw_diff['nodes_added'],
+                               ambiguous_moves=ambiguous_moves)
+
+    moved_ids = [nm['node_id'] for nm in nodes_moved]
+    assert 'T1_nid1__new' in moved_ids
+    assert 'T1_nid1__new__copy' in moved_ids
+    assert len(ambiguous_moves) == 1
+    report = ambiguous_moves[0]
+    assert report['content_id'] == 'T1_cid1'
+    assert report['old_node_ids'] == ['T1_nid1']
+    assert report['node_ids'] == ['T1_nid1__new', 'T1_nid1__new__copy']
+
+
+
 # MOVES INVOLVING REOERDERING
 ################################################################################
 
@@ -309,3 +363,120 @@ def test_treediff_large_kolibri_tree_modify(large_kolibri_tree):
     nodes_modified = raw_diff['nodes_modified']
     assert(len(nodes_modified)) == 1
 
+
+
+
+# SUMMARY
+################################################################################
+
+def test_treediff_summary_with_moves(sample_tree, sample_tree_with_moves):
+    summary = treediff(sample_tree, sample_tree_with_moves, format="summary")
+    assert summary['nodes_added'] == {'count': 0, 'by_kind': {}}
+    assert summary['nodes_deleted'] == {'count': 0, 'by_kind': {}}
+    assert summary['nodes_moved'] == {'count': 5, 'by_kind': {None: 5}}
+    assert summary['nodes_modified']['count'] == 0
+
+
+def test_treediff_summary_counts(sample_tree, sample_tree_add_and_rm):
+    treeA = copy.deepcopy(sample_tree)
+    treeB = copy.deepcopy(sample_tree_add_and_rm)
+    for tree in [treeA, treeB]:
+        for topic in tree['children']:
+            topic['kind'] = 'topic'
+    treeB['children'][0]['title'] = 'Modified title'
+    treeB['children'][0]['tags'] = ['newtag']
+    treeB['children'][2]['description'] = 'Modified description'
+
+    simplified_diff = treediff(treeA, treeB, format="simplified")
+    summary = treediff(treeA, treeB, format="summary")
+    for key in ['nodes_added', 'nodes_deleted', 'nodes_moved', 'nodes_modified']:
+        assert summary[key]['count'] == len(simplified_diff[key])
+    assert summary['nodes_modified']['by_kind'] == {'topic': 2}
+    assert summary['nodes_modified']['by_attribute'] == {'title': 1, 'tags': 1, 'description': 1}
+
+
+def test_treediff_summary_by_kind_excluded(sample_tree):
+    # the studio preset excludes `kind` from the diffed attributes
+    treeA = copy.deepcopy(sample_tree)
+    treeA['id'], treeA['source_id'] = treeA['node_id'], treeA['content_id']
+    for topic in treeA['children']:
+        topic['kind'] = 'topic'
+    treeB = copy.deepcopy(treeA)
+    treeB['children'][0]['title'] = 'Modified title'
+    treeB['children'][0]['children'][0]['title'] = 'Modified title'
+
+    summary = treediff(treeA, treeB, preset="studio", format="summary")
+    assert summary['nodes_modified']['count'] == 2
+    assert summary['nodes_modified']['by_kind'] == {'topic': 1, None: 1}
+
+
+
+# DETACHED OUTPUT
+################################################################################
+
+def test_treediff_shares_values_by_default(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'].pop()
+
+    diff = treediff(sample_tree, modified_tree, format="simplified")
+
+    t3 = findby(diff['nodes_deleted'], {"old_node_id": 'T3'}, by="old_node_id")
+    assert t3['attributes']['description']['value'] is sample_tree['children'][2]['description']
+    assert 'children' not in t3['attributes']
+
+
+def test_treediff_detached(sample_tree):
+    modified_tree = copy.deepcopy(sample_tree)
+    modified_tree['children'][0]['tags'] = ['tag1']
+    modified_tree['children'].pop()
+
+    diff = treediff(sample_tree, modified_tree, format="restructured", detached=True)
+
+    t1 = findby(diff['nodes_modified'], {"node_id": 'T1'}, by="node_id")
+    t1['attributes']['tags']['value'].append('tag2')
+    assert modified_tree['children'][0]['tags'] == ['tag1']
+    t3 = findby(diff['nodes_deleted'], {"old_node_id": 'T3'}, by="old_node_id")
+    assert t3['attributes']['title']['value'] == 'Topic T3'
+
+
+
+# DEEP TREES
+################################################################################
+
+def get_chain_tree(length, prefix='c'):
+    """
+    Returns a tree with `length` nested topics (a.k.a. a chain of topics).
+    """
+    root = {"node_id": prefix, "content_id": prefix + "_cid", "title": "Chain topic", "children": []}
+    node = root
+    for i in range(length):
+        child = {"node_id": prefix + str(i), "content_id": prefix + str(i) + "_cid", "title": "Chain topic " + str(i)}
+        node['children'] = [child]
+        node = child
+    return root
+
+
+def test_treediff_deep_tree():
+    treeA = get_chain_tree(5000)
+    treeB = get_chain_tree(5000)
+    # modify the deepest node and add a deep subtree below it
+    deepest = treeB
+    while deepest.get('children'):
+        deepest = deepest['children'][0]
+    deepest['title'] = 'Modified title'
+    deepest['children'] = [get_chain_tree(3000, prefix='new')]
+    treeA_deepest = treeA
+    while treeA_deepest.get('children'):
+        treeA_deepest = treeA_deepest['children'][0]
+    treeA_deepest['children'] = []
+
+    restructured_diff = treediff(treeA, treeB, format="restructured")
+
+    assert len(restructured_diff['nodes_deleted']) == 0
+    assert len(restructured_diff['nodes_moved']) == 0
+    nodes_modified = restructured_diff['nodes_modified']
+    assert len(nodes_modified) == 1
+    assert nodes_modified[0]['node_id'] == 'c4999'
+    nodes_added = restructured_diff['nodes_added']
+    assert len(nodes_added) == 1
+    assert nodes_added[0]['node_id'] == 'new'